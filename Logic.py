@@ -10,37 +10,44 @@ Logic.py
 #this comment by Shams
 from datetime import date
 
-# حالياً نستخدم إيجنت العمرة فقط
 from agent.UmrahAgent import UmrahAgent
-# مستقبلاً:
-# from agent.HajjExAgent import HajjExAgent
-# from agent.HajjLoAgent import HajjLoAgent
+from agent.HajjExAgent import HajjExAgent
+from agent.HajjLoAgent import HajjLoAgent
+from agent.user_type_router import route_user_type
 
 
 # =========================
 # دالة اختيار الإيجنت المناسب
 # =========================
+# مفتاح التوجيه (من agent/user_type_router.py) → كلاس الإيجنت
+AGENTS = {
+    "umrah": UmrahAgent,
+    "hajj_ex": HajjExAgent,
+    "hajj_lo": HajjLoAgent,
+}
+
+# نسخة وحدة من كل إيجنت (الإيجنتات ما تحفظ حالة خاصة بالطلب)
+_agent_instances = {}
+
+
 def get_agent_for_user(user_type: str):
     
    # تختار الإيجنت المناسب حسب نوع المستخدم.
     #هذه العملية داخلية، ما تظهر للمستخدم.
-    
-
-    normalized = (user_type or "").strip().lower()
-
-    # كل ما له علاقة بالعمرة يروح لإيجنت العمرة
-    if "عمره" in normalized or "عمرة" in normalized or "وكيل" in normalized or "خارجي" in normalized or "umrah" in normalized or "external" in normalized:
-        return UmrahAgent()
-
-    # مثال مستقبلي:
-    # if "حج" in normalized and "خارج" in normalized:
-    #     return HajjExAgent()
-    #
-    # if "حج" in normalized and " in normalized:
-    #     return HajjLoAgent()
+    # جدول التوجيه مطبّع ومترجم مرة وحدة، والنتيجة محفوظة لكل نص نوع مستخدم
+    key = route_user_type(user_type)
 
     # لو ما لقينا إيجنت مناسب نرجّع None
-    return None
+    if key is None:
+        return None
+
+    agent = _agent_instances.get(key)
+    if agent is None or agent.collection is None:
+        # إيجنت ما قدر يتصل بمونقو (مثلاً وقت التشغيل) ما ينحفظ، نعيد المحاولة بالطلب الجاي
+        agent = AGENTS[key]()
+        if agent.collection is not None:
+            _agent_instances[key] = agent
+    return agent
 
 
 # ==============
@@ -53,7 +60,7 @@ def main():
 
     # -------- المدخلات من الموظف --------
     client_name = input("اسم العميل : ")
-    user_type = input("نوع المستخدم (شركة عمرة / وكيل خارجي / مقدم خدمة) : ")
+    user_type = input("نوع المستخدم (شركة عمرة / وكيل خارجي / حج خارجي / حج داخلي) : ")
     issue_description = input("وصف المشكلة : ")
 
     # -------- اختيار الإيجنت داخلياً --------
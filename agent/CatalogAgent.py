@@ -0,0 +1,155 @@
+import logging
+
+from .SmartAgent import SmartAgent
+from .mongo_helper import get_collection, COLLECTION_NAME
+from .case_index import get_case_index, MATCH_TIERS, RANKING, RANKING_MODES
+from .text_normalizer import normalize_query
+from .stage_timer import current_timer, INDEX, PREPROCESS, SCORE, SORT
+from .user_type_router import route_user_type
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogAgent(SmartAgent):
+    """
+    Base agent that answers from one user-type partition of a cases collection.
+
+    Subclasses declare where their cases live and their route key. A case
+    belongs to the agent its UserType routes to (agent/user_type_router.py),
+    so the partitions and the request routing share one table; cases that
+    route to no agent (no or unknown UserType) go to the catch-all agent of
+    their collection (UmrahAgent, or a Hajj agent in its own collection).
+    Each partition gets its own in-memory index, so adding cases for one
+    agent never slows down the others.
+    """
+
+    # مفتاح التوجيه في agent/user_type_router.py
+    route_key = None
+    # المجموعة اللي فيها الحالات
+    collection_name = COLLECTION_NAME
+    # هل الحالات اللي UserType حقها ما يوصل لأي إيجنت (فاضي أو غير معروف) تتبع هذا الإيجنت؟
+    owns_unrouted_cases = False
+
+    def __init__(self):
+        super().__init__()
+        try:
+            # Connect to MongoDB collection
+            self.collection = get_collection(self.collection_name)
+            self.data_source_error = None
+        except Exception as e:
+            self.collection = None
+            self.data_source_error = e
+            self.log_error(e)
+
+        # طبقات المطابقة: "prefix" (أول 3 حروف) و/أو "fuzzy" (أخطاء إملائية)
+        self.match_tiers = MATCH_TIERS
+        # طريقة الترتيب: "keywords" (نقاط الكلمات) أو "bm25"
+        self.ranking = RANKING
+
+    def is_supported_user(self, user_type: str) -> bool:
+        return route_user_type(user_type) == self.route_key
+
+    @property
+    def partition_key(self) -> str:
+        return type(self).__name__
+
+    @classmethod
+    def owns_case(cls, case: dict) -> bool:
+        """Does this case belong to this agent's partition (by where its UserType routes)?"""
+        user_type = case.get("UserType")
+        key = route_user_type(user_type) if isinstance(user_type, str) else None
+        if key is None:
+            return cls.owns_unrouted_cases
+        return key == cls.route_key
+
+    def get_index(self):
+        if self.collection is None:
+            return None
+        return get_case_index(self.collection, self.partition_key, self.owns_case)
+
+    def find_best_row(self, issue_text: str, ranking=None):
+        """
+        Find the best matching case for the given issue text.
+        Returns: (best_case_dict, status_message)
+        """
+        matches = self.find_all_matches(issue_text, ranking=ranking)
+        if matches:
+            return matches[0], self.message("success")
+        return None, self.message("no_match")
+
+    def find_all_matches(self, issue_text: str, limit=5, tiers=None, ranking=None):
+        """
+        Find all matching cases ranked by score.
+        tiers: matching tiers to use (defaults to self.match_tiers)
+        ranking: "keywords" or "bm25" (defaults to self.ranking)
+        Returns: list of matching cases sorted by score (highest first)
+        """
+        if not ranking:
+            ranking = self.ranking
+        elif ranking not in RANKING_MODES:
+            raise ValueError(f"ranking must be one of {', '.join(RANKING_MODES)}")
+        if self.collection is None:
+            logger.debug("Collection is None")
+            return []
+
+        timer = current_timer()
+        try:
+            # الفهرس مبني مرة وحدة لكل نسخة من الكتالوج (الكلمات مطبّعة مسبقاً)
+            index = self.get_index()
+            timer.lap(INDEX)
+            if index is None or not len(index):
+                return []
+
+            # التطبيع محفوظ (lru)، فاستدعاء score() بعده ما يعيده
+            normalize_query(issue_text)
+            timer.lap(PREPROCESS)
+            results = index.score(issue_text, tiers or self.match_tiers, ranking)
+            timer.lap(SCORE)
+
+            scored_cases = []
+            for pos, score, matched_main in results:
+                # نسخة من الحالة عشان ما نعدل على الكاش
+                case = dict(index.cases[pos])
+                case["MatchScore"] = score
+
+                # Calculate match ratio for tie-breaking (share of main keywords actually matched,
+                # not derived from the score so extra keywords don't inflate it)
+                total_keywords = index.main_counts[pos]
+                case["MatchRatio"] = matched_main / total_keywords if total_keywords > 0 else 0
+                scored_cases.append(case)
+
+            # Sort by score first, then by match ratio (prefer cases with higher % of keywords matched)
+            scored_cases.sort(key=lambda x: (x["MatchScore"], x["MatchRatio"]), reverse=True)
+            timer.lap(SORT)
+            logger.debug(f"'{issue_text}': {len(scored_cases)} matching cases out of {len(index)}")
+            return scored_cases[:limit]
+
+        except Exception as e:
+            self.log_error(e)
+            return []
+
+    def find_semantic_row(self, issue_text: str):
+        """
+        Fallback when keyword matching finds nothing: nearest case by
+        hashed n-gram similarity over Category/SubCategory/ResponseText.
+        Returns: (case_dict, status_message)
+        """
+        if self.collection is None:
+            return None, self.message("no_match")
+
+        try:
+            index = self.get_index()
+            results = index.search_semantic(issue_text, limit=1) if index is not None else []
+            if not results:
+                return None, self.message("no_match")
+
+            pos, similarity = results[0]
+            case = dict(index.cases[pos])
+            case["MatchScore"] = round(similarity, 4)
+            case["MatchRatio"] = 0
+            case["MatchType"] = "semantic"
+            return case, self.message("semantic")
+
+        except Exception as e:
+            self.log_error(e)
+            return None, self.message("no_match")
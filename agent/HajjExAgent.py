@@ -0,0 +1,12 @@
+import os
+
+from .CatalogAgent import CatalogAgent
+from .mongo_helper import COLLECTION_NAME
+
+
+class HajjExAgent(CatalogAgent):
+    route_key = "hajj_ex"
+    # حالات حجاج الخارج (نفس مجموعة الحالات افتراضياً، مفصولة بـ UserType)
+    collection_name = os.getenv("MONGO_HAJJ_EX_COLLECTION", COLLECTION_NAME)
+    # في مجموعة خاصة فيه، الحالات اللي ما لها إيجنت (بدون UserType) تتبعه
+    owns_unrouted_cases = collection_name != COLLECTION_NAME
@@ -1,32 +1,30 @@
-import re
 import datetime
 import traceback
 import os
-import smtplib
-from email.mime.text import MIMEText
-from collections import Counter
+
+from .alert_dispatcher import get_alert_dispatcher
+from .error_stats import get_error_stats
+from .metrics import AGENT_ERRORS
+from .text_normalizer import normalize_text
 
 
 class SmartAgent:
     def __init__(self):
         # ملف اللوق
         self.log_file = "agent_logs.txt"
+        # ملف التجميعات اليومية للأخطاء (يتحدث تدريجياً من اللوق)
+        self.stats_file = "agent_error_stats.json"
 
         # إعدادات التنبيه 
-        self.alert_email = ""  # إيميل التنبيهات (لسا ماسويته)
+        self.alert_email = os.environ.get("CALLHELPER_ALERT_EMAIL", "")  # إيميل التنبيهات
         self.alert_threshold = 3  # لو نفس الخطأ تكرر 3 مرات في نفس اليوم → تنبيه
 
         # نقرأ باسورد التطبيق من متغير بيئة، ما نحطه هارد كود
         self.email_password = os.environ.get("CALLHELPER_APP_PASSWORD", "")
 
-    #  تنظيف النص
+    #  تنظيف النص (نفس التطبيع المستخدم لفهرسة الكلمات المفتاحية)
     def preprocess(self, text: str) -> str:
-        if not text:
-            return ""
-        text = text.strip().lower()
-        text = re.sub(r"[^\w\s\u0600-\u06FF]", " ", text)
-        text = re.sub(r"\s+", " ", text)
-        return text
+        return normalize_text(text)
 
     #  رسائل رفيق الموحدة
     def message(self, key: str) -> str:
@@ -34,6 +32,7 @@ class SmartAgent:
             "missing": "الوصف غير مكتمل، أضف تفاصيل أكثر ",
             "invalid": "التنسيق غير واضح، حاول تكتبه بطريقة أوضح.",
             "no_match": "ما قدرت أحدد الحالة بدقة، ممكن توضح المشكلة بكلمات ثانية؟",
+            "semantic": "ما لقيت تطابق مباشر بالكلمات المفتاحية، هذي أقرب حالة ممكن تفيدك.",
             "error": "حدث خطأ غير متوقع وتم تسجيله للمراجعة",
             "success": "تمت معالجة الطلب بنجاح ",
             "processing": "جاري تحليل المدخلات. لحظة "
@@ -57,104 +56,68 @@ class SmartAgent:
             now = datetime.datetime.now()
             date_today = now.strftime("%Y-%m-%d")
             error_type = type(error).__name__
+            AGENT_ERRORS.labels(error_type).inc()
 
             # نكتب في ملف اللوق
             with open(self.log_file, "a", encoding="utf-8") as f:
                 f.write(f"[{now}] {error_type}: {error}\n")
                 f.write("-" * 60 + "\n")
 
-            # نحسب تكرار الأخطاء من نفس النوع اليوم
-            with open(self.log_file, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-
-            errors_today = [
-                line for line in lines
-                if line.startswith("[") and date_today in line
-            ]
-
-            types_today = []
-            for line in errors_today:
-                # مثال سطر: [2025-11-11 22:10:01.123456] ValueError: message
-                try:
-                    after_time = line.split("]", 1)[1].strip()
-                    etype = after_time.split(":", 1)[0].strip().split()[0]
-                    types_today.append(etype)
-                except Exception:
-                    continue
-
-            count = Counter(types_today)[error_type]
-
-            # لو تخطى الحد و التنبيهات مفعّلة و فيه إعدادات إيميل → نرسل تنبيه
-            if (
-                enable_alert
-                and self.alert_email
-                and self.email_password
-                and count >= self.alert_threshold
-            ):
+            # نحسب تكرار الأخطاء من نفس النوع اليوم (من التجميعات، بدون ما نقرأ اللوق كامل)
+            count = self.error_stats().refresh().count(date_today, error_type)
+
+            # لو تخطى الحد و التنبيهات مفعّلة → نحط التنبيه في الطابور (الإرسال يصير بالخلفية)
+            if enable_alert and count >= self.alert_threshold:
                 self.send_email_alert(error_type, count)
 
         except Exception:
             # ما نرمي خطأ جديد لو تسجيل اللوق نفسه فشل
             pass
 
-    #  إرسال تنبيه بالإيميل (ما يستدعي log_error عشان ما ندخل حلقة)
+    #  إرسال تنبيه (ما يستدعي log_error عشان ما ندخل حلقة)
     def send_email_alert(self, error_type: str, count: int):
+        """
+        ما يرسل مباشرة: يحط التنبيه في طابور AlertDispatcher اللي يجمع
+        التنبيهات المتكررة لنفس النوع ويحدد معدل الإرسال في خيط بالخلفية.
+        """
         try:
-            msg = MIMEText(
-                f"تنبيه \n\n"
-                f"تم تكرار الخطأ من النوع: {error_type} عدد {count} مرات اليوم.\n"
-                f"يرجى مراجعة نظام Smart Call Helper / SmartAgent.\n"
-            )
-            msg["Subject"] = f" تنبيه تكرار خطأ: {error_type}"
-            msg["From"] = self.alert_email
-            msg["To"] = self.alert_email
-
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-                server.login(self.alert_email, self.email_password)
-                server.send_message(msg)
-
+            dispatcher = get_alert_dispatcher(self.alert_email, self.email_password)
+            if dispatcher is not None:
+                dispatcher.submit(error_type, count)
         except Exception:
-            # لو فشل الإرسال، نتجاهل هنا (ما نستدعي log_error عشان ما يصير تنبيه على التنبيه)
+            # لو فشل، نتجاهل هنا (ما نستدعي log_error عشان ما يصير تنبيه على التنبيه)
             pass
 
+    #  التجميعات اليومية للأخطاء
+    def error_stats(self):
+        return get_error_stats(self.log_file, self.stats_file)
+
+    #  تقرير الأخطاء كصفوف (للـ API)
+    def get_error_report(self, days: int = 7):
+        """
+        يرجع عدد الأخطاء لكل يوم ولكل نوع خطأ لآخر `days` يوم.
+        يعتمد على التجميعات اليومية، فالتكلفة على عدد الأيام مو حجم اللوق.
+        """
+        return self.error_stats().refresh().report(days)
+
     #  توليد تقرير أسبوعي CSV من اللوق
     def generate_weekly_report(self, days: int = 7):
         """
-        يقرأ ملف اللوق ويطلع تقرير بعدد الأخطاء لكل يوم ولكل نوع خطأ.
+        يطلع تقرير بعدد الأخطاء لكل يوم ولكل نوع خطأ من التجميعات اليومية.
         يحفظه في ملف: agent_error_report.csv
         """
         if not os.path.exists(self.log_file):
             return "ما فيه سجل أخطاء حتى الآن."
 
         try:
-            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
-            summary = {}  # {(date, error_type): count}
-
-            with open(self.log_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    if not line.startswith("["):
-                        continue
-                    try:
-                        timestamp_str, rest = line.split("]", 1)
-                        timestamp_str = timestamp_str.strip("[")
-                        dt = datetime.datetime.fromisoformat(timestamp_str)
-                        if dt < cutoff_date:
-                            continue
-
-                        after_time = rest.strip()
-                        error_type = after_time.split(":", 1)[0].strip().split()[0]
-
-                        key = (dt.date().isoformat(), error_type)
-                        summary[key] = summary.get(key, 0) + 1
-                    except Exception:
-                        continue
+            rows = self.get_error_report(days)
 
             # نكتب التقرير في CSV بسيط
             report_file = "agent_error_report.csv"
             with open(report_file, "w", encoding="utf-8") as f:
                 f.write("date,error_type,count\n")
-                for (date_str, etype), cnt in sorted(summary.items()):
-                    f.write(f"{date_str},{etype},{cnt}\n")
+                for row in rows:
+                    f.write(f"{row['date']},{row['error_type']},{row['count']}\n")
 
             return f"تم إنشاء تقرير الأخطاء في {report_file}"
 
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+agent/alert_dispatcher.py
+Background dispatcher for SmartAgent error alerts.
+
+Alerts are queued from the request thread and delivered by a single daemon
+thread. Repeated alerts for the same error type are aggregated over a time
+window, and deliveries are rate limited with a token bucket so a burst of
+errors never turns into a burst of SMTP handshakes.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import smtplib
+import logging
+import threading
+from datetime import datetime
+from email.mime.text import MIMEText
+from typing import Dict, Optional
+
+from .metrics import ALERTS
+
+logger = logging.getLogger(__name__)
+
+# Configuration with environment variable support
+ALERT_TRANSPORT = os.getenv("CALLHELPER_ALERT_TRANSPORT", "smtp")  # "smtp" or "file"
+ALERT_FILE = os.getenv("CALLHELPER_ALERT_FILE", "agent_alerts.jsonl")
+ALERT_WINDOW_SECONDS = float(os.getenv("CALLHELPER_ALERT_WINDOW_SECONDS", "300"))
+ALERT_RATE_PER_HOUR = float(os.getenv("CALLHELPER_ALERT_RATE_PER_HOUR", "10"))
+ALERT_BURST = int(os.getenv("CALLHELPER_ALERT_BURST", "3"))
+ALERT_QUEUE_SIZE = int(os.getenv("CALLHELPER_ALERT_QUEUE_SIZE", "1000"))
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def try_take(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class SmtpTransport:
+    """Send alerts by email through an SMTP_SSL server (Gmail by default)."""
+
+    def __init__(self, sender: str, password: str, host: str = "smtp.gmail.com", port: int = 465):
+        self.sender = sender
+        self.password = password
+        self.host = host
+        self.port = port
+
+    def send(self, subject: str, body: str):
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["From"] = self.sender
+        msg["To"] = self.sender
+
+        with smtplib.SMTP_SSL(self.host, self.port, timeout=10) as server:
+            server.login(self.sender, self.password)
+            server.send_message(msg)
+
+
+class FileTransport:
+    """Append alerts as JSON lines to a local file (for tests and local runs)."""
+
+    def __init__(self, path: str = ALERT_FILE):
+        self.path = path
+
+    def send(self, subject: str, body: str):
+        entry = {"timestamp": datetime.now().isoformat(), "subject": subject, "body": body}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class AlertDispatcher:
+    """
+    Queue alerts and deliver them from a background thread.
+
+    submit() never blocks: if the queue is full the alert is dropped. Alerts
+    for the same error type are merged until `window_seconds` have passed
+    since the first one, then sent as a single message if the token bucket
+    allows it (otherwise they stay pending until a token is available).
+    At shutdown, close() skips the window but not the token bucket.
+    """
+
+    def __init__(
+        self,
+        transport,
+        window_seconds: float = ALERT_WINDOW_SECONDS,
+        rate_per_hour: float = ALERT_RATE_PER_HOUR,
+        burst: int = ALERT_BURST,
+        max_queue: int = ALERT_QUEUE_SIZE,
+    ):
+        self.transport = transport
+        self.window_seconds = window_seconds
+        self.bucket = TokenBucket(rate_per_hour / 3600.0, burst)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.pending: Dict[str, dict] = {}
+        self.dropped = 0
+        self.sent = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # يحمي pending و bucket (الخيط و close() ممكن يوصلونها مع بعض)
+        self._pending_lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="callhelper-alerts", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, error_type: str, count: int) -> bool:
+        """Queue an alert without blocking. Returns False if it was dropped."""
+        self.start()
+        try:
+            self.queue.put_nowait((error_type, count, time.monotonic()))
+            ALERTS.labels("queued").inc()
+            return True
+        except queue.Full:
+            self.dropped += 1
+            ALERTS.labels("dropped").inc()
+            return False
+
+    def depth(self) -> int:
+        """Alerts queued or waiting in the aggregation window."""
+        return self.queue.qsize() + len(self.pending)
+
+    def close(self, timeout: float = 5.0):
+        """Stop the worker and deliver what is pending, without waiting for the window."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                # الخيط لسه يرسل: نخليه يكمل وما نرسل من خيطين
+                logger.warning(f"Alert dispatcher still busy after {timeout}s; "
+                               f"{self.depth()} alerts left undelivered")
+                return
+        self._drain()
+        self._flush(ignore_window=True)
+        if self.pending:
+            logger.warning(f"{len(self.pending)} alerts left undelivered at shutdown (rate limit)")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                item = self.queue.get(timeout=1.0)
+                self._add(*item)
+            except queue.Empty:
+                pass
+            self._drain()
+            self._flush()
+
+    def _drain(self):
+        while True:
+            try:
+                self._add(*self.queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _add(self, error_type: str, count: int, at: float):
+        with self._pending_lock:
+            entry = self.pending.get(error_type)
+            if entry is None:
+                self.pending[error_type] = {"first": at, "count": count, "occurrences": 1}
+            else:
+                entry["count"] = max(entry["count"], count)
+                entry["occurrences"] += 1
+
+    def _flush(self, ignore_window: bool = False):
+        now = time.monotonic()
+        due = []
+        with self._pending_lock:
+            for error_type in list(self.pending):
+                entry = self.pending[error_type]
+                if not ignore_window and now - entry["first"] < self.window_seconds:
+                    continue
+                if not self.bucket.try_take(now):
+                    continue
+                due.append((error_type, self.pending.pop(error_type)))
+        # الإرسال برا القفل (SMTP بطيء)
+        for error_type, entry in due:
+            self._deliver(error_type, entry)
+
+    def _deliver(self, error_type: str, entry: dict):
+        subject = f" تنبيه تكرار خطأ: {error_type}"
+        body = (
+            f"تنبيه \n\n"
+            f"تم تكرار الخطأ من النوع: {error_type} عدد {entry['count']} مرات اليوم.\n"
+            f"عدد التنبيهات المجمّعة: {entry['occurrences']}\n"
+            f"يرجى مراجعة نظام Smart Call Helper / SmartAgent.\n"
+        )
+        try:
+            self.transport.send(subject, body)
+            self.sent += 1
+            ALERTS.labels("sent").inc()
+        except Exception as e:
+            ALERTS.labels("failed").inc()
+            # ما نستدعي log_error هنا عشان ما يصير تنبيه على التنبيه
+            logger.error(f"Failed to deliver alert for {error_type}: {e}")
+
+
+_dispatcher: Optional[AlertDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_alert_dispatcher(sender: str = "", password: str = "") -> Optional[AlertDispatcher]:
+    """
+    Return the process-wide dispatcher, creating it on first use.
+    Returns None when the configured transport has no credentials.
+    """
+    global _dispatcher
+    if _dispatcher is not None:
+        return _dispatcher
+
+    if ALERT_TRANSPORT == "file":
+        transport = FileTransport(ALERT_FILE)
+    elif sender and password:
+        transport = SmtpTransport(sender, password)
+    else:
+        return None
+
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = AlertDispatcher(transport)
+            atexit.register(_dispatcher.close)
+    return _dispatcher
+
+
+def get_alert_queue_depth() -> int:
+    """Depth of the process-wide dispatcher (0 before the first alert)."""
+    return _dispatcher.depth() if _dispatcher is not None else 0
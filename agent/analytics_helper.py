@@ -7,13 +7,163 @@ Tracks all interactions and provides dashboard metrics
 
 from datetime import datetime, timedelta
 from pymongo import MongoClient, DESCENDING
+from pymongo.errors import CollectionInvalid
 import os
+import logging
+import threading
+
+from .latency_sketch import LatencySketch, bin_key
+from .metrics import INTERACTIONS, INTERACTION_LOG_FAILURES
+from .mongo_helper import COMMAND_LISTENERS
+from .heavy_hitters import get_hot_query_tracker
 
 # MongoDB connection
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
-client = MongoClient(MONGO_URI)
+client = MongoClient(MONGO_URI, event_listeners=COMMAND_LISTENERS)
 db = client["callhelper"]
-logs_collection = db["interaction_logs"]
+
+# Storage mode for raw interaction logs:
+#   "events"     - one document per interaction in interaction_logs (default)
+#   "timeseries" - one document per interaction in a MongoDB time-series collection
+#   "bucketed"   - many interactions per document, one bucket per hour
+LOG_STORAGE = os.environ.get("CALLHELPER_LOG_STORAGE", "events")
+# Raw events (timeseries/bucketed modes) are archived after this many days; rollups are kept forever
+LOG_RETENTION_DAYS = int(os.environ.get("CALLHELPER_LOG_RETENTION_DAYS", "90"))
+# TTL deletes raw events this many days after retention, as a safety net behind archiving
+LOG_TTL_GRACE_DAYS = int(os.environ.get("CALLHELPER_LOG_TTL_GRACE_DAYS", "7"))
+BUCKET_MAX_EVENTS = int(os.environ.get("CALLHELPER_LOG_BUCKET_SIZE", "500"))
+
+logs_collection = db["interaction_logs_ts" if LOG_STORAGE == "timeseries" else "interaction_logs"]
+buckets_collection = db["interaction_log_buckets"]
+rollups_collection = db["interaction_log_rollups"]
+# Space-Saving counts of normalized queries per hour (see agent/heavy_hitters.py)
+hot_queries_collection = db["interaction_hot_queries"]
+# The same counts per day, which popular-query reads aggregate
+hot_queries_daily_collection = db["interaction_hot_queries_daily"]
+
+logger = logging.getLogger(__name__)
+
+# The time-series collection must exist before the first insert, or MongoDB
+# creates a regular collection with that name on the fly
+_log_storage_ready = LOG_STORAGE != "timeseries"
+_log_storage_lock = threading.Lock()
+
+
+def log_storage_ready():
+    return _log_storage_ready
+
+
+def ensure_log_storage():
+    """
+    Create the time-series collection (with TTL) when
+    CALLHELPER_LOG_STORAGE=timeseries. Runs once, before the first write;
+    an existing collection that is not time-series is reported, not
+    replaced.
+    """
+    global _log_storage_ready
+    if _log_storage_ready:
+        return
+    with _log_storage_lock:
+        if _log_storage_ready:
+            return
+        retention = LOG_RETENTION_DAYS + LOG_TTL_GRACE_DAYS
+        try:
+            db.create_collection(
+                logs_collection.name,
+                timeseries={"timeField": "timestamp", "metaField": "user_type", "granularity": "hours"},
+                expireAfterSeconds=retention * 86400,
+            )
+        except CollectionInvalid:
+            # موجودة من قبل: نتأكد إنها time-series فعلاً
+            info = next(iter(db.list_collections(filter={"name": logs_collection.name})), None) or {}
+            if info.get("type") != "timeseries":
+                logger.error(
+                    f"{logs_collection.name} exists but is not a time-series collection "
+                    f"(type {info.get('type')!r}): events have no time-series layout or TTL. "
+                    f"Rename or drop it and restart to recreate it.")
+        _log_storage_ready = True
+
+
+def _expire_at(timestamp):
+    return timestamp + timedelta(days=LOG_RETENTION_DAYS + LOG_TTL_GRACE_DAYS)
+
+
+def _rollup_write(log_entry):
+    """Per (date, hour, user_type, interaction_type) counters, kept after raw events expire."""
+    response_time = log_entry["response_time_ms"]
+    inc = {
+        "count": 1,
+        "successful": 1 if log_entry["success"] else 0,
+        "response_time_sum": response_time or 0,
+        "response_time_count": 1 if response_time is not None else 0,
+    }
+    if response_time is not None:
+        # latency sketch bin (see agent/latency_sketch.py); $inc merges across workers
+        inc[f"latency_bins.{bin_key(response_time)}"] = 1
+    return rollups_collection.name, "update_one", (
+        {
+            "date": log_entry["date"],
+            "hour": log_entry["hour"],
+            "user_type": log_entry["user_type"],
+            "interaction_type": log_entry["interaction_type"],
+        },
+        {"$inc": inc},
+    ), {"upsert": True}
+
+
+def _bucket_write(log_entry):
+    """Append an event to the current hour's bucket (a new bucket starts when it is full)."""
+    timestamp = log_entry["timestamp"]
+    hour_start = timestamp.replace(minute=0, second=0, microsecond=0)
+    return buckets_collection.name, "update_one", (
+        {"hour_start": hour_start, "count": {"$lt": BUCKET_MAX_EVENTS}},
+        {
+            "$push": {"events": log_entry},
+            "$inc": {"count": 1},
+            "$setOnInsert": {
+                "date": log_entry["date"],
+                "hour": log_entry["hour"],
+                "expire_at": _expire_at(hour_start),
+            },
+        },
+    ), {"upsert": True}
+
+
+def build_log_entry(interaction_type, user_type, query, success,
+                    response_time=None, matched_case_id=None, error_message=None):
+    """The interaction document (see log_interaction for the arguments)."""
+    now = datetime.utcnow()
+    return {
+        "timestamp": now,
+        "interaction_type": interaction_type,
+        "user_type": user_type,
+        "query": query,
+        "success": success,
+        "response_time_ms": response_time,
+        "matched_case_id": matched_case_id,
+        "error_message": error_message,
+        "date": now.strftime("%Y-%m-%d"),
+        "hour": now.hour
+    }
+
+
+def log_writes(log_entry):
+    """
+    Database writes for one interaction, as (collection name, method, args,
+    kwargs). The names and methods are the same on pymongo and motor
+    collections, so the async logger (agent/async_mongo.py) runs this list
+    as is.
+    """
+    if LOG_STORAGE == "bucketed":
+        event = _bucket_write(log_entry)
+    else:
+        # time-series collections expire through the collection's own TTL option
+        event = (logs_collection.name, "insert_one", (log_entry,), {})
+    return [event, _rollup_write(log_entry)]
+
+
+def record_hot_query(log_entry):
+    get_hot_query_tracker(hot_queries_collection).record(log_entry["query"], log_entry["timestamp"])
 
 
 def log_interaction(
@@ -37,26 +187,85 @@ def log_interaction(
         matched_case_id: ID of the matched case (if any)
         error_message: Error message (if any)
     """
+    INTERACTIONS.labels(interaction_type, "true" if success else "false").inc()
     try:
-        log_entry = {
-            "timestamp": datetime.utcnow(),
-            "interaction_type": interaction_type,
-            "user_type": user_type,
-            "query": query,
-            "success": success,
-            "response_time_ms": response_time,
-            "matched_case_id": matched_case_id,
-            "error_message": error_message,
-            "date": datetime.utcnow().strftime("%Y-%m-%d"),
-            "hour": datetime.utcnow().hour
-        }
-        logs_collection.insert_one(log_entry)
+        ensure_log_storage()
+        log_entry = build_log_entry(
+            interaction_type, user_type, query, success, response_time, matched_case_id, error_message)
+        for name, method, args, kwargs in log_writes(log_entry):
+            getattr(db[name], method)(*args, **kwargs)
+        record_hot_query(log_entry)
         return True
     except Exception as e:
+        INTERACTION_LOG_FAILURES.inc()
         print(f"Failed to log interaction: {e}")
         return False
 
 
+def _from_rollups():
+    """Raw events expire in timeseries/bucketed modes, so counts come from rollups."""
+    return LOG_STORAGE != "events"
+
+
+def _dashboard_stats_from_rollups(today, week_ago, month_ago):
+    pipeline = [
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": "$count"},
+            "today": {"$sum": {"$cond": [{"$eq": ["$date", today]}, "$count", 0]}},
+            "week": {"$sum": {"$cond": [{"$gte": ["$date", week_ago]}, "$count", 0]}},
+            "month": {"$sum": {"$cond": [{"$gte": ["$date", month_ago]}, "$count", 0]}},
+            "successful": {"$sum": "$successful"},
+            "rt_sum": {"$sum": "$response_time_sum"},
+            "rt_count": {"$sum": "$response_time_count"},
+        }}
+    ]
+    totals = next(iter(rollups_collection.aggregate(pipeline)), None) or {}
+    total_queries = totals.get("total", 0)
+    success_rate = (totals.get("successful", 0) / total_queries * 100) if total_queries > 0 else 0
+    avg_response_time = (totals["rt_sum"] / totals["rt_count"]) if totals.get("rt_count") else 0
+
+    user_types = list(rollups_collection.aggregate([
+        {"$group": {"_id": "$user_type", "count": {"$sum": "$count"}}},
+        {"$sort": {"count": -1}}
+    ]))
+
+    return {
+        "total_queries": total_queries,
+        "today_queries": totals.get("today", 0),
+        "week_queries": totals.get("week", 0),
+        "month_queries": totals.get("month", 0),
+        "success_rate": round(success_rate, 2),
+        "avg_response_time_ms": round(avg_response_time, 2),
+        "user_type_breakdown": user_types
+    }
+
+
+def get_logs_version():
+    """
+    Cheap fingerprint of the interaction logs, for ETags on analytics endpoints
+    It changes whenever an interaction is logged (or raw events are archived)
+    Returns: tuple (None if the logs can't be read)
+    """
+    try:
+        if LOG_STORAGE == "bucketed":
+            # البكت الشغال = أحدث ساعة وأقل عدد (البكتات المليانة عددها BUCKET_MAX_EVENTS)
+            latest = buckets_collection.find_one(
+                {}, {"_id": 1, "count": 1}, sort=[("hour_start", DESCENDING), ("count", 1)]
+            )
+            return (latest["_id"], latest["count"]) if latest else ()
+        if LOG_STORAGE == "timeseries":
+            latest = logs_collection.find_one({}, {"timestamp": 1}, sort=[("timestamp", DESCENDING)])
+            latest = latest["timestamp"] if latest else None
+        else:
+            latest = logs_collection.find_one({}, {"_id": 1}, sort=[("_id", DESCENDING)])
+            latest = latest["_id"] if latest else None
+        return (latest, logs_collection.estimated_document_count())
+    except Exception as e:
+        print(f"Error getting logs version: {e}")
+        return None
+
+
 def get_dashboard_stats():
     """
     Get overall statistics for the dashboard
@@ -67,9 +276,12 @@ def get_dashboard_stats():
         today = now.strftime("%Y-%m-%d")
         week_ago = (now - timedelta(days=7)).strftime("%Y-%m-%d")
         month_ago = (now - timedelta(days=30)).strftime("%Y-%m-%d")
+
+        if _from_rollups():
+            return _dashboard_stats_from_rollups(today, week_ago, month_ago)
         
-        # Total queries
-        total_queries = logs_collection.count_documents({})
+        # Total queries (collection metadata, no scan)
+        total_queries = logs_collection.estimated_document_count()
         
         # Today's queries
         today_queries = logs_collection.count_documents({"date": today})
@@ -121,6 +333,25 @@ def get_dashboard_stats():
         }
 
 
+_RECENT_FIELDS = ("timestamp", "user_type", "query", "success", "matched_case_id", "response_time_ms")
+
+
+def _recent_queries_from_buckets(limit):
+    queries = []
+    # أحدث البكتات أول؛ نوقف لما يكتمل العدد
+    for bucket in buckets_collection.find({}, {"events": 1}).sort("hour_start", DESCENDING):
+        queries.extend(bucket.get("events", []))
+        if len(queries) >= limit:
+            break
+    queries.sort(key=lambda q: q["timestamp"], reverse=True)
+    result = []
+    for q in queries[:limit]:
+        entry = {k: q.get(k) for k in _RECENT_FIELDS}
+        entry["timestamp"] = entry["timestamp"].isoformat()
+        result.append(entry)
+    return result
+
+
 def get_recent_queries(limit=10):
     """
     Get recent queries with their results
@@ -129,6 +360,9 @@ def get_recent_queries(limit=10):
     Returns: list of recent query logs
     """
     try:
+        if LOG_STORAGE == "bucketed":
+            return _recent_queries_from_buckets(limit)
+
         queries = list(logs_collection.find(
             {},
             {
@@ -153,26 +387,51 @@ def get_recent_queries(limit=10):
         return []
 
 
-def get_popular_queries(limit=10):
+def get_popular_queries(limit=10, days=None):
     """
-    Get most common queries
+    Get most common queries (normalized, so spelling variants count together)
     Args:
         limit: Number of popular queries to return
+        days: Only count the past N days (None = all kept history)
     Returns: list of popular queries with counts
     """
     try:
-        pipeline = [
-            {"$group": {"_id": "$query", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": limit},
-            {"$project": {"_id": 0, "query": "$_id", "count": 1}}
-        ]
-        return list(logs_collection.aggregate(pipeline))
+        start_date = None
+        if days is not None:
+            start_date = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
+        return get_hot_query_tracker(hot_queries_collection).top(limit, start_date)
     except Exception as e:
         print(f"Error getting popular queries: {e}")
         return []
 
 
+def get_case_match_counts(days=30):
+    """
+    Count matches per case over the past N days (raw events, so at most
+    the retention window in timeseries/bucketed modes)
+    Returns: {case_id: count}
+    """
+    try:
+        start_date = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
+        match = {"date": {"$gte": start_date}, "matched_case_id": {"$ne": None}}
+        if LOG_STORAGE == "bucketed":
+            pipeline = [
+                {"$match": {"date": {"$gte": start_date}}},
+                {"$unwind": "$events"},
+                {"$replaceRoot": {"newRoot": "$events"}},
+                {"$match": {"matched_case_id": {"$ne": None}}},
+            ]
+            collection = buckets_collection
+        else:
+            pipeline = [{"$match": match}]
+            collection = logs_collection
+        pipeline.append({"$group": {"_id": "$matched_case_id", "count": {"$sum": 1}}})
+        return {row["_id"]: row["count"] for row in collection.aggregate(pipeline)}
+    except Exception as e:
+        print(f"Error getting case match counts: {e}")
+        return {}
+
+
 def get_hourly_activity():
     """
     Get activity breakdown by hour for today
@@ -188,7 +447,11 @@ def get_hourly_activity():
             {"$project": {"_id": 0, "hour": "$_id", "count": 1}}
         ]
         
-        hourly_data = list(logs_collection.aggregate(pipeline))
+        if _from_rollups():
+            pipeline[1] = {"$group": {"_id": "$hour", "count": {"$sum": "$count"}}}
+            hourly_data = list(rollups_collection.aggregate(pipeline))
+        else:
+            hourly_data = list(logs_collection.aggregate(pipeline))
         
         # Fill in missing hours with 0
         result = []
@@ -219,7 +482,54 @@ def get_daily_trends(days=7):
             {"$project": {"_id": 0, "date": "$_id", "total": 1, "successful": 1}}
         ]
         
+        if _from_rollups():
+            pipeline[1] = {"$group": {"_id": "$date", "total": {"$sum": "$count"}, "successful": {"$sum": "$successful"}}}
+            return list(rollups_collection.aggregate(pipeline))
         return list(logs_collection.aggregate(pipeline))
     except Exception as e:
         print(f"Error getting daily trends: {e}")
         return []
+
+
+LATENCY_GROUPS = ("user_type", "interaction_type")
+
+
+def get_latency_percentiles(days=7, group_by=LATENCY_GROUPS):
+    """
+    Get p50/p90/p99 response times from the hourly latency sketches
+    Args:
+        days: Number of days to include (0 = today only)
+        group_by: rollup fields to break down by (subset of user_type, interaction_type)
+    Returns: {"overall": {...}, "groups": [{user_type, interaction_type, count, p50, p90, p99}, ...]}
+    """
+    try:
+        start_date = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
+        group_by = tuple(f for f in group_by if f in LATENCY_GROUPS)
+
+        overall = LatencySketch()
+        groups = {}
+        cursor = rollups_collection.find(
+            {"date": {"$gte": start_date}, "latency_bins": {"$exists": True}},
+            {"_id": 0, "latency_bins": 1, **{f: 1 for f in group_by}}
+        )
+        for doc in cursor:
+            bins = doc["latency_bins"]
+            overall.merge_bins(bins)
+            key = tuple(doc.get(f) for f in group_by)
+            groups.setdefault(key, LatencySketch()).merge_bins(bins)
+
+        rows = []
+        for key, sketch in groups.items():
+            row = dict(zip(group_by, key))
+            row["count"] = sketch.count
+            row.update(sketch.quantiles())
+            rows.append(row)
+        rows.sort(key=lambda r: r["count"], reverse=True)
+
+        return {
+            "overall": {"count": overall.count, **overall.quantiles()},
+            "groups": rows
+        }
+    except Exception as e:
+        print(f"Error getting latency percentiles: {e}")
+        return {"overall": {"count": 0, "p50": None, "p90": None, "p99": None}, "groups": []}
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+agent/async_mongo.py
+Non-blocking MongoDB access for the asyncio server (asgi.py).
+
+log_interaction_async() writes the same documents as
+analytics_helper.log_interaction(): it builds the entry and runs
+analytics_helper.log_writes() on motor collections, so an interaction
+logged under either server looks the same to the dashboards.
+
+motor is optional. Without it (or with CALLHELPER_ASYNC_MONGO=0, e.g.
+under the in-memory Mongo stand-in), the synchronous logger runs in the
+I/O thread pool instead, which still keeps the event loop free.
+
+The motor client is bound to the event loop it is first used on, so it is
+created lazily inside the server and closed at shutdown (close_client()).
+"""
+
+import os
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from . import analytics_helper
+from .metrics import INTERACTIONS, INTERACTION_LOG_FAILURES
+from .mongo_helper import COMMAND_LISTENERS
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # motor not installed: fall back to pymongo in threads
+    AsyncIOMotorClient = None
+
+logger = logging.getLogger(__name__)
+
+ASYNC_MONGO = os.getenv("CALLHELPER_ASYNC_MONGO", "1") == "1" and AsyncIOMotorClient is not None
+# Threads for blocking pymongo calls made from the event loop
+IO_THREADS = int(os.getenv("CALLHELPER_ASYNC_IO_THREADS", "16"))
+
+io_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="async-io")
+_client = None
+
+
+def get_database():
+    """The motor "callhelper" database, or None when motor is not used."""
+    global _client
+    if not ASYNC_MONGO:
+        return None
+    if _client is None:
+        _client = AsyncIOMotorClient(analytics_helper.MONGO_URI, event_listeners=COMMAND_LISTENERS)
+    return _client[analytics_helper.db.name]
+
+
+def close_client():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call in the I/O thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_pool, functools.partial(func, *args, **kwargs))
+
+
+async def log_interaction_async(interaction_type, user_type, query, success, response_time=None,
+                                matched_case_id=None, error_message=None) -> bool:
+    """Async analytics_helper.log_interaction (same arguments and return value)."""
+    db = get_database()
+    if db is None:
+        return await run_blocking(
+            analytics_helper.log_interaction, interaction_type, user_type, query, success,
+            response_time, matched_case_id, error_message)
+
+    INTERACTIONS.labels(interaction_type, "true" if success else "false").inc()
+    try:
+        if not analytics_helper.log_storage_ready():
+            await run_blocking(analytics_helper.ensure_log_storage)
+        log_entry = analytics_helper.build_log_entry(
+            interaction_type, user_type, query, success, response_time, matched_case_id, error_message)
+        for name, method, args, kwargs in analytics_helper.log_writes(log_entry):
+            await getattr(db[name], method)(*args, **kwargs)
+        analytics_helper.record_hot_query(log_entry)
+        return True
+    except Exception as e:
+        INTERACTION_LOG_FAILURES.inc()
+        logger.error(f"Failed to log interaction: {e}")
+        return False
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+agent/bm25_index.py
+BM25 relevance ranking over case keywords and text.
+
+Document frequencies and lengths are computed once per catalog version and
+each term's contribution to each case is precomputed into compact arrays
+(case positions + float32 weights). Ranking a query is then a sparse dot
+product: sum the weights of the query's terms per case.
+"""
+
+import math
+from array import array
+from typing import Any, Dict, List, Tuple
+
+from .text_normalizer import normalize_text, normalize_query
+from .case_io import synonym_terms
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# وزن كل حقل (كم مرة تنحسب كلماته في طول الحالة وتكرار الكلمة)
+FIELD_WEIGHTS = {
+    "MainKeywords": 3,
+    "Synonyms": 2,
+    "ExtraKeywords": 2,
+    "Category": 2,
+    "SubCategory": 2,
+    "ResponseText": 1,
+}
+
+_CLITICS = ("وال", "بال", "فال", "كال", "لل", "ال")
+
+
+def stem(token: str) -> str:
+    """Light stemming: drop a leading definite article / clitic ("ال", "وال", ...)."""
+    for prefix in _CLITICS:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 3:
+            return token[len(prefix):]
+    return token
+
+
+def _field_tokens(value) -> List[str]:
+    if isinstance(value, list):
+        value = " ".join(v for v in value if isinstance(v, str))
+    if not isinstance(value, str):
+        return []
+    return [stem(t) for t in normalize_text(value).split()]
+
+
+class Bm25Index:
+    def __init__(self, cases: List[Dict[str, Any]], k1: float = BM25_K1, b: float = BM25_B):
+        doc_tfs: List[Dict[str, int]] = []
+        lengths: List[int] = []
+        df: Dict[str, int] = {}
+
+        for case in cases:
+            tf: Dict[str, int] = {}
+            length = 0
+            for field, weight in FIELD_WEIGHTS.items():
+                value = case.get(field)
+                if field == "Synonyms":
+                    # "كلمة=مرادف|مرادف" → المرادفات بس (الكلمة محسوبة بحقلها)
+                    value = synonym_terms(value)
+                for token in _field_tokens(value):
+                    tf[token] = tf.get(token, 0) + weight
+                    length += weight
+            for token in tf:
+                df[token] = df.get(token, 0) + 1
+            doc_tfs.append(tf)
+            lengths.append(length)
+
+        n = len(cases)
+        avgdl = (sum(lengths) / n) if n else 0.0
+        postings: Dict[str, Tuple[array, array]] = {}
+        for pos, tf in enumerate(doc_tfs):
+            norm = k1 * (1 - b + b * lengths[pos] / avgdl) if avgdl else k1
+            for token, freq in tf.items():
+                idf = math.log(1 + (n - df[token] + 0.5) / (df[token] + 0.5))
+                entry = postings.get(token)
+                if entry is None:
+                    entry = postings[token] = (array("i"), array("f"))
+                entry[0].append(pos)
+                entry[1].append(idf * freq * (k1 + 1) / (freq + norm))
+
+        self.postings = postings
+        self.avgdl = avgdl
+
+    def score(self, issue_text: str) -> Dict[int, float]:
+        """case_pos -> BM25 score for a raw query (each distinct query term counted once)."""
+        _, tokens = normalize_query(issue_text)
+        scores: Dict[int, float] = {}
+        for token in {stem(t) for t in tokens}:
+            entry = self.postings.get(token)
+            if entry is None:
+                continue
+            for pos, weight in zip(*entry):
+                scores[pos] = scores.get(pos, 0.0) + weight
+        return scores
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+agent/case_index.py
+In-memory keyword index over the cases collection.
+
+Keywords are normalized once when the index is built (with the same
+normalizer used for queries) and stored in an inverted index, so a query
+only touches the cases whose keywords it actually hits instead of scanning
+the whole catalog. Indexes are cached per collection and rebuilt only when
+the catalog version in MongoDB changes.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .text_normalizer import normalize_text, normalize_query
+from .fuzzy_index import TrigramIndex
+from .bm25_index import Bm25Index
+from .semantic_index import SemanticIndex
+from .suggest_index import SuggestIndex
+from .mongo_helper import get_catalog_version, on_catalog_change
+from .case_io import parse_synonym
+from .metrics import CASE_INDEX_BUILDS
+
+logger = logging.getLogger(__name__)
+
+# How long a cached index is trusted before re-checking the catalog version
+INDEX_TTL_SECONDS = float(os.getenv("CALLHELPER_INDEX_TTL_SECONDS", "5"))
+
+# Keyword tiers
+MAIN, EXTRA, NEGATIVE = 0, 1, 2
+TIER_POINTS = {MAIN: 2, EXTRA: 1}
+
+# Matching tiers on top of the exact (substring) tier, which always runs:
+#   "prefix" - a query word shares its first 3 letters with the keyword
+#   "fuzzy"  - a query word is within a small edit distance of the keyword
+MATCH_TIERS = tuple(
+    t.strip() for t in os.getenv("CALLHELPER_MATCH_TIERS", "prefix").split(",") if t.strip()
+)
+
+# Default ranking mode: "keywords" (point scoring) or "bm25"
+RANKING_MODES = ("keywords", "bm25")
+RANKING = os.getenv("CALLHELPER_RANKING", "keywords")
+
+
+def _normalized_keywords(values) -> List[str]:
+    if not isinstance(values, list):
+        return []
+    return [normalize_text(v) for v in values if isinstance(v, str)]
+
+
+def _normalized_synonyms(values) -> List[Tuple[Optional[str], List[str]]]:
+    """(keyword or None, synonyms) per Synonyms entry, normalized."""
+    groups = []
+    for value in values if isinstance(values, list) else []:
+        if isinstance(value, str):
+            keyword, synonyms = parse_synonym(value)
+            terms = [t for t in (normalize_text(s) for s in synonyms) if t]
+            if terms:
+                groups.append((normalize_text(keyword) if keyword is not None else None, terms))
+    return groups
+
+
+class CaseIndex:
+    """
+    Inverted index: normalized keyword -> postings of (case_pos, tier, group).
+
+    `group` is the keyword's position in its list, so two raw keywords that
+    normalize to the same term still score separately, like before.
+
+    Synonyms are resolved here, once per catalog version, so a query costs
+    nothing extra at request time:
+    - a group "تفعيل=تنشيط|تشغيل" gives its synonyms the posting of that
+      keyword of the case, so they score exactly what the keyword scores
+      (and only once, whichever forms the query uses);
+    - a plain synonym counts as one more extra keyword of the case.
+    """
+
+    def __init__(self, cases: List[Dict[str, Any]], version: Any = 0):
+        self.version = version
+        self.cases = cases
+        self.main_counts: List[int] = []
+        self.terms: Dict[str, List[Tuple[int, int, int]]] = {}
+        # أول 3 حروف من الكلمة → postings (للمطابقة الجزئية، بدون السلبية)
+        self.prefix3: Dict[str, List[Tuple[int, int, int]]] = {}
+
+        for pos, case in enumerate(cases):
+            main = _normalized_keywords(case.get("MainKeywords"))
+            extra = _normalized_keywords(case.get("ExtraKeywords"))
+            self.main_counts.append(len(case.get("MainKeywords") or []))
+            self._add_terms(pos, MAIN, main)
+            self._add_terms(pos, EXTRA, extra)
+            self._add_terms(pos, NEGATIVE, _normalized_keywords(case.get("NegativeKeywords")))
+            self._add_synonyms(pos, main, extra, _normalized_synonyms(case.get("Synonyms")))
+
+        self.term_lengths = sorted({len(t) for t in self.terms})
+        self._fuzzy: Optional[TrigramIndex] = None
+        self._bm25: Optional[Bm25Index] = None
+        self._semantic: Optional[SemanticIndex] = None
+        self._suggest: Optional[SuggestIndex] = None
+        self._fuzzy_lock = threading.Lock()
+
+    def _add_terms(self, pos: int, tier: int, keywords: List[str]):
+        for group, kw in enumerate(keywords):
+            if kw:
+                self._add_posting(kw, (pos, tier, group))
+
+    def _add_posting(self, term: str, posting: Tuple[int, int, int]):
+        postings = self.terms.setdefault(term, [])
+        # postings الحالة الواحدة تنضاف ورا بعض، فنكفي نفحص آخرها
+        for existing in reversed(postings):
+            if existing[0] != posting[0]:
+                break
+            if existing == posting:
+                return
+        postings.append(posting)
+        if posting[1] != NEGATIVE and len(term) >= 3:
+            self.prefix3.setdefault(term[:3], []).append(posting)
+
+    def _add_synonyms(self, pos: int, main: List[str], extra: List[str],
+                      synonyms: List[Tuple[Optional[str], List[str]]]):
+        if not synonyms:
+            return
+
+        # الكلمة → مجموعتها في الحالة (الرئيسية أولى من الإضافية)
+        groups: Dict[str, Tuple[int, int, int]] = {}
+        for group, kw in enumerate(extra):
+            groups[kw] = (pos, EXTRA, group)
+        for group, kw in enumerate(main):
+            groups[kw] = (pos, MAIN, group)
+
+        next_group = len(extra)
+        for keyword, terms in synonyms:
+            for term in terms:
+                if term in groups:
+                    continue
+                if keyword in groups:
+                    groups[term] = groups[keyword]
+                else:
+                    # مرادف بدون كلمة (أو كلمته مو في الحالة) → كلمة إضافية لحاله
+                    groups[term] = (pos, EXTRA, next_group)
+                    next_group += 1
+                self._add_posting(term, groups[term])
+
+    def __len__(self):
+        return len(self.cases)
+
+    def fuzzy(self) -> TrigramIndex:
+        """Trigram index over main/extra keywords, built on first use."""
+        if self._fuzzy is None:
+            with self._fuzzy_lock:
+                if self._fuzzy is None:
+                    vocabulary = [
+                        term for term, postings in self.terms.items()
+                        if any(tier != NEGATIVE for _, tier, _ in postings)
+                    ]
+                    self._fuzzy = TrigramIndex(vocabulary)
+        return self._fuzzy
+
+    def lookup(self, text: str, tokens: Tuple[str, ...], tiers: Tuple[str, ...] = MATCH_TIERS):
+        """
+        Yield postings hit by a normalized query.
+        - any keyword that appears as a substring of the query (all tiers)
+        - "prefix": main/extra keywords sharing their first 3 letters with a query word
+        - "fuzzy": main/extra keywords within a bounded edit distance of a query word
+        """
+        terms = self.terms
+        n = len(text)
+        for i in range(n):
+            for length in self.term_lengths:
+                if i + length > n:
+                    break
+                postings = terms.get(text[i:i + length])
+                if postings:
+                    yield from postings
+
+        if "prefix" in tiers:
+            seen = set()
+            for w in tokens:
+                if len(w) < 3 or w[:3] in seen:
+                    continue
+                seen.add(w[:3])
+                postings = self.prefix3.get(w[:3])
+                if postings:
+                    yield from postings
+
+        if "fuzzy" in tiers:
+            fuzzy = self.fuzzy()
+            for w in tokens:
+                if w in terms:
+                    continue
+                for term in fuzzy.lookup(w):
+                    for posting in terms[term]:
+                        if posting[1] != NEGATIVE:
+                            yield posting
+
+    def bm25(self) -> Bm25Index:
+        """BM25 statistics for this catalog version, built on first use."""
+        if self._bm25 is None:
+            with self._fuzzy_lock:
+                if self._bm25 is None:
+                    self._bm25 = Bm25Index(self.cases)
+        return self._bm25
+
+    def semantic(self) -> SemanticIndex:
+        """Hashed n-gram vectors for this catalog version, built on first use."""
+        if self._semantic is None:
+            with self._fuzzy_lock:
+                if self._semantic is None:
+                    self._semantic = SemanticIndex(self.cases)
+        return self._semantic
+
+    def suggest(self) -> SuggestIndex:
+        """Typeahead index over keywords, synonyms and categories, built on first use."""
+        if self._suggest is None:
+            with self._fuzzy_lock:
+                if self._suggest is None:
+                    self._suggest = SuggestIndex(self.cases)
+        return self._suggest
+
+    def search_semantic(self, issue_text: str, limit: int = 5) -> List[Tuple[int, float]]:
+        """Nearest cases by hashed n-gram similarity, skipping negative keyword hits."""
+        text, tokens = normalize_query(issue_text)
+        if not text:
+            return []
+        excluded, _ = self._keyword_hits(text, tokens, ())
+        # نطلب أكثر شوي عشان يبقى عندنا `limit` بعد الاستبعاد
+        results = self.semantic().search(issue_text, limit + len(excluded))
+        return [(pos, sim) for pos, sim in results if pos not in excluded][:limit]
+
+    def _keyword_hits(self, text: str, tokens: Tuple[str, ...], tiers: Tuple[str, ...]):
+        excluded = set()
+        hits: Dict[int, set] = {}
+        for pos, tier, group in self.lookup(text, tokens, tiers):
+            if tier == NEGATIVE:
+                excluded.add(pos)
+            else:
+                hits.setdefault(pos, set()).add((tier, group))
+        return excluded, hits
+
+    def score(self, issue_text: str, tiers: Tuple[str, ...] = MATCH_TIERS,
+              ranking: str = RANKING) -> List[Tuple[int, Any, int]]:
+        """
+        Score cases for a raw query.
+        ranking: "keywords" (2 points per main keyword, 1 per extra) or "bm25"
+        Returns (case_pos, score, matched_main) for cases with a main/extra
+        keyword or synonym hit and no negative keyword hit. Both rankings
+        score exactly these candidates: bm25 only orders them, so words
+        shared with ResponseText alone never make a match, and a case found
+        only by the prefix/fuzzy tiers (no exact query term) scores 0 and
+        ranks after the others instead of being dropped.
+        """
+        text, tokens = normalize_query(issue_text)
+        if not text:
+            return []
+
+        excluded, hits = self._keyword_hits(text, tokens, tiers)
+
+        results = []
+        if ranking == "bm25":
+            bm25 = self.bm25().score(issue_text)
+            for pos, groups in hits.items():
+                if pos in excluded:
+                    continue
+                # كلمات مثل "في" أو نص الرد وحده ما تكفي، والمطابقة بالبادئة أو الخطأ الإملائي ما لها وزن bm25
+                matched_main = sum(1 for tier, _ in groups if tier == MAIN)
+                results.append((pos, round(bm25.get(pos, 0.0), 4), matched_main))
+        else:
+            for pos, groups in hits.items():
+                if pos in excluded:
+                    continue
+                score = sum(TIER_POINTS[tier] for tier, _ in groups)
+                matched_main = sum(1 for tier, _ in groups if tier == MAIN)
+                results.append((pos, score, matched_main))
+        results.sort()
+        return results
+
+
+# collection name -> {"version", "checked_at", "fetched_at", "cases", "indexes": {partition_key: CaseIndex}}
+_cache: Dict[str, dict] = {}
+_cache_lock = threading.Lock()
+
+
+def _invalidate(collection_name: str, version: int):
+    entry = _cache.get(collection_name)
+    if entry is not None:
+        entry["checked_at"] = 0.0
+
+
+on_catalog_change(_invalidate)
+
+
+def get_case_index(
+    collection,
+    partition_key: str = "*",
+    owns_case: Optional[Callable[[Dict[str, Any]], bool]] = None,
+) -> Optional[CaseIndex]:
+    """
+    Return the cached index for one partition of a collection.
+
+    The collection is fetched once per catalog version and split into
+    partitions (e.g. per user type) on demand, so each agent only scores
+    its own cases. The version is re-checked at most every
+    INDEX_TTL_SECONDS (or right away after a local catalog change).
+    """
+    now = time.monotonic()
+    entry = _cache.get(collection.name)
+    if entry is not None and now - entry["checked_at"] < INDEX_TTL_SECONDS:
+        index = entry["indexes"].get(partition_key)
+        if index is not None:
+            return index
+
+    with _cache_lock:
+        entry = _cache.get(collection.name)
+        if entry is None or now - entry["checked_at"] >= INDEX_TTL_SECONDS:
+            # عدد المستندات مع النسخة عشان نلقط التعديلات اللي صارت برا mongo_helper
+            version = (get_catalog_version(collection), collection.estimated_document_count())
+            if entry is not None and entry["version"] == version:
+                entry["checked_at"] = now
+            else:
+                entry = {
+                    "version": version,
+                    "checked_at": now,
+                    "fetched_at": now,
+                    "cases": list(collection.find({})),
+                    "indexes": {},
+                }
+                _cache[collection.name] = entry
+
+        index = entry["indexes"].get(partition_key)
+        if index is None:
+            cases = entry["cases"]
+            if owns_case is not None:
+                cases = [case for case in cases if owns_case(case)]
+            index = CaseIndex(cases, entry["version"])
+            entry["indexes"][partition_key] = index
+            CASE_INDEX_BUILDS.labels(collection.name).inc()
+            logger.info(
+                f"Built case index for {collection.name}/{partition_key} "
+                f"v{entry['version'][0]}: {len(index)} cases"
+            )
+        return index
+
+
+def cache_stats() -> List[Dict[str, Any]]:
+    """Cached collections: {collection, age_seconds, partitions: {partition_key: case count}}."""
+    now = time.monotonic()
+    return [
+        {
+            "collection": name,
+            "age_seconds": now - entry["fetched_at"],
+            "partitions": {key: len(index) for key, index in list(entry["indexes"].items())},
+        }
+        for name, entry in list(_cache.items())
+    ]
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+agent/case_io.py
+Bulk import / export of cases (CSV and JSON lines).
+
+Imports are streamed: rows are read one at a time, validated with the same
+rules as the admin form (parse_keywords for keyword fields, required
+fields), and upserted by CaseID with bulk_write in chunks of
+CALLHELPER_IMPORT_CHUNK_SIZE. The catalog version is bumped once at the
+end of an import instead of once per case, so the case indexes are
+rebuilt once.
+
+CSV files may come from Excel ("Save as CSV UTF-8"): a BOM is accepted and
+the delimiter (comma, semicolon or tab) is detected from the header line.
+Keyword cells are comma or newline separated, as in the admin form.
+A Synonyms entry is either a plain term or a group "keyword=syn1|syn2"
+binding its synonyms to one of the case's main/extra keywords; rows
+whose group names a keyword the case does not have are rejected.
+
+Exports stream the collection sorted by CaseID in the same formats.
+
+CLI:
+    python -m agent.case_io import cases.csv [--dry-run]
+    python -m agent.case_io export cases.jsonl
+"""
+
+import os
+import io
+import sys
+import csv
+import json
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .mongo_helper import get_collection, bump_catalog_version
+from .text_normalizer import normalize_text
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = int(os.getenv("CALLHELPER_IMPORT_CHUNK_SIZE", "500"))
+# Errors kept in an import report (the rest are only counted)
+MAX_REPORTED_ERRORS = 100
+
+# Column order for exports (same fields as the admin form)
+CASE_FIELDS = (
+    "CaseID", "UserType", "AccountStatus", "Category", "SubCategory",
+    "MainKeywords", "ExtraKeywords", "Synonyms", "NegativeKeywords",
+    "Priorty", "ResponseText", "Why", "FallbackText", "Notes", "LastUpdated",
+)
+KEYWORD_FIELDS = ("MainKeywords", "ExtraKeywords", "Synonyms", "NegativeKeywords")
+# "keyword=syn1|syn2" في حقل Synonyms
+SYNONYM_GROUP_SEP = "="
+SYNONYM_SEP = "|"
+REQUIRED_FIELDS = ("CaseID", "UserType", "Category", "MainKeywords", "ResponseText")
+FORMATS = ("csv", "jsonl")
+
+
+def parse_keywords(s) -> List[str]:
+    """Parse comma/newline-separated keywords into a list."""
+    if not s:
+        return []
+    parts = []
+    for line in s.replace("\r", "\n").split("\n"):
+        for p in line.split(","):
+            t = p.strip().lower()
+            if t:
+                parts.append(t)
+    # Remove duplicates while preserving order
+    return list(dict.fromkeys(parts))
+
+
+def parse_synonym(value: str) -> Tuple[Optional[str], List[str]]:
+    """("keyword", [synonyms]) for a "keyword=syn1|syn2" group, (None, [value]) for a plain synonym."""
+    if SYNONYM_GROUP_SEP not in value:
+        return None, [value.strip()] if value.strip() else []
+    keyword, _, rest = value.partition(SYNONYM_GROUP_SEP)
+    return keyword.strip(), [s.strip() for s in rest.split(SYNONYM_SEP) if s.strip()]
+
+
+def synonym_terms(values) -> List[str]:
+    """Every synonym term of a Synonyms list (group keywords left out)."""
+    if not isinstance(values, list):
+        return []
+    return [t for v in values if isinstance(v, str) for t in parse_synonym(v)[1]]
+
+
+def parse_synonyms(s) -> List[str]:
+    """parse_keywords for the Synonyms field, with groups written as "keyword=syn1|syn2"."""
+    return list(dict.fromkeys(_synonym_entry(t) for t in parse_keywords(s)))
+
+
+def _synonym_entry(value: str) -> str:
+    keyword, synonyms = parse_synonym(value)
+    if keyword is None:
+        return value
+    return keyword + SYNONYM_GROUP_SEP + SYNONYM_SEP.join(synonyms)
+
+
+def synonym_errors(case: Dict[str, Any]) -> Optional[str]:
+    """Why the case's synonym groups are invalid, or None."""
+    keywords = {normalize_text(k) for f in ("MainKeywords", "ExtraKeywords")
+                for k in case.get(f) or [] if isinstance(k, str)}
+    for value in case.get("Synonyms") or []:
+        keyword, synonyms = parse_synonym(value)
+        if keyword is None:
+            continue
+        if not keyword or not synonyms:
+            return f"synonym group {value!r} needs a keyword and at least one synonym (keyword=syn1|syn2)"
+        if normalize_text(keyword) not in keywords:
+            return f"synonym group {value!r}: {keyword!r} is not a main or extra keyword of the case"
+    return None
+
+
+def format_for(filename: str) -> Optional[str]:
+    """Import/export format from a file name, or None if unsupported."""
+    name = filename.lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return None
+
+
+# ---- reading ----
+
+
+def iter_csv_rows(stream: TextIO) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(line number, row) for each CSV record."""
+    header = stream.readline().lstrip("\ufeff")
+    # من الهيدر ناخذ الفاصل بس؛ بدون علامات تنصيص فيه يخمّن doublequote=False ويخرب "" داخل الحقول
+    try:
+        delimiter = csv.Sniffer().sniff(header, delimiters=",;\t").delimiter
+    except csv.Error:
+        delimiter = ","
+    fields = [f.strip() for f in next(csv.reader([header], delimiter=delimiter))]
+    reader = csv.DictReader(stream, fieldnames=fields, delimiter=delimiter)
+    for row in reader:
+        # line_num ما يحسب الهيدر لأنه انقرأ قبل
+        if any((v or "").strip() for k, v in row.items() if k is not None):
+            yield reader.line_num + 1, row
+
+
+def iter_jsonl_rows(stream: TextIO) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(line number, object) for each JSON line; malformed lines yield an {"_error": ...} row."""
+    for number, line in enumerate(stream, 1):
+        line = line.strip().lstrip("\ufeff")
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = {"_error": f"invalid JSON: {e}"}
+        if not isinstance(row, dict):
+            row = {"_error": "expected a JSON object"}
+        yield number, row
+
+
+def iter_rows(stream: TextIO, fmt: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    if fmt == "csv":
+        return iter_csv_rows(stream)
+    if fmt == "jsonl":
+        return iter_jsonl_rows(stream)
+    raise ValueError(f"unsupported format {fmt!r} (expected one of {', '.join(FORMATS)})")
+
+
+def _keywords(value) -> List[str]:
+    if isinstance(value, list):
+        return list(dict.fromkeys(t for t in (str(v).strip().lower() for v in value) if t))
+    return parse_keywords(str(value)) if value is not None else []
+
+
+def _synonyms(value) -> List[str]:
+    return list(dict.fromkeys(_synonym_entry(t) for t in _keywords(value)))
+
+
+def clean_case(row: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Normalize an imported row to a case document. Returns (case, error or None)."""
+    if "_error" in row:
+        return {}, row["_error"]
+    case = {}
+    for field in CASE_FIELDS:
+        if field == "LastUpdated" or field not in row:
+            continue
+        value = row[field]
+        if field == "Synonyms":
+            case[field] = _synonyms(value)
+        elif field in KEYWORD_FIELDS:
+            case[field] = _keywords(value)
+        else:
+            case[field] = "" if value is None else str(value).strip()
+    missing = [f for f in REQUIRED_FIELDS if not case.get(f)]
+    if missing:
+        return case, f"missing required fields: {', '.join(missing)}"
+    return case, synonym_errors(case)
+
+
+# ---- import ----
+
+
+def import_cases(rows: Iterable[Tuple[int, Dict[str, Any]]], collection=None,
+                 chunk_size: int = IMPORT_CHUNK_SIZE, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Upsert validated rows by CaseID in bulk_write chunks.
+
+    Columns missing from the file are left untouched on existing cases.
+    A CaseID repeated within a chunk keeps its last row. Returns
+    {rows, valid, invalid, inserted, updated, version, errors, aborted}.
+
+    An import that fails partway (undecodable file, write error) is not
+    rolled back: chunks already written stay, the catalog version is still
+    bumped for them, and "aborted" describes where and why it stopped.
+    """
+    collection = collection if collection is not None else get_collection()
+    report = {"rows": 0, "valid": 0, "invalid": 0, "inserted": 0, "updated": 0,
+              "version": None, "errors": [], "aborted": None}
+    pending: Dict[str, UpdateOne] = {}
+
+    def flush():
+        if not pending:
+            return
+        if not dry_run:
+            try:
+                result = collection.bulk_write(list(pending.values()), ordered=False)
+            except BulkWriteError as e:
+                # unordered: باقي العمليات انكتبت
+                report["inserted"] += e.details.get("nUpserted", 0)
+                report["updated"] += e.details.get("nMatched", 0)
+                raise
+            report["inserted"] += result.upserted_count
+            report["updated"] += result.matched_count
+        pending.clear()
+
+    now = datetime.now(timezone.utc)
+    line = 0
+    try:
+        for line, row in rows:
+            report["rows"] += 1
+            case, error = clean_case(row)
+            if error:
+                report["invalid"] += 1
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append({"line": line, "CaseID": case.get("CaseID"), "error": error})
+                continue
+            report["valid"] += 1
+            case["LastUpdated"] = now
+            pending[case["CaseID"]] = UpdateOne({"CaseID": case["CaseID"]}, {"$set": case}, upsert=True)
+            if len(pending) >= chunk_size:
+                flush()
+        flush()
+    except Exception as e:
+        if isinstance(e, UnicodeDecodeError):
+            reason = "the file is not UTF-8 (in Excel use \"CSV UTF-8\")"
+        else:
+            reason = str(e)
+        report["aborted"] = f"stopped after line {line}: {reason}"
+        logger.error(f"Case import aborted after line {line}: {e}")
+    finally:
+        # الكتل اللي انكتبت لازم الفهارس تشوفها حتى لو الاستيراد وقف
+        if report["inserted"] or report["updated"]:
+            report["version"] = bump_catalog_version(collection)
+    logger.info(f"Imported cases: {report['valid']} valid, {report['invalid']} invalid, "
+                f"{report['inserted']} inserted, {report['updated']} updated")
+    return report
+
+
+def import_file(stream, fmt: str, **kwargs) -> Dict[str, Any]:
+    """Import from a binary or text stream (an upload, or a file opened by the CLI)."""
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    return import_cases(iter_rows(stream, fmt), **kwargs)
+
+
+# ---- export ----
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_cases(fmt: str, collection=None, batch_size: int = IMPORT_CHUNK_SIZE) -> Iterator[str]:
+    """Yield the catalog as CSV or JSON lines text, one record per chunk, sorted by CaseID."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unsupported format {fmt!r} (expected one of {', '.join(FORMATS)})")
+    collection = collection if collection is not None else get_collection()
+    cursor = collection.find({}, {"_id": 0}, sort=[("CaseID", 1)], batch_size=batch_size)
+
+    if fmt == "jsonl":
+        for doc in cursor:
+            yield json.dumps({k: _export_value(v) for k, v in doc.items()}, ensure_ascii=False) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM عشان Excel يفتح العربي صح
+    buffer.write("\ufeff")
+    writer.writerow(CASE_FIELDS)
+    for doc in cursor:
+        writer.writerow([
+            ", ".join(doc.get(f) or []) if f in KEYWORD_FIELDS else _export_value(doc.get(f, ""))
+            for f in CASE_FIELDS
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import / export of cases")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="upsert cases from a CSV or JSON lines file")
+    imp.add_argument("file")
+    imp.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    imp.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    imp.add_argument("--dry-run", action="store_true", help="validate only, write nothing")
+    exp = sub.add_parser("export", help="write all cases to a CSV or JSON lines file")
+    exp.add_argument("file")
+    exp.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or format_for(args.file)
+    if fmt is None:
+        parser.error("cannot tell the format from the file name, use --format")
+
+    if args.command == "import":
+        with open(args.file, encoding="utf-8-sig", newline="") as f:
+            report = import_file(f, fmt, chunk_size=args.chunk_size, dry_run=args.dry_run)
+        print(f"Rows {report['rows']}: {report['valid']} valid, {report['invalid']} invalid | "
+              f"inserted {report['inserted']}, updated {report['updated']}"
+              + (" (dry run)" if args.dry_run else ""))
+        for error in report["errors"]:
+            print(f"  line {error['line']} {error['CaseID'] or ''}: {error['error']}")
+        if report["aborted"]:
+            print(f"Import incomplete, {report['aborted']}")
+        return 1 if report["invalid"] or report["aborted"] else 0
+
+    with open(args.file, "w", encoding="utf-8", newline="") as f:
+        f.writelines(export_cases(fmt))
+    print(f"Exported cases to {args.file}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
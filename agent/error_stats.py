@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+agent/error_stats.py
+Persistent daily error aggregates for SmartAgent.
+
+The log file stays the source of truth. ErrorStats keeps per-day, per-type
+counts in a small JSON file together with the byte offset of the log that
+has already been counted, so each refresh only parses lines appended since
+the previous one and reports cost O(days) instead of O(log size).
+"""
+
+import os
+import json
+import logging
+import threading
+from datetime import date, timedelta
+from typing import Dict, List
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorStats:
+    def __init__(self, log_file: str, stats_file: str):
+        self.log_file = log_file
+        self.stats_file = stats_file
+        self._lock = threading.Lock()
+        self.offset = 0
+        self.days: Dict[str, Dict[str, int]] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.stats_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.offset = int(data.get("offset", 0))
+            self.days = data.get("days", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to load error stats, rebuilding from log: {e}")
+            self.offset, self.days = 0, {}
+
+    def _save(self):
+        tmp = f"{self.stats_file}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"offset": self.offset, "days": self.days}, f)
+        os.replace(tmp, self.stats_file)
+
+    def refresh(self) -> "ErrorStats":
+        """Count log lines appended since the last checkpoint."""
+        with self._lock:
+            lock_fd = None
+            try:
+                if fcntl is not None:
+                    lock_fd = open(f"{self.stats_file}.lock", "w")
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                    # عملية ثانية ممكن تكون حدّثت الملف قبلنا
+                    self._load()
+
+                if not os.path.exists(self.log_file):
+                    return self
+                if os.path.getsize(self.log_file) < self.offset:
+                    # الملف انقص (تدوير/حذف) → نبدأ من أوله
+                    self.offset = 0
+
+                with open(self.log_file, "rb") as f:
+                    f.seek(self.offset)
+                    chunk = f.read()
+
+                # نعد بس الأسطر الكاملة، والباقي ينحسب في المرة الجاية
+                end = chunk.rfind(b"\n") + 1
+                if end == 0:
+                    return self
+                for raw in chunk[:end].splitlines():
+                    self._count_line(raw.decode("utf-8", errors="replace"))
+                self.offset += end
+                self._save()
+            finally:
+                if lock_fd is not None:
+                    fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                    lock_fd.close()
+        return self
+
+    def _count_line(self, line: str):
+        # مثال سطر: [2025-11-11 22:10:01.123456] ValueError: message
+        if not line.startswith("["):
+            return
+        try:
+            timestamp_str, rest = line[1:].split("]", 1)
+            day = timestamp_str[:10]
+            error_type = rest.strip().split(":", 1)[0].strip().split()[0]
+        except (ValueError, IndexError):
+            return
+        per_type = self.days.setdefault(day, {})
+        per_type[error_type] = per_type.get(error_type, 0) + 1
+
+    def count(self, day: str, error_type: str) -> int:
+        return self.days.get(day, {}).get(error_type, 0)
+
+    def report(self, days: int = 7) -> List[Dict]:
+        """Rows of {date, error_type, count} for the last `days` days, oldest first."""
+        today = date.today()
+        rows = []
+        for i in range(days - 1, -1, -1):
+            day = (today - timedelta(days=i)).isoformat()
+            for error_type, cnt in sorted(self.days.get(day, {}).items()):
+                rows.append({"date": day, "error_type": error_type, "count": cnt})
+        return rows
+
+
+_instances: Dict[str, ErrorStats] = {}
+_instances_lock = threading.Lock()
+
+
+def get_error_stats(log_file: str, stats_file: str) -> ErrorStats:
+    """Shared ErrorStats per stats file (agents are created per request)."""
+    with _instances_lock:
+        stats = _instances.get(stats_file)
+        if stats is None or stats.log_file != log_file:
+            stats = ErrorStats(log_file, stats_file)
+            _instances[stats_file] = stats
+        return stats
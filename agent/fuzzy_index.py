@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+agent/fuzzy_index.py
+Typo-tolerant term lookup backed by a character-trigram index.
+
+Candidates are the vocabulary terms sharing enough padded trigrams with the
+query word (the q-gram lemma bound for `max_edits`), so a lookup only touches
+terms that share trigrams with the word instead of the whole vocabulary.
+Candidates are then verified with a bounded Levenshtein distance.
+"""
+
+import os
+from typing import Dict, Iterable, List, Tuple
+
+FUZZY_MAX_EDITS = int(os.getenv("CALLHELPER_FUZZY_MAX_EDITS", "1"))
+FUZZY_MIN_LENGTH = int(os.getenv("CALLHELPER_FUZZY_MIN_LENGTH", "4"))
+
+_CACHE_SIZE = 10000
+
+
+def trigrams(word: str) -> List[str]:
+    padded = f"#{word}#"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def bounded_edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance of a and b, or limit + 1 once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class TrigramIndex:
+    def __init__(self, vocabulary: Iterable[str], max_edits: int = FUZZY_MAX_EDITS,
+                 min_length: int = FUZZY_MIN_LENGTH):
+        self.max_edits = max_edits
+        self.min_length = min_length
+        self.terms: List[str] = []
+        self.postings: Dict[str, List[int]] = {}
+        self._cache: Dict[str, Tuple[str, ...]] = {}
+
+        for term in vocabulary:
+            # كلمة وحدة بس؛ العبارات تتطابق بالطريقة العادية
+            if len(term) < min_length or " " in term:
+                continue
+            term_id = len(self.terms)
+            self.terms.append(term)
+            for gram in set(trigrams(term)):
+                self.postings.setdefault(gram, []).append(term_id)
+
+    def lookup(self, word: str) -> Tuple[str, ...]:
+        """Vocabulary terms within max_edits of word (memoized per word)."""
+        cached = self._cache.get(word)
+        if cached is not None:
+            return cached
+
+        matches: Tuple[str, ...] = ()
+        if len(word) >= self.min_length:
+            grams = set(trigrams(word))
+            # كل تعديل يخرب 3 trigrams على الأكثر
+            needed = len(grams) - 3 * self.max_edits
+            counts: Dict[int, int] = {}
+            for gram in grams:
+                for term_id in self.postings.get(gram, ()):
+                    counts[term_id] = counts.get(term_id, 0) + 1
+            matches = tuple(
+                self.terms[term_id]
+                for term_id, shared in counts.items()
+                if shared >= needed
+                and bounded_edit_distance(word, self.terms[term_id], self.max_edits) <= self.max_edits
+            )
+
+        if len(self._cache) >= _CACHE_SIZE:
+            self._cache.clear()
+        self._cache[word] = matches
+        return matches
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+agent/heavy_hitters.py
+Bounded-memory "popular queries" tracking.
+
+SpaceSaving keeps at most `capacity` counters: a new query evicts the
+smallest counter and inherits its count (recorded as the error bound), so
+every query seen more than N/capacity times is guaranteed to be kept.
+Queries are keyed by their normalized form, so spelling variants that
+only differ in hamza/taa marbuta/diacritics count together.
+
+HotQueryTracker keeps one sketch per hour in memory and periodically
+flushes the deltas to MongoDB with $inc: one small document per
+(date, hour, query), plus the same counts per (date, query) in a daily
+collection (<collection>_daily). Several workers flushing into the same
+hour or day simply add up.
+
+A failed write is retried on the next flush: hourly rows that were not
+written stay queued (all of them when the error does not say which were
+applied), and daily totals are only taken from hourly rows
+that were, and are kept until the daily write succeeds, so both
+collections converge (rebuild_daily() also recomputes the daily one from
+the hourly rows). At most CALLHELPER_HOT_QUERIES_MAX_RETRY_ROWS hourly
+rows wait for a retry; beyond that the oldest are dropped.
+
+Reads never touch the hourly rows. top() serves a per-window snapshot
+aggregated from the daily collection, refreshed in the background every
+CALLHELPER_HOT_QUERIES_SNAPSHOT_SECONDS, so counts lag by up to the flush
+plus snapshot intervals. Only the first read of a window waits for the
+aggregation.
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .text_normalizer import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Configuration with environment variable support
+HOT_QUERIES_CAPACITY = int(os.getenv("CALLHELPER_HOT_QUERIES_CAPACITY", "200"))
+HOT_QUERIES_FLUSH_SECONDS = float(os.getenv("CALLHELPER_HOT_QUERIES_FLUSH_SECONDS", "60"))
+HOT_QUERIES_RETENTION_DAYS = int(os.getenv("CALLHELPER_HOT_QUERIES_RETENTION_DAYS", "365"))
+HOT_QUERIES_SNAPSHOT_SECONDS = float(os.getenv("CALLHELPER_HOT_QUERIES_SNAPSHOT_SECONDS", "60"))
+HOT_QUERIES_MAX_RETRY_ROWS = int(os.getenv("CALLHELPER_HOT_QUERIES_MAX_RETRY_ROWS", "50000"))
+# Windows (start date, limit) kept as snapshots
+_MAX_SNAPSHOTS = 64
+
+
+class SpaceSaving:
+    """Space-Saving top-k counter over at most `capacity` keys."""
+
+    __slots__ = ("capacity", "counts", "errors", "labels")
+
+    def __init__(self, capacity: int = HOT_QUERIES_CAPACITY):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        # أول صيغة شفناها للاستعلام (للعرض بدل النص المطبّع)
+        self.labels: Dict[str, str] = {}
+
+    def offer(self, key: str, label: Optional[str] = None, n: int = 1):
+        if key in self.counts:
+            self.counts[key] += n
+            return
+        floor = 0
+        if len(self.counts) >= self.capacity:
+            victim = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(victim)
+            del self.errors[victim]
+            del self.labels[victim]
+        self.counts[key] = floor + n
+        self.errors[key] = floor
+        self.labels[key] = label or key
+
+    def merge(self, other: "SpaceSaving"):
+        for key, n in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + n
+            self.errors[key] = self.errors.get(key, 0) + other.errors[key]
+            self.labels.setdefault(key, other.labels[key])
+        if len(self.counts) > self.capacity:
+            for key, _ in self.top(len(self.counts))[self.capacity:]:
+                del self.counts[key], self.errors[key], self.labels[key]
+
+    def top(self, k: int) -> List[Tuple[str, int]]:
+        """[(key, count)] for the k largest counters."""
+        return sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class HotQueryTracker:
+    """Per-hour SpaceSaving sketches, flushed to a MongoDB collection in the background."""
+
+    def __init__(self, collection, capacity: int = HOT_QUERIES_CAPACITY,
+                 flush_seconds: float = HOT_QUERIES_FLUSH_SECONDS,
+                 retention_days: int = HOT_QUERIES_RETENTION_DAYS,
+                 snapshot_seconds: float = HOT_QUERIES_SNAPSHOT_SECONDS, daily_collection=None):
+        self.collection = collection
+        self.daily_collection = (daily_collection if daily_collection is not None
+                                 else collection.database[f"{collection.name}_daily"])
+        self.capacity = capacity
+        self.flush_seconds = flush_seconds
+        self.retention_days = retention_days
+        self.snapshot_seconds = snapshot_seconds
+        self._pending: Dict[Tuple[str, int], SpaceSaving] = {}
+        # ما انكتب في المحاولة السابقة: (UpdateOne الساعة, (date, key, count, error, label, expire_at))
+        self._unwritten_hourly: List[Tuple[UpdateOne, tuple]] = []
+        # (date, key) → [count, error, label, expire_at] لصفوف الساعة اللي انكتبت بس
+        self._unwritten_daily: Dict[Tuple[str, str], list] = {}
+        # (start_date, limit) → (loaded_at, rows)
+        self._snapshots: Dict[Tuple[Optional[str], int], Tuple[float, List[dict]]] = {}
+        self._refreshing = set()
+        # يزيد كل ما تغيرت نتيجة snapshot (يدخل في ETag الصفحة)
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="hot-query-flusher", daemon=True
+                )
+                self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def record(self, query: str, at: Optional[datetime] = None):
+        key = normalize_query(query or "")[0]
+        if not key:
+            return
+        at = at or datetime.utcnow()
+        hour = (at.strftime("%Y-%m-%d"), at.hour)
+        with self._lock:
+            sketch = self._pending.get(hour)
+            if sketch is None:
+                sketch = self._pending[hour] = SpaceSaving(self.capacity)
+            sketch.offer(key, query.strip())
+
+    def pending_count(self) -> int:
+        """Counters recorded but not flushed yet."""
+        with self._lock:
+            return sum(len(sketch) for sketch in self._pending.values()) + len(self._unwritten_hourly)
+
+    @staticmethod
+    def _write(collection, ops) -> List[int]:
+        """bulk_write `ops`; returns the positions of the ops that were not applied."""
+        if not ops:
+            return []
+        try:
+            collection.bulk_write(ops, ordered=False)
+            return []
+        except BulkWriteError as e:
+            # unordered: الباقي انكتب
+            failed = sorted(err["index"] for err in e.details.get("writeErrors", []))
+        except Exception:
+            failed = list(range(len(ops)))
+        logger.error(f"Failed to flush popular queries to {collection.name}: "
+                     f"{len(failed)} of {len(ops)} rows will be retried")
+        return failed
+
+    def flush(self) -> int:
+        """Write pending counts with $inc. Returns the number of hourly rows written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            hourly, self._unwritten_hourly = self._unwritten_hourly, []
+            for (date, hour), sketch in pending.items():
+                expire_at = datetime.strptime(date, "%Y-%m-%d") + timedelta(hours=hour, days=self.retention_days)
+                for key, count in sketch.counts.items():
+                    label, error = sketch.labels[key], sketch.errors[key]
+                    hourly.append((UpdateOne(
+                        {"date": date, "hour": hour, "key": key},
+                        {
+                            "$inc": {"count": count, "error": error},
+                            "$setOnInsert": {"query": label, "expire_at": expire_at},
+                        },
+                        upsert=True,
+                    ), (date, key, count, error, label, expire_at)))
+
+            failed = set(self._write(self.collection, [op for op, _ in hourly]))
+            daily = self._unwritten_daily
+            for i, (op, (date, key, count, error, label, expire_at)) in enumerate(hourly):
+                if i in failed:
+                    self._unwritten_hourly.append((op, (date, key, count, error, label, expire_at)))
+                    continue
+                totals = daily.setdefault((date, key), [0, 0, label, expire_at])
+                totals[0] += count
+                totals[1] += error
+                totals[3] = max(totals[3], expire_at)
+            overflow = len(self._unwritten_hourly) - HOT_QUERIES_MAX_RETRY_ROWS
+            if overflow > 0:
+                logger.error(f"Dropping {overflow} popular-query rows that could not be written")
+                del self._unwritten_hourly[:overflow]
+
+            keys = list(daily)
+            daily_ops = [
+                UpdateOne(
+                    {"date": date, "key": key},
+                    {
+                        "$inc": {"count": count, "error": error},
+                        "$setOnInsert": {"query": label},
+                        "$max": {"expire_at": expire_at},
+                    },
+                    upsert=True,
+                )
+                for (date, key), (count, error, label, expire_at) in daily.items()
+            ]
+            self._unwritten_daily = {keys[i]: daily[keys[i]] for i in self._write(self.daily_collection, daily_ops)}
+            return len(hourly) - len(failed)
+
+    def query_top(self, limit: int = 10, start_date: Optional[str] = None) -> List[dict]:
+        """Aggregate the daily collection (what top() snapshots)."""
+        pipeline = [
+            # أقدم صيغة محفوظة هي اللي تنعرض
+            {"$sort": {"date": 1}},
+            {"$group": {"_id": "$key", "query": {"$first": "$query"}, "count": {"$sum": "$count"}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": limit},
+            {"$project": {"_id": 0, "query": 1, "count": 1}},
+        ]
+        if start_date:
+            pipeline.insert(0, {"$match": {"date": {"$gte": start_date}}})
+        return list(self.daily_collection.aggregate(pipeline))
+
+    def top(self, limit: int = 10, start_date: Optional[str] = None) -> List[dict]:
+        """
+        Most frequent queries since start_date ("YYYY-MM-DD", None = all
+        kept history), from the window's snapshot. A stale snapshot is
+        returned as is and refreshed in the background.
+        """
+        window = (start_date, limit)
+        cached = self._snapshots.get(window)
+        if cached is None:
+            return self._refresh(window)
+        if time.monotonic() - cached[0] >= self.snapshot_seconds:
+            with self._lock:
+                if window not in self._refreshing:
+                    self._refreshing.add(window)
+                    threading.Thread(target=self._refresh, args=(window,),
+                                     name="hot-query-snapshot", daemon=True).start()
+        return cached[1]
+
+    def _refresh(self, window) -> List[dict]:
+        try:
+            rows = self.query_top(window[1], window[0])
+        except Exception as e:
+            logger.error(f"Failed to load popular queries: {e}")
+            cached = self._snapshots.get(window)
+            if cached is None:
+                raise
+            rows = cached[1]
+        finally:
+            with self._lock:
+                self._refreshing.discard(window)
+        with self._lock:
+            previous = self._snapshots.get(window)
+            if previous is None or previous[1] != rows:
+                self.generation += 1
+            if previous is None and len(self._snapshots) >= _MAX_SNAPSHOTS:
+                # أقدم نافذة (غالباً start_date أمس)
+                del self._snapshots[min(self._snapshots, key=lambda w: self._snapshots[w][0])]
+            self._snapshots[window] = (time.monotonic(), rows)
+        return rows
+
+    def rebuild_daily(self):
+        """Recompute the daily collection from the hourly rows (after upgrading)."""
+        self.daily_collection.delete_many({})
+        self.collection.aggregate([
+            {"$sort": {"date": 1, "hour": 1}},
+            {"$group": {
+                "_id": {"date": "$date", "key": "$key"},
+                "query": {"$first": "$query"},
+                "count": {"$sum": "$count"},
+                "error": {"$sum": "$error"},
+                "expire_at": {"$max": "$expire_at"},
+            }},
+            {"$project": {"_id": 0, "date": "$_id.date", "key": "$_id.key",
+                          "query": 1, "count": 1, "error": 1, "expire_at": 1}},
+            {"$merge": {"into": self.daily_collection.name, "on": ["date", "key"]}},
+        ], allowDiskUse=True)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+
+_tracker: Optional[HotQueryTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_hot_query_tracker(collection) -> HotQueryTracker:
+    """Process-wide tracker for `collection` (started on first use, flushed at exit)."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = HotQueryTracker(collection)
+            _tracker.start()
+            atexit.register(_tracker.close)
+        return _tracker
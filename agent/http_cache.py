@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+agent/http_cache.py
+Response compression and ETag helpers for the Flask app.
+
+- choose_encoding() / compress(): gzip or deflate for responses above
+  CALLHELPER_COMPRESS_MIN_BYTES, negotiated from Accept-Encoding.
+- make_etag() / etag_matches(): weak ETags derived from data versions
+  (catalog version, interaction log fingerprint) rather than from the
+  body, so a matching If-None-Match is answered with 304 before the view
+  queries or serializes anything. Weak ETags stay valid when the body is
+  compressed.
+- VersionCache: memoizes a version lookup for a short TTL so a dashboard
+  refreshing several panels at once costs a single fingerprint query.
+"""
+
+import os
+import gzip
+import zlib
+import time
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+COMPRESS_MIN_BYTES = int(os.getenv("CALLHELPER_COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.getenv("CALLHELPER_COMPRESS_LEVEL", "6"))
+COMPRESS_MIMETYPES = frozenset((
+    "application/json", "application/x-ndjson", "text/html", "text/plain", "text/csv",
+))
+# How long a data version is reused before it is looked up again
+ETAG_TTL_SECONDS = float(os.getenv("CALLHELPER_ETAG_TTL_SECONDS", "1"))
+
+# الأفضلية عند تساوي q
+_ENCODINGS = ("gzip", "deflate")
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best supported content coding for an Accept-Encoding header, or None."""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding] = q
+    wildcard = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for coding in _ENCODINGS:
+        q = weights.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(data: bytes, encoding: str, level: int = COMPRESS_LEVEL) -> bytes:
+    if encoding == "gzip":
+        # mtime=0: نفس المحتوى يعطي نفس البايتات
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == "deflate":
+        return zlib.compress(data, level)
+    raise ValueError(f"unsupported encoding {encoding!r}")
+
+
+def make_etag(*parts: Any) -> str:
+    """Weak ETag over the given version parts (request path, data versions, ...)."""
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against `etag`."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = _opaque(etag)
+    return any(_opaque(tag) == wanted for tag in if_none_match.split(","))
+
+
+class VersionCache:
+    """Memoize version lookups by key for `ttl` seconds (thread-safe)."""
+
+    def __init__(self, ttl: float = ETAG_TTL_SECONDS):
+        self.ttl = ttl
+        self._values: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, lookup: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        cached = self._values.get(key)
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached[1]
+        value = lookup()
+        with self._lock:
+            self._values[key] = (now, value)
+        return value
+
+
+version_cache = VersionCache()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+agent/latency_sketch.py
+Mergeable latency quantile sketch (DDSketch-style).
+
+Values are counted in logarithmic bins whose width guarantees a relative
+error of RELATIVE_ACCURACY on every quantile. A sketch is just a map of
+bin key -> count, so two sketches merge by adding counts. That makes it
+safe to maintain with $inc from any number of workers: each interaction
+increments one bin in its hourly rollup document, and hours/days/user
+types are merged at query time without touching the raw logs.
+"""
+
+import math
+from typing import Dict, Iterable, Optional
+
+# 1% relative error. Changing it invalidates stored bins (run
+# `python -m agent.log_archive rebuild-rollups` afterwards).
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Values at or below this (ms) go to the zero bin
+MIN_VALUE = 1e-3
+ZERO_KEY = "z"
+
+
+def bin_key(value: float) -> str:
+    """Bin key (a string, so it can be a MongoDB field name) for a latency value."""
+    if value <= MIN_VALUE:
+        return ZERO_KEY
+    return str(math.ceil(math.log(value) / LOG_GAMMA))
+
+
+def _bin_value(key: str) -> float:
+    if key == ZERO_KEY:
+        return 0.0
+    index = int(key)
+    # نقطة المنتصف (بالنسبة) بين حدود البن
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class LatencySketch:
+    """Quantile sketch over positive values (milliseconds)."""
+
+    __slots__ = ("bins", "count")
+
+    def __init__(self, bins: Optional[Dict[str, int]] = None):
+        self.bins: Dict[str, int] = {}
+        self.count = 0
+        if bins:
+            self.merge_bins(bins)
+
+    def add(self, value: float, count: int = 1):
+        key = bin_key(value)
+        self.bins[key] = self.bins.get(key, 0) + count
+        self.count += count
+
+    def merge_bins(self, bins: Dict[str, int]):
+        for key, n in bins.items():
+            self.bins[key] = self.bins.get(key, 0) + n
+            self.count += n
+
+    def merge(self, other: "LatencySketch"):
+        self.merge_bins(other.bins)
+
+    def _ordered(self):
+        return sorted(self.bins.items(), key=lambda kv: -math.inf if kv[0] == ZERO_KEY else int(kv[0]))
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile q (0..1), or None when the sketch is empty."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key, n in self._ordered():
+            seen += n
+            if seen > rank:
+                return _bin_value(key)
+        return _bin_value(self._ordered()[-1][0])
+
+    def quantiles(self, qs: Iterable[float] = (0.5, 0.9, 0.99)) -> Dict[str, Optional[float]]:
+        """{"p50": .., "p90": .., "p99": ..} rounded to 2 decimals."""
+        result = {}
+        for q in qs:
+            value = self.quantile(q)
+            result[f"p{q * 100:g}"] = round(value, 2) if value is not None else None
+        return result
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+agent/log_archive.py
+Retention and archival for interaction logs.
+
+In the "timeseries" and "bucketed" storage modes (CALLHELPER_LOG_STORAGE)
+raw events are kept for CALLHELPER_LOG_RETENTION_DAYS. Older days are
+exported to gzip-compressed JSON lines files (one per day) and removed
+from MongoDB, while the hourly rollups stay. TTL indexes delete anything
+that was never archived a few days later as a safety net.
+
+Deleting archived days from a time-series collection needs MongoDB 7.0
+or later (older servers only delete by the metaField, user_type). On an
+older server `archive` stops before writing anything; the collection's
+TTL (expireAfterSeconds) still removes old events, or use the "bucketed"
+mode to archive them.
+
+CLI:
+    python -m agent.log_archive archive [--dir log_archive] [--days 90]
+    python -m agent.log_archive rebuild-rollups   # backfill rollups from raw events
+    python -m agent.log_archive rebuild-hot-queries   # backfill popular queries from raw events
+    python -m agent.log_archive rebuild-hot-queries --from-hourly   # daily counts from hourly ones
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import argparse
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from . import analytics_helper
+from .heavy_hitters import HotQueryTracker
+from .latency_sketch import MIN_VALUE, ZERO_KEY, LOG_GAMMA
+from .analytics_helper import (
+    LOG_STORAGE, LOG_RETENTION_DAYS, logs_collection, buckets_collection, rollups_collection,
+    hot_queries_collection, hot_queries_daily_collection
+)
+
+ARCHIVE_DIR = os.environ.get("CALLHELPER_LOG_ARCHIVE_DIR", "log_archive")
+# أول نسخة تسمح بحذف من time-series بشرط على غير metaField
+TIMESERIES_DELETE_VERSION = (7, 0)
+
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def _archive_path(out_dir: str, day: str) -> str:
+    path = os.path.join(out_dir, f"interaction_logs-{day}.jsonl.gz")
+    n = 1
+    # لو اليوم انأرشف قبل (أحداث متأخرة) ما نكتب فوقه
+    while os.path.exists(path):
+        path = os.path.join(out_dir, f"interaction_logs-{day}.{n}.jsonl.gz")
+        n += 1
+    return path
+
+
+def _raw_days():
+    source = buckets_collection if LOG_STORAGE == "bucketed" else logs_collection
+    return sorted(source.distinct("date"))
+
+
+def _day_events(day: str):
+    if LOG_STORAGE == "bucketed":
+        for bucket in buckets_collection.find({"date": day}).sort("hour_start", 1):
+            yield from bucket.get("events", [])
+    else:
+        yield from logs_collection.find({"date": day}, {"_id": 0}).sort("timestamp", 1)
+
+
+def _server_version(collection) -> tuple:
+    version = collection.database.client.server_info().get("version", "0")
+    return tuple(int(p) for p in re.findall(r"\d+", version)[:2])
+
+
+def _delete_day(source, day: str):
+    if LOG_STORAGE == "timeseries":
+        # time-series: بحقل الوقت (date مشتق من timestamp بتوقيت UTC)
+        start = datetime.strptime(day, "%Y-%m-%d")
+        source.delete_many({"timestamp": {"$gte": start, "$lt": start + timedelta(days=1)}})
+    else:
+        source.delete_many({"date": day})
+
+
+def iter_events(start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """Raw events still in MongoDB, day by day in time order (dates are "YYYY-MM-DD", inclusive)."""
+    for day in _raw_days():
+        if (start_date and day < start_date) or (end_date and day > end_date):
+            continue
+        yield from _day_events(day)
+
+
+def archive_expired_days(retention_days: int = LOG_RETENTION_DAYS, out_dir: str = ARCHIVE_DIR) -> List[str]:
+    """
+    Export every day older than the retention window to out_dir and delete
+    its raw events. Returns the written file paths.
+    """
+    if LOG_STORAGE == "events":
+        # في وضع events الإحصائيات تعتمد على الأحداث الخام، فما نحذفها
+        raise RuntimeError("Archiving requires CALLHELPER_LOG_STORAGE=timeseries or bucketed")
+
+    source = buckets_collection if LOG_STORAGE == "bucketed" else logs_collection
+    if LOG_STORAGE == "timeseries":
+        version = _server_version(source)
+        if version < TIMESERIES_DELETE_VERSION:
+            raise RuntimeError(
+                f"Archiving a time-series collection needs MongoDB "
+                f"{'.'.join(map(str, TIMESERIES_DELETE_VERSION))}+ (server is {'.'.join(map(str, version))}): "
+                f"older servers cannot delete archived days. Raw events still expire through the "
+                f"collection's TTL; use CALLHELPER_LOG_STORAGE=bucketed to archive them on this server.")
+
+    os.makedirs(out_dir, exist_ok=True)
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+
+    written = []
+    for day in sorted(source.distinct("date", {"date": {"$lt": cutoff}})):
+        path = _archive_path(out_dir, day)
+        tmp = f"{path}.tmp"
+        count = 0
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for event in _day_events(day):
+                event.pop("_id", None)
+                f.write(json.dumps(event, ensure_ascii=False, default=_json_default) + "\n")
+                count += 1
+        os.replace(tmp, path)
+        try:
+            _delete_day(source, day)
+        except Exception:
+            # اليوم باقي في مونقو: نشيل الملف عشان التشغيل الجاي ما يأرشفه مرتين
+            os.remove(path)
+            raise
+        written.append(path)
+        print(f"Archived {count} events for {day} → {path}")
+    return written
+
+
+def rebuild_rollups():
+    """
+    Recompute rollups (counters and latency sketches) from the raw events
+    still in MongoDB, e.g. after switching modes.
+    """
+    fields = {"date": "$date", "hour": "$hour", "user_type": "$user_type", "interaction_type": "$interaction_type"}
+    group = {
+        "count": {"$sum": 1},
+        "successful": {"$sum": {"$cond": ["$success", 1, 0]}},
+        "response_time_sum": {"$sum": {"$ifNull": ["$response_time_ms", 0]}},
+        "response_time_count": {"$sum": {"$cond": [{"$eq": [{"$ifNull": ["$response_time_ms", None]}, None]}, 0, 1]}},
+    }
+    unwind = []
+    if LOG_STORAGE == "bucketed":
+        unwind = [{"$unwind": "$events"}, {"$replaceRoot": {"newRoot": "$events"}}]
+    pipeline = unwind + [{"$group": {"_id": fields, **group}}]
+    pipeline += [
+        {"$project": {"_id": 0, **{k: f"$_id.{k}" for k in fields}, **{k: 1 for k in group}}},
+        {"$merge": {
+            "into": rollups_collection.name,
+            "on": list(fields),
+            "whenMatched": "replace",
+            "whenNotMatched": "insert",
+        }},
+    ]
+    # نفس حساب bin_key() في agent/latency_sketch.py
+    bin_key = {"$cond": [
+        {"$lte": ["$response_time_ms", MIN_VALUE]},
+        ZERO_KEY,
+        {"$toString": {"$toLong": {"$ceil": {"$divide": [{"$ln": "$response_time_ms"}, LOG_GAMMA]}}}},
+    ]}
+    bins_pipeline = unwind + [
+        {"$match": {"response_time_ms": {"$type": "number"}}},
+        {"$group": {"_id": {**fields, "bin": bin_key}, "n": {"$sum": 1}}},
+        {"$group": {
+            "_id": {k: f"$_id.{k}" for k in fields},
+            "bins": {"$push": {"k": "$_id.bin", "v": "$n"}},
+        }},
+        {"$project": {"_id": 0, **{k: f"$_id.{k}" for k in fields}, "latency_bins": {"$arrayToObject": "$bins"}}},
+        {"$merge": {
+            "into": rollups_collection.name,
+            "on": list(fields),
+            "whenMatched": "merge",
+            "whenNotMatched": "discard",
+        }},
+    ]
+    source = buckets_collection if LOG_STORAGE == "bucketed" else logs_collection
+    list(source.aggregate(pipeline))
+    # the replace above drops latency_bins; add them back from the same events
+    list(source.aggregate(bins_pipeline))
+
+
+def rebuild_hot_queries() -> int:
+    """
+    Recompute the popular-query counts from the raw events still in MongoDB.
+    Replaces the existing counts; run it once after upgrading or when no
+    server is logging. Returns the number of events counted.
+    """
+    hot_queries_collection.delete_many({})
+    hot_queries_daily_collection.delete_many({})
+    # tracker مستقل (بدون خيط خلفي)، ونكتب كل يوم لحاله عشان الذاكرة تبقى محدودة
+    tracker = HotQueryTracker(hot_queries_collection, daily_collection=hot_queries_daily_collection)
+    count = 0
+    for day in _raw_days():
+        for event in _day_events(day):
+            tracker.record(event.get("query") or "", event["timestamp"])
+            count += 1
+        tracker.flush()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Interaction log retention tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    archive = sub.add_parser("archive", help="export and delete days older than the retention window")
+    archive.add_argument("--dir", default=ARCHIVE_DIR)
+    archive.add_argument("--days", type=int, default=LOG_RETENTION_DAYS)
+    sub.add_parser("rebuild-rollups", help="recompute rollups from raw events")
+    hot = sub.add_parser("rebuild-hot-queries", help="recompute popular-query counts from raw events")
+    hot.add_argument("--from-hourly", action="store_true",
+                     help="only rebuild the daily counts from the hourly ones (keeps history older than raw events)")
+    args = parser.parse_args(argv)
+
+    if args.command == "archive":
+        files = archive_expired_days(args.days, args.dir)
+        print(f"Archived {len(files)} day(s) (storage: {analytics_helper.LOG_STORAGE})")
+    elif args.command == "rebuild-hot-queries" and args.from_hourly:
+        HotQueryTracker(hot_queries_collection, daily_collection=hot_queries_daily_collection).rebuild_daily()
+        print("Daily popular-query counts rebuilt from hourly counts")
+    elif args.command == "rebuild-hot-queries":
+        print(f"Counted {rebuild_hot_queries()} events into popular queries")
+    else:
+        rebuild_rollups()
+        print("Rollups rebuilt")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
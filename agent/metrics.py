@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+"""
+agent/metrics.py
+In-process metrics registry with Prometheus text exposition.
+
+Counters, gauges and histograms live in plain dicts guarded by a lock.
+With several gunicorn workers, set CALLHELPER_METRICS_DIR to a directory
+shared by the workers: each process then writes a snapshot of its values
+to <dir>/metrics-<pid>-<start>.json every CALLHELPER_METRICS_FLUSH_SECONDS
+(and right before it serves /metrics), and render() merges every snapshot.
+<start> is the process start time, so a recycled worker whose pid is
+reused never overwrites the previous owner's file. Counters and
+histograms of exited workers are folded into <dir>/archive.json and
+their files removed (at exit, or by the next render() if the worker was
+killed), so totals never go backwards and the directory doesn't grow
+with every recycled worker. Gauges only count live processes and are
+combined per metric with `multiprocess_mode` ("sum", "max", "min" or
+"all", which adds a pid label).
+
+Collect callbacks (add_collect_callback) run before every snapshot, for
+gauges that are cheaper to read on demand than to keep up to date.
+"""
+
+import os
+import json
+import uuid
+import atexit
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Configuration with environment variable support
+METRICS_DIR = os.getenv("CALLHELPER_METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("CALLHELPER_METRICS_FLUSH_SECONDS", "5"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# Totals of exited processes, in the metrics directory
+ARCHIVE_FILE = "archive.json"
+
+
+class _Child:
+    """A metric bound to one set of label values (cached, so labels() doesn't allocate)."""
+
+    __slots__ = ("_metric", "_key")
+
+    def __init__(self, metric, key: Tuple[str, ...]):
+        self._metric = metric
+        self._key = key
+
+    def inc(self, amount: float = 1):
+        self._metric._inc(self._key, amount)
+
+    def dec(self, amount: float = 1):
+        self._metric._inc(self._key, -amount)
+
+    def set(self, value: float):
+        self._metric._set(self._key, value)
+
+    def observe(self, value: float):
+        self._metric._observe(self._key, value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._children: Dict[Tuple[str, ...], _Child] = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values, **kwargs) -> _Child:
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children.setdefault(key, _Child(self, key))
+        return child
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[list]:
+        with self._lock:
+            return [[list(key), value if not isinstance(value, list) else value[:]]
+                    for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1):
+        self._inc((), amount)
+
+    def _inc(self, key, amount):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 multiprocess_mode: str = "sum", registry: Optional["Registry"] = None):
+        self.multiprocess_mode = multiprocess_mode
+        super().__init__(name, documentation, labelnames, registry)
+
+    def set(self, value: float):
+        self._set((), value)
+
+    def inc(self, amount: float = 1):
+        self._inc((), amount)
+
+    def dec(self, amount: float = 1):
+        self._inc((), -amount)
+
+    def _set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+    def _inc(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float):
+        self._observe((), value)
+
+    def _observe(self, key, value):
+        # [count per bucket..., count above the last bucket, sum]
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+_INF = 'le="+Inf"'
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _process_start(pid: int) -> Optional[str]:
+    """Start time of a process (Linux), to tell a reused pid apart. None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+        # اسم العملية ممكن فيه مسافات وأقواس، فنعد الحقول بعد آخر ")"
+        return stat.rsplit(b")", 1)[1].split()[19].decode("ascii")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _snapshot_alive(snap: dict) -> bool:
+    pid = snap.get("pid")
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return snap.get("started") == _own_start()[1]
+    if not _pid_alive(pid):
+        return False
+    started = snap.get("started")
+    return started is None or started == _process_start(pid)
+
+
+_own = (None, None)
+
+
+def _own_start():
+    """(pid, start id) of this process, recomputed after a fork."""
+    global _own
+    pid = os.getpid()
+    if _own[0] != pid:
+        _own = (pid, _process_start(pid) or uuid.uuid4().hex[:12])
+    return _own
+
+
+def _load_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # بيتكتب الحين أو تالف
+
+
+class Registry:
+    def __init__(self, directory: str = METRICS_DIR, flush_seconds: float = METRICS_FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._metrics: Dict[str, _Metric] = {}
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._files_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def add_collect_callback(self, callback: Callable[[], None]):
+        self._callbacks.append(callback)
+        self.start()
+
+    def _collect(self):
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Metrics collect callback failed: {e}")
+
+    def snapshot(self) -> dict:
+        self._collect()
+        return {
+            name: {
+                "type": m.type,
+                "help": m.documentation,
+                "labelnames": list(m.labelnames),
+                "buckets": list(getattr(m, "buckets", ())),
+                "mode": getattr(m, "multiprocess_mode", ""),
+                "samples": m.samples(),
+            }
+            for name, m in list(self._metrics.items())
+        }
+
+    # ---- multi-process ----
+
+    def _path(self) -> str:
+        pid, started = _own_start()
+        return os.path.join(self.directory, f"metrics-{pid}-{started}.json")
+
+    @staticmethod
+    def _write_json(path: str, data: dict):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def write_snapshot(self):
+        """Write this process's snapshot to the shared directory (atomic replace)."""
+        if not self.directory:
+            return
+        pid, started = _own_start()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._write_json(self._path(), {"pid": pid, "started": started, "metrics": self.snapshot()})
+        except OSError as e:
+            logger.error(f"Failed to write metrics snapshot: {e}")
+
+    @contextmanager
+    def _directory_lock(self):
+        """Serialize archive updates across threads and (with fcntl) worker processes."""
+        with self._files_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, ".lock"), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_snapshots(self, retire: Optional[str] = None) -> List[dict]:
+        """
+        Snapshots of live processes plus the archive. Files of exited
+        processes (and `retire`, this process's own file at exit) are first
+        folded into the archive and removed.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._directory_lock():
+            archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+            archive = _load_json(archive_path)
+            live, dead, dead_paths = [], [], []
+            for filename in os.listdir(self.directory):
+                if not (filename.startswith("metrics-") and filename.endswith(".json")):
+                    continue
+                path = os.path.join(self.directory, filename)
+                snap = _load_json(path)
+                if snap is None:
+                    continue
+                if path == retire or not _snapshot_alive(snap):
+                    dead.append(snap)
+                    dead_paths.append(path)
+                else:
+                    live.append(snap)
+            if dead:
+                # الـ gauges تنحذف هنا لأن العملية ميتة؛ العدادات تنضاف للأرشيف
+                archive = {"pid": None, "metrics": self._merge(([archive] if archive else []) + dead)}
+                try:
+                    self._write_json(archive_path, archive)
+                    for path in dead_paths:
+                        os.remove(path)
+                except OSError as e:
+                    logger.error(f"Failed to archive metrics of exited workers: {e}")
+        return live + ([archive] if archive else [])
+
+    def _retire(self):
+        """At exit: write a last snapshot and fold it into the archive."""
+        self.write_snapshot()
+        try:
+            self._read_snapshots(retire=self._path())
+        except OSError as e:
+            logger.error(f"Failed to archive metrics at exit: {e}")
+
+    def start(self):
+        """Start the background snapshot writer (multi-process mode only)."""
+        if not self.directory:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self._retire)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.write_snapshot()
+
+    @staticmethod
+    def _merge(snapshots: List[dict]) -> dict:
+        merged: Dict[str, dict] = {}
+        for snap in snapshots:
+            pid = snap.get("pid")
+            alive = _snapshot_alive(snap)
+            for name, metric in snap.get("metrics", {}).items():
+                out = merged.setdefault(name, {**metric, "samples": {}})
+                if metric["type"] == "gauge":
+                    if not alive:
+                        continue
+                    mode = metric.get("mode") or "sum"
+                    for labels, value in metric["samples"]:
+                        if mode == "all":
+                            out["samples"][tuple(labels) + (str(pid),)] = value
+                            continue
+                        key = tuple(labels)
+                        if key not in out["samples"]:
+                            out["samples"][key] = value
+                        elif mode == "max":
+                            out["samples"][key] = max(out["samples"][key], value)
+                        elif mode == "min":
+                            out["samples"][key] = min(out["samples"][key], value)
+                        else:
+                            out["samples"][key] += value
+                    if mode == "all" and "pid" not in out["labelnames"]:
+                        out["labelnames"] = out["labelnames"] + ["pid"]
+                elif metric["type"] == "histogram":
+                    for labels, row in metric["samples"]:
+                        key = tuple(labels)
+                        current = out["samples"].get(key)
+                        out["samples"][key] = row if current is None else [a + b for a, b in zip(current, row)]
+                else:
+                    for labels, value in metric["samples"]:
+                        key = tuple(labels)
+                        out["samples"][key] = out["samples"].get(key, 0) + value
+        for metric in merged.values():
+            metric["samples"] = [[list(k), v] for k, v in metric["samples"].items()]
+        return merged
+
+    # ---- exposition ----
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        if self.directory:
+            self.write_snapshot()
+            metrics = self._merge(self._read_snapshots())
+        else:
+            metrics = self.snapshot()
+
+        lines = []
+        for name in sorted(metrics):
+            metric = metrics[name]
+            names = metric["labelnames"]
+            lines.append(f"# HELP {name} {_escape(metric['help'])}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labels, value in sorted(metric["samples"]):
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{_labels(names, labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric["buckets"], value):
+                    cumulative += count
+                    le = f'le="{_number(float(bound))}"'
+                    lines.append(f"{name}_bucket{_labels(names, labels, le)} {cumulative}")
+                cumulative += value[-2]
+                lines.append(f"{name}_bucket{_labels(names, labels, _INF)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(names, labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(names, labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ---- CallHelper metrics ----
+
+HTTP_REQUESTS = Counter(
+    "callhelper_http_requests_total", "HTTP requests by endpoint, method and status",
+    ("endpoint", "method", "status"))
+HTTP_LATENCY = Histogram(
+    "callhelper_http_request_duration_seconds", "HTTP request latency by endpoint", ("endpoint",))
+STAGE_LATENCY = Histogram(
+    "callhelper_stage_duration_seconds", "Time spent per request stage (see agent/stage_timer.py)",
+    ("endpoint", "stage"), buckets=FAST_BUCKETS)
+
+AGENT_ERRORS = Counter(
+    "callhelper_agent_errors_total", "Errors logged by agents, by exception type", ("error_type",))
+INTERACTIONS = Counter(
+    "callhelper_interactions_total", "Logged interactions by type and outcome",
+    ("interaction_type", "success"))
+INTERACTION_LOG_FAILURES = Counter(
+    "callhelper_interaction_log_failures_total", "Interactions that could not be written to MongoDB")
+
+ALERTS = Counter(
+    "callhelper_alerts_total", "Error alerts by outcome (queued, dropped, sent, failed)", ("outcome",))
+ALERT_QUEUE_DEPTH = Gauge(
+    "callhelper_alert_queue_depth", "Alerts waiting in the dispatcher queue or aggregation window")
+HOT_QUERIES_PENDING = Gauge(
+    "callhelper_hot_queries_pending", "Popular-query counters waiting to be flushed to MongoDB")
+CHAT_SESSIONS = Gauge(
+    "callhelper_chat_sessions", "Active chat sessions held in memory")
+
+CASE_INDEX_CASES = Gauge(
+    "callhelper_case_index_cases", "Cases in each cached partition index",
+    ("collection", "partition"), multiprocess_mode="max")
+CASE_INDEX_AGE = Gauge(
+    "callhelper_case_index_age_seconds", "Seconds since each cached collection was fetched from MongoDB",
+    ("collection",), multiprocess_mode="max")
+CASE_INDEX_BUILDS = Counter(
+    "callhelper_case_index_builds_total", "Case index (re)builds", ("collection",))
+
+MONGO_LATENCY = Histogram(
+    "callhelper_mongo_command_duration_seconds", "MongoDB command latency by command",
+    ("command",), buckets=FAST_BUCKETS)
+MONGO_FAILURES = Counter(
+    "callhelper_mongo_command_failures_total", "Failed MongoDB commands by command", ("command",))
@@ -6,29 +6,102 @@ MongoDB helper functions for CRUD operations on the CallHelper database.
 
 import os
 import logging
-from typing import Dict, Any, List, Optional
-from pymongo import MongoClient
+from typing import Callable, Dict, Any, List, Optional
+from pymongo import MongoClient, ReturnDocument, monitoring
 from pymongo.collection import Collection
 from datetime import datetime, timezone
 
+from .metrics import MONGO_LATENCY, MONGO_FAILURES
+
 logger = logging.getLogger(__name__)
 
 # Configuration with environment variable support
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 DB_NAME = os.getenv("MONGO_DB_NAME", "callhelper_db")
 COLLECTION_NAME = os.getenv("MONGO_COLLECTION", "umrah_cases")
+META_COLLECTION_NAME = os.getenv("MONGO_META_COLLECTION", "catalog_meta")
+
+# Columns shown in the admin list (list_cases projection)
+LIST_FIELDS = ("CaseID", "UserType", "Category", "SubCategory", "Priorty", "LastUpdated")
+# Keyword fields searched by list_cases(keyword=...)
+SEARCH_KEYWORD_FIELDS = ("MainKeywords", "ExtraKeywords", "Synonyms")
+
+# MongoClient is thread-safe and pools connections, so share one per process
+_client: Optional[MongoClient] = None
+
+# Called with (collection_name, new_version) after every catalog change
+_catalog_listeners: List[Callable[[str, int], None]] = []
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Record the latency of every MongoDB command in agent.metrics."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_LATENCY.labels(event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_FAILURES.labels(event.command_name).inc()
 
 
-def get_collection() -> Collection:
+# Pass to every MongoClient (event_listeners=COMMAND_LISTENERS)
+COMMAND_LISTENERS = [CommandMetrics()]
+
+
+def get_client() -> MongoClient:
+    """Get the shared MongoClient, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = MongoClient(MONGO_URI, event_listeners=COMMAND_LISTENERS)
+    return _client
+
+
+def get_collection(name: str = COLLECTION_NAME) -> Collection:
     """Get the MongoDB collection for cases."""
     try:
-        client = MongoClient(MONGO_URI)
-        return client[DB_NAME][COLLECTION_NAME]
+        return get_client()[DB_NAME][name]
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
         raise
 
 
+def get_catalog_version(coll: Optional[Collection] = None) -> int:
+    """
+    Return the catalog version of a cases collection.
+    The version changes on every insert/update/delete, so in-memory indexes
+    built from the collection can be reused until it moves.
+    """
+    coll = coll if coll is not None else get_collection()
+    doc = coll.database[META_COLLECTION_NAME].find_one({"_id": coll.name}, {"version": 1})
+    return int(doc.get("version", 0)) if doc else 0
+
+
+def bump_catalog_version(coll: Optional[Collection] = None) -> int:
+    """Increment and return the catalog version of a cases collection."""
+    coll = coll if coll is not None else get_collection()
+    doc = coll.database[META_COLLECTION_NAME].find_one_and_update(
+        {"_id": coll.name},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    version = int(doc["version"])
+    for listener in _catalog_listeners:
+        try:
+            listener(coll.name, version)
+        except Exception as e:
+            logger.error(f"Catalog listener failed: {e}")
+    return version
+
+
+def on_catalog_change(listener: Callable[[str, int], None]):
+    """Register a callback run in this process after each catalog version bump."""
+    _catalog_listeners.append(listener)
+
+
 def get_all_cases() -> List[Dict[str, Any]]:
     """Retrieve all cases, sorted by CaseID."""
     try:
@@ -39,6 +112,73 @@ def get_all_cases() -> List[Dict[str, Any]]:
         return []
 
 
+def list_cases(
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = 50,
+    category: Optional[str] = None,
+    keyword: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    One page of cases for the admin list, ordered by CaseID.
+
+    Keyset pagination: pass the last CaseID of a page as `after` for the
+    next page, or the first CaseID as `before` for the previous one.
+    Only LIST_FIELDS are fetched. `category` is an exact match and
+    `keyword` matches an entry of the main/extra keywords or synonyms;
+    both are served by the (field, CaseID) indexes, as is the count.
+
+    Returns: {cases, total, next_after, prev_before}
+    """
+    query: Dict[str, Any] = {}
+    if category:
+        query["Category"] = category
+    if keyword:
+        keyword = keyword.strip().lower()
+        query["$or"] = [{field: keyword} for field in SEARCH_KEYWORD_FIELDS]
+
+    page_query = dict(query)
+    direction = -1 if before and not after else 1
+    if after:
+        page_query["CaseID"] = {"$gt": after}
+    elif before:
+        page_query["CaseID"] = {"$lt": before}
+
+    try:
+        coll = get_collection()
+        projection = {field: 1 for field in LIST_FIELDS}
+        projection["_id"] = 0
+        # limit + 1 عشان نعرف إذا فيه صفحة بعدها
+        cases = list(coll.find(page_query, projection).sort("CaseID", direction).limit(limit + 1))
+        more = len(cases) > limit
+        cases = cases[:limit]
+        if direction < 0:
+            cases.reverse()
+        # بدون فلتر نقرأ العدد من metadata بدل ما نعد الفهرس كامل
+        total = coll.count_documents(query) if query else coll.estimated_document_count()
+    except Exception as e:
+        logger.error(f"Failed to list cases: {e}")
+        return {"cases": [], "total": 0, "next_after": None, "prev_before": None}
+
+    has_next = more if direction > 0 else bool(before)
+    has_prev = bool(after) if direction > 0 else more
+    return {
+        "cases": cases,
+        "total": total,
+        "next_after": cases[-1]["CaseID"] if cases and has_next else None,
+        "prev_before": cases[0]["CaseID"] if cases and has_prev else None,
+    }
+
+
+def get_categories() -> List[str]:
+    """Distinct case categories (read from the Category index)."""
+    try:
+        return sorted(c for c in get_collection().distinct("Category") if c)
+    except Exception as e:
+        logger.error(f"Failed to list categories: {e}")
+        return []
+
+
 def get_case_by_id(case_id: str) -> Optional[Dict[str, Any]]:
     """Retrieve a single case by its CaseID."""
     try:
@@ -57,6 +197,7 @@ def insert_case(case_data: Dict[str, Any]):
         if "LastUpdated" not in case_data or case_data["LastUpdated"] is None:
             case_data["LastUpdated"] = datetime.now(timezone.utc)
         result = coll.insert_one(case_data)
+        bump_catalog_version(coll)
         logger.info(f"Inserted case {case_data.get('CaseID')}")
         return result
     except Exception as e:
@@ -71,6 +212,7 @@ def update_case(case_id: str, case_data: Dict[str, Any]):
         # Update LastUpdated timestamp
         case_data["LastUpdated"] = datetime.now(timezone.utc)
         result = coll.update_one({"CaseID": case_id}, {"$set": case_data}, upsert=False)
+        bump_catalog_version(coll)
         logger.info(f"Updated case {case_id}")
         return result
     except Exception as e:
@@ -83,6 +225,7 @@ def delete_case(case_id: str):
     try:
         coll = get_collection()
         result = coll.delete_one({"CaseID": case_id})
+        bump_catalog_version(coll)
         logger.info(f"Deleted case {case_id}")
         return result
     except Exception as e:
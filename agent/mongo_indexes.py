@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+agent/mongo_indexes.py
+Index bootstrap and query-plan checks for the hot MongoDB collections.
+
+ensure_indexes() is idempotent and runs at app startup (unless
+CALLHELPER_ENSURE_INDEXES=0). check_query_plans() runs explain() on the
+queries issued by mongo_helper and analytics_helper and flags any that fall
+back to a collection scan.
+
+CLI:
+    python -m agent.mongo_indexes            # create indexes
+    python -m agent.mongo_indexes --check    # create indexes + report plans
+"""
+
+import sys
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from .mongo_helper import get_collection
+from . import analytics_helper
+
+logger = logging.getLogger(__name__)
+
+# (keys, options) per collection
+CASE_INDEXES: List[Tuple[list, dict]] = [
+    ([("CaseID", ASCENDING)], {"unique": True, "name": "CaseID_unique"}),
+    ([("UserType", ASCENDING)], {"name": "UserType"}),
+    # (field, CaseID): filtered admin listing with keyset pagination + counts
+    ([("Category", ASCENDING), ("CaseID", ASCENDING)], {"name": "Category_CaseID"}),
+    ([("MainKeywords", ASCENDING), ("CaseID", ASCENDING)], {"name": "MainKeywords_CaseID"}),
+    ([("ExtraKeywords", ASCENDING), ("CaseID", ASCENDING)], {"name": "ExtraKeywords_CaseID"}),
+    ([("Synonyms", ASCENDING), ("CaseID", ASCENDING)], {"name": "Synonyms_CaseID"}),
+]
+
+LOG_INDEXES: List[Tuple[list, dict]] = [
+    ([("date", ASCENDING), ("success", ASCENDING)], {"name": "date_success"}),
+    ([("date", ASCENDING), ("hour", ASCENDING)], {"name": "date_hour"}),
+    ([("timestamp", DESCENDING)], {"name": "timestamp_desc"}),
+    ([("success", ASCENDING)], {"name": "success"}),
+    ([("response_time_ms", ASCENDING)], {"name": "response_time_ms"}),
+]
+
+ROLLUP_INDEXES: List[Tuple[list, dict]] = [
+    ([("date", ASCENDING), ("hour", ASCENDING), ("user_type", ASCENDING), ("interaction_type", ASCENDING)],
+     {"unique": True, "name": "rollup_key"}),
+]
+
+BUCKET_INDEXES: List[Tuple[list, dict]] = [
+    ([("hour_start", DESCENDING), ("count", ASCENDING)], {"name": "hour_start_count"}),
+    ([("date", ASCENDING)], {"name": "date"}),
+    # TTL: expire_at is already retention + grace days after the bucket's hour
+    ([("expire_at", ASCENDING)], {"name": "expire_at_ttl", "expireAfterSeconds": 0}),
+]
+
+HOT_QUERY_INDEXES: List[Tuple[list, dict]] = [
+    ([("date", ASCENDING), ("hour", ASCENDING), ("key", ASCENDING)], {"unique": True, "name": "date_hour_key"}),
+    ([("expire_at", ASCENDING)], {"name": "expire_at_ttl", "expireAfterSeconds": 0}),
+]
+
+
+HOT_QUERY_DAILY_INDEXES: List[Tuple[list, dict]] = [
+    ([("date", ASCENDING), ("key", ASCENDING)], {"unique": True, "name": "date_key"}),
+    ([("expire_at", ASCENDING)], {"name": "expire_at_ttl", "expireAfterSeconds": 0}),
+]
+
+
+def _create(coll, indexes) -> List[Dict[str, Any]]:
+    results = []
+    for keys, options in indexes:
+        try:
+            coll.create_index(keys, **options)
+            results.append({"collection": coll.name, "index": options["name"], "ok": True})
+        except OperationFailure as e:
+            # مثلاً CaseID مكرر يمنع الفهرس الفريد
+            logger.error(f"Failed to create index {options['name']} on {coll.name}: {e}")
+            results.append({"collection": coll.name, "index": options["name"], "ok": False, "error": str(e)})
+    return results
+
+
+def ensure_indexes() -> List[Dict[str, Any]]:
+    """Create all indexes (no-op for indexes that already exist)."""
+    analytics_helper.ensure_log_storage()
+    results = _create(get_collection(), CASE_INDEXES)
+    results += _create(analytics_helper.logs_collection, LOG_INDEXES)
+    results += _create(analytics_helper.rollups_collection, ROLLUP_INDEXES)
+    results += _create(analytics_helper.hot_queries_collection, HOT_QUERY_INDEXES)
+    results += _create(analytics_helper.hot_queries_daily_collection, HOT_QUERY_DAILY_INDEXES)
+    if analytics_helper.LOG_STORAGE == "bucketed":
+        results += _create(analytics_helper.buckets_collection, BUCKET_INDEXES)
+    return results
+
+
+def _plan_stages(node) -> List[str]:
+    """Collect stage names from every winningPlan found in an explain() document."""
+    stages = []
+    if isinstance(node, dict):
+        plan = node.get("winningPlan")
+        if isinstance(plan, dict):
+            stages += _walk_plan(plan.get("queryPlan", plan))
+        for key, value in node.items():
+            if key != "winningPlan":
+                stages += _plan_stages(value)
+    elif isinstance(node, list):
+        for value in node:
+            stages += _plan_stages(value)
+    return stages
+
+
+def _walk_plan(plan) -> List[str]:
+    stages = [plan.get("stage", "?")]
+    if isinstance(plan.get("inputStage"), dict):
+        stages += _walk_plan(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        stages += _walk_plan(child)
+    return stages
+
+
+def _explain_aggregate(coll, pipeline) -> dict:
+    return coll.database.command("aggregate", coll.name, pipeline=pipeline, explain=True)
+
+
+def check_query_plans() -> List[Dict[str, Any]]:
+    """
+    explain() each helper query and report its plan stages.
+    Returns: list of {name, stages, collscan}
+    """
+    cases = get_collection()
+    logs = analytics_helper.logs_collection
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    week_ago = (datetime.utcnow() - timedelta(days=7)).strftime("%Y-%m-%d")
+
+    queries = [
+        ("get_case_by_id", lambda: cases.find({"CaseID": "x"}).limit(1).explain()),
+        ("get_all_cases sort", lambda: cases.find({}).sort("CaseID", 1).explain()),
+        ("list_cases page", lambda: cases.find({"CaseID": {"$gt": "x"}}).sort("CaseID", 1).limit(51).explain()),
+        ("list_cases by category", lambda: cases.find(
+            {"Category": "x", "CaseID": {"$gt": "x"}}).sort("CaseID", 1).limit(51).explain()),
+        ("list_cases by keyword", lambda: cases.find(
+            {"$or": [{f: "x"} for f in ("MainKeywords", "ExtraKeywords", "Synonyms")]}
+        ).sort("CaseID", 1).limit(51).explain()),
+        ("cases by UserType", lambda: cases.find({"UserType": "x"}).explain()),
+        ("logs today", lambda: logs.find({"date": today}).explain()),
+        ("logs since week", lambda: logs.find({"date": {"$gte": week_ago}}).explain()),
+        ("logs successful", lambda: logs.find({"success": True}).explain()),
+        ("recent queries", lambda: logs.find({}).sort("timestamp", DESCENDING).limit(10).explain()),
+        ("avg response time", lambda: _explain_aggregate(logs, [
+            {"$match": {"response_time_ms": {"$ne": None}}},
+            {"$group": {"_id": None, "avg_time": {"$avg": "$response_time_ms"}}},
+        ])),
+        ("hourly activity", lambda: _explain_aggregate(logs, [
+            {"$match": {"date": today}},
+            {"$group": {"_id": "$hour", "count": {"$sum": 1}}},
+        ])),
+        ("daily trends", lambda: _explain_aggregate(logs, [
+            {"$match": {"date": {"$gte": week_ago}}},
+            {"$group": {"_id": "$date", "total": {"$sum": 1}}},
+        ])),
+    ]
+
+    report = []
+    for name, explain in queries:
+        try:
+            stages = _plan_stages(explain())
+            report.append({"name": name, "stages": stages, "collscan": "COLLSCAN" in stages})
+        except Exception as e:
+            report.append({"name": name, "stages": [], "collscan": None, "error": str(e)})
+    return report
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    for result in ensure_indexes():
+        status = "✅" if result["ok"] else f"❌ {result.get('error')}"
+        print(f"{result['collection']}.{result['index']}: {status}")
+
+    if "--check" in argv:
+        print()
+        collscans = 0
+        for entry in check_query_plans():
+            if entry.get("error"):
+                print(f"⚠️  {entry['name']}: {entry['error']}")
+                continue
+            mark = "❌ COLLSCAN" if entry["collscan"] else "✅"
+            collscans += bool(entry["collscan"])
+            print(f"{mark} {entry['name']}: {' <- '.join(entry['stages'])}")
+        return 1 if collscans else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+agent/request_profiler.py
+Opt-in cProfile profiling of production requests.
+
+A request to one of the profiled endpoints runs under cProfile when:
+
+    header   X-CallHelper-Profile carries CALLHELPER_PROFILE_TOKEN
+             (header profiling is off while no token is configured)
+    admin    POST /admin/profiling {"profile_next": N} armed the next N requests
+    sample   every CALLHELPER_PROFILE_SAMPLE_EVERY-th request (0 = off)
+
+Only one request is profiled at a time per process; a request that would
+be profiled while another one is running is simply served unprofiled.
+That keeps the overhead bounded, and it is required on Python 3.12+ where
+cProfile hooks sys.monitoring, which is process wide (a profile taken
+there can also contain calls made by other threads meanwhile).
+
+Profiles are aggregated per endpoint into pstats.Stats objects in memory,
+so the hot-function report covers every profiled request since the last
+reset. Like the stage histograms, reports are per worker process.
+"""
+
+import os
+import hmac
+import io
+import cProfile
+import pstats
+import itertools
+import threading
+from time import perf_counter_ns
+from typing import Dict, Iterable, List, Optional
+
+PROFILE_HEADER = "X-CallHelper-Profile"
+PROFILE_TOKEN = os.getenv("CALLHELPER_PROFILE_TOKEN", "")
+# Profile 1 in N requests (0 = no sampling)
+PROFILE_SAMPLE_EVERY = int(os.getenv("CALLHELPER_PROFILE_SAMPLE_EVERY", "0"))
+PROFILED_ENDPOINTS = frozenset(
+    e.strip() for e in os.getenv("CALLHELPER_PROFILE_ENDPOINTS", "api_resolve,search,api_chat").split(",")
+    if e.strip()
+)
+
+SORT_KEYS = ("cumulative", "tottime", "ncalls")
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+
+def _short_path(path: str) -> str:
+    if path.startswith(_ROOT):
+        return path[len(_ROOT):]
+    marker = os.sep + "site-packages" + os.sep
+    if marker in path:
+        return path.split(marker, 1)[1]
+    return path
+
+
+def _function_name(func: tuple) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name  # built-in
+    return f"{_short_path(filename)}:{line}({name})"
+
+
+class ProfileSession:
+    __slots__ = ("endpoint", "reason", "profile", "started")
+
+    def __init__(self, endpoint: str, reason: str):
+        self.endpoint = endpoint
+        self.reason = reason
+        self.profile = cProfile.Profile()
+        self.started = perf_counter_ns()
+
+
+class RequestProfiler:
+    def __init__(self, sample_every: int = PROFILE_SAMPLE_EVERY, token: str = PROFILE_TOKEN,
+                 endpoints: Iterable[str] = PROFILED_ENDPOINTS):
+        self.sample_every = max(0, sample_every)
+        self.token = token
+        self.endpoints = set(endpoints)
+        self.profile_next = 0
+        self._counter = itertools.count(1)
+        self._busy = threading.Lock()   # بروفايل واحد فقط في نفس الوقت
+        self._lock = threading.Lock()   # يحمي الإعدادات والتجميع
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._requests: Dict[str, dict] = {}
+
+    # ---- request hooks ----
+
+    def _reason(self, header_value: Optional[str]) -> Optional[str]:
+        if header_value and self.token and hmac.compare_digest(header_value, self.token):
+            return "header"
+        if self.profile_next:
+            with self._lock:
+                if self.profile_next > 0:
+                    self.profile_next -= 1
+                    return "admin"
+        if self.sample_every and next(self._counter) % self.sample_every == 0:
+            return "sample"
+        return None
+
+    def start(self, endpoint: Optional[str], header_value: Optional[str] = None) -> Optional[ProfileSession]:
+        """Start profiling the current request if it is selected. Returns the session or None."""
+        if endpoint not in self.endpoints:
+            return None
+        reason = self._reason(header_value)
+        if reason is None or not self._busy.acquire(blocking=False):
+            return None
+        session = ProfileSession(endpoint, reason)
+        try:
+            session.profile.enable()
+        except ValueError:
+            # أداة profiling ثانية شغالة (مثلاً debugger)
+            self._busy.release()
+            return None
+        return session
+
+    def stop(self, session: ProfileSession):
+        """Stop a session started by start() and fold it into the endpoint's report."""
+        session.profile.disable()
+        elapsed_ms = (perf_counter_ns() - session.started) / 1e6
+        self._busy.release()
+
+        stats = pstats.Stats(session.profile)
+        with self._lock:
+            total = self._stats.get(session.endpoint)
+            if total is None:
+                self._stats[session.endpoint] = stats
+            else:
+                total.add(stats)
+            info = self._requests.setdefault(
+                session.endpoint, {"requests": 0, "total_ms": 0.0, "max_ms": 0.0, "reasons": {}})
+            info["requests"] += 1
+            info["total_ms"] += elapsed_ms
+            info["max_ms"] = max(info["max_ms"], elapsed_ms)
+            info["reasons"][session.reason] = info["reasons"].get(session.reason, 0) + 1
+
+    # ---- admin ----
+
+    def configure(self, sample_every: Optional[int] = None, profile_next: Optional[int] = None):
+        with self._lock:
+            if sample_every is not None:
+                self.sample_every = max(0, int(sample_every))
+            if profile_next is not None:
+                self.profile_next = max(0, int(profile_next))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._requests.clear()
+
+    def settings(self) -> dict:
+        return {
+            "sample_every": self.sample_every,
+            "profile_next": self.profile_next,
+            "header": PROFILE_HEADER if self.token else None,
+            "endpoints": sorted(self.endpoints),
+        }
+
+    def report(self, endpoint: Optional[str] = None, sort: str = "cumulative", limit: int = 30) -> dict:
+        """{settings, endpoints: {endpoint: {requests, avg_ms, max_ms, reasons, functions: [...]}}}
+
+        functions are the top `limit` entries by `sort` (cumulative, tottime
+        or ncalls); times are totals in ms over all profiled requests.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+        field = {"ncalls": 1, "tottime": 2, "cumulative": 3}[sort]
+
+        with self._lock:
+            names = [endpoint] if endpoint else sorted(self._stats)
+            endpoints = {}
+            for name in names:
+                stats = self._stats.get(name)
+                if stats is None:
+                    continue
+                info = self._requests[name]
+                rows = sorted(stats.stats.items(), key=lambda item: item[1][field], reverse=True)[:limit]
+                endpoints[name] = {
+                    "requests": info["requests"],
+                    "avg_ms": round(info["total_ms"] / info["requests"], 3),
+                    "max_ms": round(info["max_ms"], 3),
+                    "reasons": dict(info["reasons"]),
+                    "functions": self._rows(rows, info["requests"]),
+                }
+        return {"settings": self.settings(), "endpoints": endpoints}
+
+    @staticmethod
+    def _rows(rows, requests: int) -> List[dict]:
+        functions = []
+        for func, (primitive_calls, calls, tottime, cumtime, _) in rows:
+            functions.append({
+                "function": _function_name(func),
+                "ncalls": calls,
+                "primitive_calls": primitive_calls,
+                "tottime_ms": round(tottime * 1000, 3),
+                "cumtime_ms": round(cumtime * 1000, 3),
+                "cumtime_per_request_ms": round(cumtime * 1000 / requests, 3),
+            })
+        return functions
+
+    def report_text(self, endpoint: str, sort: str = "cumulative", limit: int = 30) -> str:
+        """Classic pstats print_stats() output for one endpoint."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+        stream = io.StringIO()
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                return ""
+            stats.stream = stream
+            stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+request_profiler = RequestProfiler()
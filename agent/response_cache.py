@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+agent/response_cache.py
+Pre-encoded JSON fragments for /api/resolve responses.
+
+The public JSON of a matched case only depends on the case itself, except
+for "score" and "match_type". Each case is therefore encoded once, with
+placeholders in those two slots, and the encoded text is split around them;
+a response is assembled by joining the cached parts with the per-request
+values. Fragments live in a weak map keyed by the CaseIndex they came
+from, so they are per catalog version and go away with the old index.
+
+The encoder is passed in (Flask's app.json.dumps) so the assembled bytes
+are identical to what jsonify() would have produced. Flask's defaults are
+assumed: sorted keys, ASCII output and compact separators. Per-request
+scalars (score, match type, message, ...) go through the stdlib encoder.
+"""
+
+import os
+import json
+import math
+import weakref
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# Serve /api/resolve from cached fragments (0 = always build with jsonify)
+RESPONSE_CACHE = os.getenv("CALLHELPER_RESPONSE_CACHE", "1") == "1"
+
+# (response key, case field) for the static part of a match
+MATCH_FIELDS = (
+    ("case_id", "CaseID"),
+    ("category", "Category"),
+    ("subcategory", "SubCategory"),
+    ("priority", "Priorty"),  # note: source typo
+    ("response_text", "ResponseText"),
+    ("fallback", "FallbackText"),
+    ("why", "Why"),
+    ("last_updated", "LastUpdated"),
+)
+
+# نصوص مستحيلة في البيانات، تنحجز مكان القيم اللي تتغير كل طلب
+_SLOT = "\x00callhelper:{}\x00"
+
+
+def safe_val(v):
+    if v is None:
+        return None
+    try:
+        if isinstance(v, float) and math.isnan(v):
+            return None
+    except Exception:
+        pass
+    return v
+
+
+def format_match(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Public JSON shape of a matched case."""
+    match = {key: safe_val(row.get(field)) for key, field in MATCH_FIELDS}
+    match["score"] = safe_val(row.get("MatchScore"))
+    match["match_type"] = row.get("MatchType", "keyword")
+    return match
+
+
+def _scalar(value) -> bytes:
+    return json.dumps(value).encode("utf-8")
+
+
+class _Template:
+    """Encoded match JSON split around the score and match_type slots."""
+    __slots__ = ("head", "middle", "tail", "score_first")
+
+    def __init__(self, text: str, score_slot: str, match_type_slot: str):
+        score_at, type_at = text.index(score_slot), text.index(match_type_slot)
+        self.score_first = score_at < type_at
+        (first, first_len), (second, second_len) = sorted(
+            [(score_at, len(score_slot)), (type_at, len(match_type_slot))])
+        self.head = text[:first].encode("utf-8")
+        self.middle = text[first + first_len:second].encode("utf-8")
+        self.tail = text[second + second_len:].encode("utf-8")
+
+    def render(self, score: bytes, match_type: bytes) -> bytes:
+        if self.score_first:
+            return b"".join((self.head, score, self.middle, match_type, self.tail))
+        return b"".join((self.head, match_type, self.middle, score, self.tail))
+
+
+class ResponseCache:
+    def __init__(self, dumps: Callable[[Any], str]):
+        self.dumps = dumps
+        self._score_slot = self.dumps(_SLOT.format("score"))
+        self._match_type_slot = self.dumps(_SLOT.format("match_type"))
+        # match_type قيمه قليلة ("keyword", "semantic")
+        self._match_types: Dict[Any, bytes] = {}
+        # CaseIndex → {"positions": {_id: pos}, "fragments": {pos: _Template}}
+        self._indexes: "weakref.WeakKeyDictionary[Any, dict]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _entry(self, index) -> dict:
+        entry = self._indexes.get(index)
+        if entry is None:
+            with self._lock:
+                entry = self._indexes.get(index)
+                if entry is None:
+                    positions = {case.get("_id"): pos for pos, case in enumerate(index.cases)}
+                    entry = self._indexes[index] = {"positions": positions, "fragments": {}}
+        return entry
+
+    def _template(self, index, row: Dict[str, Any]) -> Optional[_Template]:
+        if index is None:
+            return None
+        entry = self._entry(index)
+        pos = entry["positions"].get(row.get("_id"))
+        if pos is None:
+            return None
+        template = entry["fragments"].get(pos)
+        if template is None:
+            match = format_match(index.cases[pos])
+            match["score"] = _SLOT.format("score")
+            match["match_type"] = _SLOT.format("match_type")
+            template = _Template(self.dumps(match), self._score_slot, self._match_type_slot)
+            entry["fragments"][pos] = template
+        return template
+
+    def match_json(self, index, row: Dict[str, Any]) -> bytes:
+        """Encoded match object for a row returned by the agent."""
+        template = self._template(index, row)
+        if template is None:
+            # الحالة مو في هذا الفهرس (تغيّر الكتالوج بين المطابقة والرد)
+            return self.dumps(format_match(row)).encode("utf-8")
+        match_type = row.get("MatchType", "keyword")
+        encoded_type = self._match_types.get(match_type)
+        if encoded_type is None:
+            encoded_type = self._match_types[match_type] = self.dumps(match_type).encode("utf-8")
+        return template.render(_scalar(safe_val(row.get("MatchScore"))), encoded_type)
+
+    def resolve_response(self, index, fields: Dict[str, Any], rows: List[Dict[str, Any]],
+                         alternatives: bool) -> bytes:
+        """
+        Response body for /api/resolve: `fields` plus "match" (the first row)
+        and, when `alternatives` is set, "alternatives" (all rows).
+        """
+        matches = [self.match_json(index, row) for row in rows]
+        values = {key: _scalar(value) for key, value in fields.items()}
+        values["match"] = matches[0]
+        if alternatives:
+            values["alternatives"] = b"[" + b",".join(matches) + b"]"
+        return b"{" + b",".join(
+            b'"' + key.encode("ascii") + b'":' + values[key] for key in sorted(values)
+        ) + b"}\n"
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+agent/semantic_index.py
+CPU-only fallback retriever using hashed character n-gram vectors.
+
+Each case's Category, SubCategory and ResponseText are embedded by hashing
+character 3/4-grams of the normalized text into a fixed number of buckets.
+No model download, no GPU: vectors live in one contiguous float32 matrix and
+a query is answered with a single matrix-vector product.
+"""
+
+import os
+import zlib
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from .text_normalizer import normalize_text
+
+SEMANTIC_DIM = int(os.getenv("CALLHELPER_SEMANTIC_DIM", "1024"))
+SEMANTIC_MIN_SCORE = float(os.getenv("CALLHELPER_SEMANTIC_MIN_SCORE", "0.2"))
+SEMANTIC_FIELDS = ("Category", "SubCategory", "ResponseText")
+NGRAM_SIZES = (3, 4)
+
+
+def _ngram_buckets(text: str, dim: int) -> List[int]:
+    buckets = []
+    for word in normalize_text(text).split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            for i in range(len(padded) - n + 1):
+                # crc32 ثابت بين العمليات (عكس hash() في بايثون)
+                buckets.append(zlib.crc32(padded[i:i + n].encode("utf-8")) % dim)
+    return buckets
+
+
+def embed(text: str, dim: int = SEMANTIC_DIM) -> np.ndarray:
+    """L2-normalized hashed n-gram vector for a text."""
+    vector = np.zeros(dim, dtype=np.float32)
+    buckets = _ngram_buckets(text, dim)
+    if buckets:
+        np.add.at(vector, buckets, 1.0)
+        # sublinear tf عشان النصوص الطويلة ما تطغى
+        np.log1p(vector, out=vector)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+    return vector
+
+
+class SemanticIndex:
+    def __init__(self, cases: List[Dict[str, Any]], dim: int = SEMANTIC_DIM):
+        self.dim = dim
+        self.matrix = np.zeros((len(cases), dim), dtype=np.float32)
+        for pos, case in enumerate(cases):
+            text = " ".join(
+                case.get(field) for field in SEMANTIC_FIELDS if isinstance(case.get(field), str)
+            )
+            self.matrix[pos] = embed(text, dim)
+
+    def search(self, issue_text: str, limit: int = 5,
+               min_score: float = SEMANTIC_MIN_SCORE) -> List[Tuple[int, float]]:
+        """(case_pos, cosine similarity) of the nearest cases, best first."""
+        if not len(self.matrix):
+            return []
+        query = embed(issue_text, self.dim)
+        if not query.any():
+            return []
+        sims = self.matrix @ query
+        k = min(limit, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [(int(pos), float(sims[pos])) for pos in top if sims[pos] >= min_score]
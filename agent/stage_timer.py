@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+agent/stage_timer.py
+Per-stage request timing for /api/resolve, /search and /api/chat.
+
+A StageTimer is started for each timed request and made current through a
+context variable, so agent code can attribute time without any Flask
+dependency. Timing is lap based: `lap(STAGE)` charges the time since the
+previous lap to STAGE, using perf_counter_ns() and a preallocated list of
+per-stage totals (no objects are created on the hot path). When no timer
+is active, current_timer() returns a no-op timer.
+
+Finished timers are folded into in-process log2 histograms per
+(endpoint, stage), and can be rendered as a Server-Timing header.
+"""
+
+import os
+import threading
+from contextvars import ContextVar
+from time import perf_counter_ns
+from typing import Dict, List, Optional
+
+# Attach a Server-Timing header to timed responses
+SERVER_TIMING = os.getenv("CALLHELPER_SERVER_TIMING", "0") == "1"
+
+# Stage ids (indexes into StageTimer.ns)
+STAGES = (
+    "session",     # chat session lookup/cleanup
+    "faq",         # chat FAQ / common solutions
+    "agent",       # request parsing + agent lookup/construction
+    "index",       # catalog version check / Mongo fetch / index build
+    "preprocess",  # query normalization
+    "score",       # keyword / bm25 scoring
+    "sort",        # ranking + copying matched cases
+    "semantic",    # semantic fallback
+    "log",         # log_interaction
+    "render",      # response formatting + JSON encoding
+)
+SESSION, FAQ, AGENT, INDEX, PREPROCESS, SCORE, SORT, SEMANTIC, LOG, RENDER = range(len(STAGES))
+
+# Histogram buckets: upper bounds 2^i microseconds (1us .. ~67s) + overflow
+BUCKET_COUNT = 27
+
+
+class StageTimer:
+    __slots__ = ("endpoint", "ns", "started", "last")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.ns = [0] * len(STAGES)
+        self.started = self.last = perf_counter_ns()
+
+    def lap(self, stage: int):
+        now = perf_counter_ns()
+        self.ns[stage] += now - self.last
+        self.last = now
+
+    def total_ns(self) -> int:
+        return self.last - self.started
+
+    def server_timing(self) -> str:
+        """Server-Timing header value (durations in ms, only stages that ran)."""
+        parts = [f"{STAGES[i]};dur={ns / 1e6:.3f}" for i, ns in enumerate(self.ns) if ns]
+        parts.append(f"total;dur={self.total_ns() / 1e6:.3f}")
+        return ", ".join(parts)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def lap(self, stage: int):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+_current: ContextVar[Optional[StageTimer]] = ContextVar("callhelper_stage_timer", default=None)
+
+
+def start_timer(endpoint: str):
+    """Start a timer for the current request. Returns (timer, token for stop_timer)."""
+    timer = StageTimer(endpoint)
+    return timer, _current.set(timer)
+
+
+def current_timer():
+    """The active StageTimer, or a no-op timer outside timed requests."""
+    return _current.get() or _NULL_TIMER
+
+
+def stop_timer(token):
+    _current.reset(token)
+
+
+class StageHistograms:
+    """log2 histograms of stage durations per endpoint (thread-safe)."""
+
+    def __init__(self):
+        # endpoint -> [per stage + total] -> [bucket counts..., count, sum_ns]
+        self._data: Dict[str, List[List[int]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bucket(ns: int) -> int:
+        return min((ns // 1000).bit_length(), BUCKET_COUNT - 1)
+
+    def record(self, timer: StageTimer):
+        durations = timer.ns + [timer.total_ns()]
+        with self._lock:
+            rows = self._data.get(timer.endpoint)
+            if rows is None:
+                rows = self._data[timer.endpoint] = [[0] * (BUCKET_COUNT + 2) for _ in durations]
+            for row, ns in zip(rows, durations):
+                if ns:
+                    row[self._bucket(ns)] += 1
+                    row[BUCKET_COUNT] += 1
+                    row[BUCKET_COUNT + 1] += ns
+
+    @staticmethod
+    def _quantile(row: List[int], q: float) -> float:
+        """Upper bound (ms) of the bucket holding quantile q."""
+        rank = q * row[BUCKET_COUNT]
+        seen = 0
+        for i in range(BUCKET_COUNT):
+            seen += row[i]
+            if seen >= rank and row[i]:
+                return (1 << i) / 1000
+        return (1 << (BUCKET_COUNT - 1)) / 1000
+
+    def snapshot(self) -> Dict[str, Dict[str, dict]]:
+        """{endpoint: {stage: {count, avg_ms, p50_ms, p90_ms, p99_ms, buckets}}}"""
+        with self._lock:
+            data = {endpoint: [row[:] for row in rows] for endpoint, rows in self._data.items()}
+
+        report = {}
+        for endpoint, rows in data.items():
+            stages = {}
+            for name, row in zip(STAGES + ("total",), rows):
+                count = row[BUCKET_COUNT]
+                if not count:
+                    continue
+                stages[name] = {
+                    "count": count,
+                    "avg_ms": round(row[BUCKET_COUNT + 1] / count / 1e6, 3),
+                    "p50_ms": self._quantile(row, 0.5),
+                    "p90_ms": self._quantile(row, 0.9),
+                    "p99_ms": self._quantile(row, 0.99),
+                    # bucket i counts durations up to 2^i microseconds
+                    "buckets": row[:BUCKET_COUNT],
+                }
+            report[endpoint] = stages
+        return report
+
+
+stage_histograms = StageHistograms()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+agent/suggest_index.py
+Typeahead suggestions over case keywords, synonyms and categories.
+
+Each distinct normalized MainKeyword, Synonym and Category becomes one
+entry. Its key, plus every word-boundary suffix of multi-word terms (so
+"مرور" finds "كلمة مرور"), goes into one sorted array; a prefix is then
+two bisects plus a top-k over the matching slice. Top-k results for
+wide slices (short prefixes) are memoized per index.
+
+Entries are weighted by how often their cases were matched in
+interaction logs over the past CALLHELPER_SUGGEST_POPULARITY_DAYS,
+then by how many cases use them. Those counts are refreshed in the
+background every CALLHELPER_SUGGEST_POPULARITY_TTL seconds. The index
+itself is built per catalog version, as CaseIndex.suggest().
+"""
+
+import os
+import time
+import heapq
+import logging
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional
+
+from .text_normalizer import normalize_text, normalize_query
+from .case_io import synonym_terms
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_LIMIT = int(os.getenv("CALLHELPER_SUGGEST_LIMIT", "8"))
+POPULARITY_DAYS = int(os.getenv("CALLHELPER_SUGGEST_POPULARITY_DAYS", "30"))
+POPULARITY_TTL_SECONDS = float(os.getenv("CALLHELPER_SUGGEST_POPULARITY_TTL", "600"))
+
+# Entry kinds, strongest first (a term that is both keeps the first)
+KINDS = ("category", "keyword", "synonym")
+# Slices wider than this get their top-k memoized
+_MEMO_MIN_SLICE = 64
+_MEMO_MAX_ENTRIES = 4096
+# أكبر من أي حرف عربي/لاتيني بعد التطبيع
+_PREFIX_END = "\uffff"
+_NO_POPULARITY: Dict[Any, int] = {}
+
+
+class SuggestIndex:
+    def __init__(self, cases: List[Dict[str, Any]]):
+        self.labels: List[str] = []
+        self.kinds: List[int] = []
+        self.case_ids: List[List[Any]] = []
+        entry_of: Dict[str, int] = {}
+
+        def add(raw, kind: int, case_id):
+            if not isinstance(raw, str):
+                return
+            term = normalize_text(raw)
+            if not term:
+                return
+            entry = entry_of.get(term)
+            if entry is None:
+                entry = entry_of[term] = len(self.labels)
+                self.labels.append(raw.strip())
+                self.kinds.append(kind)
+                self.case_ids.append([])
+            elif kind < self.kinds[entry]:
+                self.kinds[entry] = kind
+            ids = self.case_ids[entry]
+            if not ids or ids[-1] != case_id:
+                ids.append(case_id)
+
+        for case in cases:
+            case_id = case.get("CaseID")
+            add(case.get("Category"), 0, case_id)
+            for keyword in case.get("MainKeywords") or []:
+                add(keyword, 1, case_id)
+            for synonym in synonym_terms(case.get("Synonyms")):
+                add(synonym, 2, case_id)
+
+        # (key, entry, inner): الكلمة كاملة + كل لاحقة تبدأ عند بداية كلمة
+        pairs = []
+        for term, entry in entry_of.items():
+            pairs.append((term, entry, 0))
+            start = term.find(" ")
+            while start != -1:
+                pairs.append((term[start + 1:], entry, 1))
+                start = term.find(" ", start + 1)
+        pairs.sort()
+        self._keys = [p[0] for p in pairs]
+        self._entries = [p[1] for p in pairs]
+        self._inner = [p[2] for p in pairs]
+
+        self.case_counts = [len(ids) for ids in self.case_ids]
+        self._weights = [0] * len(self.labels)
+        self._popularity: Optional[Dict[Any, int]] = None
+        self._memo: Dict[tuple, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _rank(self, popularity: Dict[Any, int]):
+        """Recompute entry weights when a new popularity snapshot arrives."""
+        if popularity is self._popularity:
+            return
+        with self._lock:
+            if popularity is self._popularity:
+                return
+            get = popularity.get
+            self._weights = [sum(get(c, 0) for c in ids) for ids in self.case_ids]
+            self._memo = {}
+            self._popularity = popularity
+
+    def _top(self, prefix: str, limit: int) -> List[int]:
+        memo_key = (prefix, limit)
+        cached = self._memo.get(memo_key)
+        if cached is not None:
+            return cached
+
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix + _PREFIX_END, lo)
+        # المدخل الواحد ممكن يطلع أكثر من مرة (الكلمة ولواحقها)؛ نفضّل بداية الكلمة
+        candidates: Dict[int, int] = {}
+        entries, inner = self._entries, self._inner
+        for i in range(lo, hi):
+            entry = entries[i]
+            if entry not in candidates or inner[i] < candidates[entry]:
+                candidates[entry] = inner[i]
+
+        weights, counts, labels = self._weights, self.case_counts, self.labels
+        top = heapq.nlargest(
+            limit, candidates,
+            key=lambda e: (-candidates[e], weights[e], counts[e], -len(labels[e])),
+        )
+        if hi - lo > _MEMO_MIN_SLICE:
+            if len(self._memo) >= _MEMO_MAX_ENTRIES:
+                self._memo = {}
+            self._memo[memo_key] = top
+        return top
+
+    def _item(self, entry: int, query: str) -> dict:
+        return {
+            "text": self.labels[entry],
+            "type": KINDS[self.kinds[entry]],
+            "query": query,
+            "matches": self._weights[entry],
+            "cases": self.case_counts[entry],
+        }
+
+    def suggest(self, text: str, limit: int = SUGGEST_LIMIT,
+                popularity: Optional[Dict[Any, int]] = None) -> List[dict]:
+        """
+        Suggestions for a partially typed query.
+
+        The whole input is matched as a prefix first; if that leaves room
+        and the input has several words, its trailing words are completed
+        too, longest run first ("نسيت كلمة مر" tries "كلمة مر", then "مر"),
+        and "query" keeps the words before them.
+        """
+        normalized, tokens = normalize_query(text)
+        if not normalized:
+            return []
+        self._rank(popularity if popularity is not None else _NO_POPULARITY)
+
+        results = [self._item(e, self.labels[e]) for e in self._top(normalized, limit)]
+        if len(results) < limit and len(tokens) > 1:
+            words = text.split()
+            if len(words) != len(tokens):
+                # علامات ترقيم منفصلة: نعرض الكلمات المطبّعة
+                words = list(tokens)
+            seen = {r["text"] for r in results}
+            for start in range(1, len(tokens)):
+                head = " ".join(words[:start])
+                for entry in self._top(" ".join(tokens[start:]), limit):
+                    if len(results) >= limit:
+                        return results
+                    if self.labels[entry] not in seen:
+                        seen.add(self.labels[entry])
+                        results.append(self._item(entry, f"{head} {self.labels[entry]}"))
+        return results
+
+
+class CasePopularity:
+    """Match counts per CaseID from interaction logs, refreshed in the background."""
+
+    def __init__(self, days: int = POPULARITY_DAYS, ttl: float = POPULARITY_TTL_SECONDS):
+        self.days = days
+        self.ttl = ttl
+        self._counts: Dict[Any, int] = {}
+        self._loaded_at = float("-inf")
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self) -> Dict[Any, int]:
+        """Current snapshot (never blocks; a stale one triggers a refresh)."""
+        if time.monotonic() - self._loaded_at >= self.ttl:
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh, name="suggest-popularity", daemon=True).start()
+        return self._counts
+
+    def _refresh(self):
+        try:
+            from .analytics_helper import get_case_match_counts
+            # snapshot جديد (ما نعدّل القديم) عشان SuggestIndex يلاحظ التغيير
+            self._counts = get_case_match_counts(self.days)
+        except Exception as e:
+            logger.error(f"Failed to load case popularity: {e}")
+        finally:
+            self._loaded_at = time.monotonic()
+            self._refreshing = False
+
+
+case_popularity = CasePopularity()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+agent/text_normalizer.py
+Arabic text normalization and tokenization shared by indexing and querying.
+
+The same function is applied to stored keywords when the case index is built
+and to user queries at request time, so spelling variants such as
+"عمرة"/"عمره" or "أ"/"إ"/"آ"/"ا" match without duplicate keywords.
+"""
+
+import re
+from functools import lru_cache
+from typing import Tuple
+
+# تشكيل (حركات) + علامات قرآنية + الألف الخنجرية
+_DIACRITICS = [chr(c) for c in range(0x0610, 0x061B)] + \
+              [chr(c) for c in range(0x064B, 0x0660)] + \
+              ["\u0670"] + [chr(c) for c in range(0x06D6, 0x06EE)]
+
+# علامات ترقيم عربية نعاملها كمسافة
+_ARABIC_PUNCT = "،؛؟٪٫٬۔«»"
+
+# جدول تحويل واحد: حذف التشكيل والتطويل، توحيد الألف والياء والتاء المربوطة
+_TRANSLATION = str.maketrans({
+    **{d: None for d in _DIACRITICS},
+    "\u0640": None,  # تطويل ـ
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي",
+    "ة": "ه",
+    **{p: " " for p in _ARABIC_PUNCT},
+})
+
+_NON_WORD = re.compile(r"[^\w\s\u0600-\u06FF]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, fold Arabic letter variants and strip diacritics/punctuation."""
+    if not text:
+        return ""
+    text = text.lower().translate(_TRANSLATION)
+    text = _NON_WORD.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+@lru_cache(maxsize=4096)
+def normalize_query(text: str) -> Tuple[str, Tuple[str, ...]]:
+    """Memoized (normalized_text, tokens) for a raw query string."""
+    normalized = normalize_text(text)
+    return normalized, tuple(normalized.split())
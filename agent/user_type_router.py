@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+agent/user_type_router.py
+Declarative routing of free-text user types to agents.
+
+ROUTES lists, in priority order, the aliases (Arabic/English) that send a
+user type to each agent. An alias is a tuple of parts that must all appear
+in the user type. Parts are normalized once and compiled into a single
+regex, and the result for each raw user_type string is memoized, so the
+Flask routes, the CLI and the agents all share one cheap lookup.
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from .text_normalizer import normalize_text
+
+# (route key, aliases) — الأولوية بالترتيب: الحج قبل العمرة لأن "حج خارجي" فيها "خارجي"
+ROUTES: Tuple[Tuple[str, Tuple[Tuple[str, ...], ...]], ...] = (
+    ("hajj_ex", (
+        ("حج", "خارج"),
+        ("hajj", "external"),
+        ("hajj", "international"),
+    )),
+    ("hajj_lo", (
+        ("حج", "داخل"),
+        ("حج", "محلي"),
+        ("hajj", "local"),
+        ("hajj", "domestic"),
+    )),
+    ("umrah", (
+        ("عمرة",),
+        ("وكيل",),
+        ("خارجي",),
+        ("umrah",),
+        ("external",),
+    )),
+)
+
+
+def _compile(routes):
+    compiled = tuple(
+        (key, tuple(frozenset(normalize_text(p) for p in alias) for alias in aliases))
+        for key, aliases in routes
+    )
+    parts = sorted({p for _, aliases in compiled for alias in aliases for p in alias},
+                   key=len, reverse=True)
+    # الجزء الأطول يغطي الأقصر اللي داخله ("خارجي" فيها "خارج")
+    implied: Dict[str, FrozenSet[str]] = {p: frozenset(q for q in parts if q in p) for p in parts}
+    pattern = re.compile("|".join(re.escape(p) for p in parts))
+    return compiled, implied, pattern
+
+
+_ROUTES, _IMPLIED, _PATTERN = _compile(ROUTES)
+
+
+@lru_cache(maxsize=1024)
+def route_user_type(user_type: str) -> Optional[str]:
+    """Return the route key ("umrah", "hajj_ex", "hajj_lo") for a raw user type, or None."""
+    normalized = normalize_text(user_type or "")
+    if not normalized:
+        return None
+
+    found = set()
+    for match in _PATTERN.finditer(normalized):
+        found |= _IMPLIED[match.group(0)]
+
+    for key, aliases in _ROUTES:
+        if any(alias <= found for alias in aliases):
+            return key
+    return None
@@ -1,40 +1,250 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import (
+    Flask, render_template, request, jsonify, redirect, url_for, flash, Response, g, stream_with_context,
+    session, make_response
+)
 from flask_cors import CORS
 import os
-import math
 import time
+import threading
+import functools
 from datetime import datetime, timezone
 
 from Logic import get_agent_for_user
-from agent.mongo_helper import get_all_cases, get_case_by_id, insert_case, update_case, delete_case
+from agent.SmartAgent import SmartAgent
+from agent.mongo_helper import (
+    get_collection, get_catalog_version, list_cases, get_categories, get_case_by_id, insert_case, update_case, delete_case
+)
+from agent.case_io import parse_keywords, parse_synonyms, synonym_errors, format_for, import_file, export_cases
 from agent.chatbot import (
     get_or_create_session, get_welcome_message, get_smart_response,
-    handle_feedback, clean_old_sessions
+    handle_feedback, clean_old_sessions, conversations
 )
 from agent.analytics_helper import (
     log_interaction, get_dashboard_stats, get_recent_queries,
-    get_popular_queries, get_hourly_activity, get_daily_trends
+    get_popular_queries, get_hourly_activity, get_daily_trends, get_latency_percentiles,
+    get_logs_version, hot_queries_collection
+)
+from agent.alert_dispatcher import get_alert_queue_depth
+from agent.case_index import cache_stats, get_case_index, RANKING_MODES
+from agent.suggest_index import case_popularity, SUGGEST_LIMIT
+from agent.heavy_hitters import get_hot_query_tracker
+from agent import metrics
+from agent.mongo_indexes import ensure_indexes
+from agent.request_profiler import request_profiler, PROFILE_HEADER
+from agent.http_cache import (
+    COMPRESS_MIN_BYTES, COMPRESS_MIMETYPES, choose_encoding, compress, make_etag, etag_matches, version_cache
+)
+from agent.response_cache import ResponseCache, RESPONSE_CACHE, format_match, safe_val as _safe_val
+from agent.stage_timer import (
+    start_timer, stop_timer, current_timer, stage_histograms, SERVER_TIMING, STAGES,
+    SESSION, FAQ, AGENT, SEMANTIC, LOG, RENDER
 )
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "dev-secret-key-change-in-production")
 CORS(app)
 
+
+def _ensure_indexes():
+    try:
+        ensure_indexes()
+    except Exception as e:
+        app.logger.error(f"Failed to ensure MongoDB indexes: {e}")
+
+
+# Create MongoDB indexes at startup (idempotent). Runs in the background so
+# an unreachable database doesn't block the server from starting.
+if os.environ.get("CALLHELPER_ENSURE_INDEXES", "1") != "0":
+    threading.Thread(target=_ensure_indexes, name="ensure-indexes", daemon=True).start()
+
+# Per-stage timing for the matching endpoints (see agent/stage_timer.py)
+TIMED_ENDPOINTS = {"search", "api_chat", "api_resolve"}
+
+
+@app.before_request
+def _start_stage_timer():
+    g.request_started = time.perf_counter()
+    if request.endpoint in TIMED_ENDPOINTS:
+        g.stage_timer, g.stage_timer_token = start_timer(request.endpoint)
+
+
+@app.after_request
+def _finish_stage_timer(response):
+    endpoint = request.endpoint or "unmatched"
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.HTTP_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+    metrics.HTTP_REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+
+    timer = g.pop("stage_timer", None)
+    if timer is not None:
+        timer.lap(RENDER)
+        stage_histograms.record(timer)
+        for stage, ns in zip(STAGES, timer.ns):
+            if ns:
+                metrics.STAGE_LATENCY.labels(endpoint, stage).observe(ns / 1e9)
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+
+@app.teardown_request
+def _reset_stage_timer(exc):
+    token = g.pop("stage_timer_token", None)
+    if token is not None:
+        stop_timer(token)
+
+
+@app.before_request
+def _start_profiler():
+    session = request_profiler.start(request.endpoint, request.headers.get(PROFILE_HEADER))
+    if session is not None:
+        g.profile_session = session
+
+
+@app.after_request
+def _mark_profiled(response):
+    session = g.get("profile_session")
+    if session is not None:
+        response.headers["X-CallHelper-Profiled"] = session.reason
+    return response
+
+
+@app.teardown_request
+def _stop_profiler(exc):
+    session = g.pop("profile_session", None)
+    if session is not None:
+        request_profiler.stop(session)
+
+
+@app.after_request
+def _compress_response(response):
+    """gzip/deflate JSON, HTML and text bodies above CALLHELPER_COMPRESS_MIN_BYTES."""
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESS_MIMETYPES
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    response.vary.add("Accept-Encoding")
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+# يتغير مع كل نشر (القوالب أو app.py) عشان ما يرجع 304 لصفحة بقالب قديم
+_ETAG_SALT = max(
+    os.path.getmtime(path)
+    for path in [__file__] + [
+        os.path.join(app.root_path, "templates", name)
+        for name in os.listdir(os.path.join(app.root_path, "templates"))
+    ]
+)
+
+
+def _logs_version():
+    return version_cache.get("logs", get_logs_version)
+
+
+def _popular_version():
+    # النتيجة من snapshot يتجدد بالخلفية، فنسخته تدخل مع نسخة السجلات
+    logs = _logs_version()
+    if logs is None:
+        return None
+    return logs, get_hot_query_tracker(hot_queries_collection).generation
+
+
+def _catalog_version():
+    def lookup():
+        collection = get_collection()
+        return get_catalog_version(collection), collection.estimated_document_count()
+    return version_cache.get("catalog", lookup)
+
+
+def _conditional(version):
+    """
+    ETag / If-None-Match for a read view whose output only depends on the
+    request URL, today's date and `version()`. A matching request gets a
+    304 before the view runs.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            # رسائل flash لازم تنعرض، فما نرجع 304 للصفحة
+            if "_flashes" in session:
+                return view(*args, **kwargs)
+            try:
+                data_version = version()
+            except Exception as e:
+                app.logger.error(f"ETag version lookup failed: {e}")
+                data_version = None
+            if data_version is None:
+                return view(*args, **kwargs)
+
+            today = datetime.now(timezone.utc).date().isoformat()
+            etag = make_etag(_ETAG_SALT, request.full_path, today, data_version)
+            if etag_matches(request.headers.get("If-None-Match"), etag):
+                return Response(status=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.headers["ETag"] = etag
+                response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapped
+    return decorator
+
+
+def _collect_runtime_metrics():
+    """Gauges read on demand (before each /metrics scrape or snapshot)."""
+    metrics.CHAT_SESSIONS.set(len(conversations))
+    metrics.ALERT_QUEUE_DEPTH.set(get_alert_queue_depth())
+    metrics.HOT_QUERIES_PENDING.set(get_hot_query_tracker(hot_queries_collection).pending_count())
+    metrics.CASE_INDEX_CASES.clear()
+    for entry in cache_stats():
+        metrics.CASE_INDEX_AGE.labels(entry["collection"]).set(round(entry["age_seconds"], 3))
+        for partition, count in entry["partitions"].items():
+            metrics.CASE_INDEX_CASES.labels(entry["collection"], partition).set(count)
+
+
+metrics.REGISTRY.add_collect_callback(_collect_runtime_metrics)
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition (merged across workers when CALLHELPER_METRICS_DIR is set)"""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
 # Home page
 @app.get("/")
 def index():
     return render_template("index.html")
 
 
-def _safe_val(v):
-    if v is None:
-        return None
-    try:
-        if isinstance(v, float) and math.isnan(v):
-            return None
-    except Exception:
-        pass
-    return v
+# Encoded case fragments for /api/resolve, with the same encoding as jsonify()
+response_cache = ResponseCache(lambda obj: app.json.dumps(obj, separators=(",", ":")))
+
+
+def _resolve_response(agent, fields, rows, alternatives=False):
+    """/api/resolve success body: `fields` + "match" (+ "alternatives") from cached fragments."""
+    if not RESPONSE_CACHE or app.json.compact is False or (app.json.compact is None and app.debug):
+        # jsonify يطبع بمسافات في وضع debug، فنبني الرد العادي
+        matches = [format_match(row) for row in rows]
+        body = {**fields, "match": matches[0]}
+        if alternatives:
+            body["alternatives"] = matches
+        return app.json.response(body)
+    body = response_cache.resolve_response(agent.get_index(), fields, rows, alternatives)
+    return app.response_class(body, mimetype=app.json.mimetype)
 
 
 @app.post("/search")
@@ -54,6 +264,7 @@ def search():
             return jsonify({"error": "الرجاء ملء جميع الحقول المطلوبة"}), 400
 
         agent = get_agent_for_user(user_type)
+        current_timer().lap(AGENT)
         if agent is None:
             return jsonify({"error": "نوع الجهة غير مدعوم"}), 400
 
@@ -89,14 +300,25 @@ def search():
         return jsonify({"error": f"حدث خطأ غير متوقع: {str(e)}"}), 500
 
 
-@app.post("/api/chat")
-def api_chat():
-    """Smart chatbot endpoint with conversation flows"""
+CHAT_ERROR = {
+    "success": False,
+    "response": "حدث خطأ، الرجاء المحاولة مرة أخرى",
+    "quick_replies": ["العودة للبداية"]
+}
+
+
+def chat_reply(data):
+    """
+    Reply to one chat message (the JSON body of /api/chat). Returns (body, status).
+
+    Shared by the Flask view and the asyncio server (asgi.py), which runs it
+    in its scoring thread pool.
+    """
+    timer = current_timer()
     try:
         # Clean old sessions periodically
         clean_old_sessions()
         
-        data = request.get_json(force=True) or {}
         message = (data.get("message") or "").strip()
         user_type = (data.get("user_type") or "شركة عمرة").strip()
         is_first = data.get("is_first", False)
@@ -104,16 +326,17 @@ def api_chat():
         
         # Get or create session
         session = get_or_create_session(session_id)
+        timer.lap(SESSION)
         
         # Welcome message
         if is_first or not message:
             result = get_welcome_message()
-            return jsonify({
+            return {
                 "success": True,
                 "response": result["response"],
                 "quick_replies": result["quick_replies"],
                 "session_id": session.session_id
-            })
+            }, 200
         
         # Add user message to history
         session.add_message("user", message)
@@ -122,38 +345,44 @@ def api_chat():
         if "ساعد" in message or "نعم" in message or "إيه" in message or "لا" in message or "تحدث مع موظف" in message:
             result = handle_feedback(message, session)
             session.add_message("bot", result["response"])
-            return jsonify({
+            return {
                 "success": True,
                 "response": result["response"],
                 "quick_replies": result["quick_replies"],
                 "session_id": session.session_id
-            })
+            }, 200
         
         # Get smart response (check FAQ and common solutions first)
         smart_result = get_smart_response(message, session)
+        timer.lap(FAQ)
         
         if not smart_result["needs_db"]:
             # FAQ or common solution found
             session.add_message("bot", smart_result["response"])
-            return jsonify({
+            return {
                 "success": True,
                 "response": smart_result["response"],
                 "quick_replies": smart_result["quick_replies"],
                 "session_id": session.session_id
-            })
+            }, 200
         
         # If no FAQ match, search database
         agent = get_agent_for_user(user_type)
+        timer.lap(AGENT)
         if agent is None:
             result = get_welcome_message()
-            return jsonify({
+            return {
                 "success": True,
                 "response": result["response"],
                 "quick_replies": result["quick_replies"],
                 "session_id": session.session_id
-            })
+            }, 200
         
         best_row, status_msg = agent.find_best_row(message)
+        if best_row is None:
+            # No keyword hit: fall back to the nearest case by text similarity
+            best_row, status_msg = agent.find_semantic_row(message)
+            timer.lap(SEMANTIC)
         
         if best_row is None:
             response_text = "عذراً، لم أجد إجابة دقيقة في قاعدة البيانات.\n\nهل يمكنك إعادة صياغة السؤال أو اختيار موضوع من القائمة؟"
@@ -175,167 +404,227 @@ def api_chat():
         
         session.add_message("bot", response_text)
         
-        return jsonify({
+        return {
             "success": True,
             "response": response_text,
             "quick_replies": quick_replies,
             "session_id": session.session_id
-        })
+        }, 200
     
     except Exception as e:
-        return jsonify({
-            "success": False,
-            "response": "حدث خطأ، الرجاء المحاولة مرة أخرى",
-            "quick_replies": ["العودة للبداية"]
-        }), 500
+        return CHAT_ERROR, 500
 
 
-@app.post("/api/resolve")
-def api_resolve():
-    start_time = time.time()
+@app.post("/api/chat")
+def api_chat():
+    """Smart chatbot endpoint with conversation flows"""
     try:
         data = request.get_json(force=True) or {}
-        name = (data.get("name") or "").strip()
-        user_type = (data.get("user_type") or "").strip()
-        issue = (data.get("issue") or "").strip()
-        get_alternatives = data.get("get_alternatives", False)
-        
-        app.logger.info(f"\n[API] Received request:")
-        app.logger.info(f"  user_type: '{user_type}'")
-        app.logger.info(f"  issue: '{issue}'")
-        app.logger.info(f"  get_alternatives: {get_alternatives}")
-
-        if not user_type or not issue:
-            return jsonify({
-                "success": False,
-                "message": "Missing required fields: user_type and issue",
-            }), 400
+    except Exception:
+        return jsonify(CHAT_ERROR), 500
+    body, status = chat_reply(data)
+    return jsonify(body), status
+
+
+class ResolveResult:
+    """Outcome of resolve_issue(): the response to send and the interaction to log."""
+    __slots__ = ("status", "fields", "rows", "alternatives", "agent", "log")
+
+    def __init__(self, status, fields, rows=None, alternatives=False, agent=None, log=None):
+        self.status = status
+        self.fields = fields              # JSON body, without "match"/"alternatives" when rows are set
+        self.rows = rows                  # matched cases, best first
+        self.alternatives = alternatives
+        self.agent = agent
+        self.log = log                    # log_interaction() kwargs, or None
+
+
+def resolve_issue(data, start_time):
+    """
+    Matching part of /api/resolve for a parsed JSON body; logging and
+    rendering are left to the caller. Shared by the Flask view and the
+    asyncio server (asgi.py), which runs it in its scoring thread pool.
+    """
+    timer = current_timer()
+    name = (data.get("name") or "").strip()
+    user_type = (data.get("user_type") or "").strip()
+    issue = (data.get("issue") or "").strip()
+    get_alternatives = data.get("get_alternatives", False)
+    ranking = data.get("ranking")  # "keywords" / "bm25" (optional)
+    
+    app.logger.info(f"\n[API] Received request:")
+    app.logger.info(f"  user_type: '{user_type}'")
+    app.logger.info(f"  issue: '{issue}'")
+    app.logger.info(f"  get_alternatives: {get_alternatives}")
 
-        agent = get_agent_for_user(user_type)
-        if agent is None:
-            log_interaction(
-                interaction_type="resolve",
-                user_type=user_type,
-                query=issue,
-                success=False,
-                error_message="Unsupported user type"
-            )
-            return jsonify({
-                "success": False,
-                "message": "Unsupported user type for now.",
-            }), 400
+    if not user_type or not issue:
+        return ResolveResult(400, {
+            "success": False,
+            "message": "Missing required fields: user_type and issue",
+        })
+    if ranking and ranking not in RANKING_MODES:
+        return ResolveResult(400, {
+            "success": False,
+            "message": f"Unknown ranking: use one of {', '.join(RANKING_MODES)}",
+        })
 
-        # Get all matches if alternatives requested
-        if get_alternatives:
-            all_matches = agent.find_all_matches(issue, limit=5)
-            response_time = (time.time() - start_time) * 1000
-            
-            if not all_matches:
-                return jsonify({
-                    "success": False,
-                    "message": "No matches found",
-                    "alternatives": []
-                }), 200
-            
-            # Log first match
-            log_interaction(
-                interaction_type="resolve",
-                user_type=user_type,
-                query=issue,
-                success=True,
-                response_time=response_time,
-                matched_case_id=_safe_val(all_matches[0].get("CaseID"))
-            )
-            
-            # Format all matches
-            formatted_matches = []
-            for match in all_matches:
-                formatted_matches.append({
-                    "case_id": _safe_val(match.get("CaseID")),
-                    "category": _safe_val(match.get("Category")),
-                    "subcategory": _safe_val(match.get("SubCategory")),
-                    "priority": _safe_val(match.get("Priorty")),
-                    "score": _safe_val(match.get("MatchScore")),
-                    "response_text": _safe_val(match.get("ResponseText")),
-                    "fallback": _safe_val(match.get("FallbackText")),
-                    "why": _safe_val(match.get("Why")),
-                    "last_updated": _safe_val(match.get("LastUpdated")),
-                })
-            
-            return jsonify({
-                "success": True,
-                "message": "Found multiple matches",
-                "customer": name,
-                "user_type": user_type,
-                "match": formatted_matches[0],
-                "alternatives": formatted_matches
-            })
-        
-        # Original behavior - get best match only
-        best_row, status_msg = agent.find_best_row(issue)
-        
-        response_time = (time.time() - start_time) * 1000  # Convert to ms
+    agent = get_agent_for_user(user_type)
+    timer.lap(AGENT)
+    if agent is None:
+        return ResolveResult(400, {
+            "success": False,
+            "message": "Unsupported user type for now.",
+        }, log=dict(
+            interaction_type="resolve",
+            user_type=user_type,
+            query=issue,
+            success=False,
+            error_message="Unsupported user type"
+        ))
+
+    # Get all matches if alternatives requested
+    if get_alternatives:
+        all_matches = agent.find_all_matches(issue, limit=5, ranking=ranking)
+        if not all_matches:
+            # No keyword hit: fall back to the nearest case by text similarity
+            semantic_row, _ = agent.find_semantic_row(issue)
+            all_matches = [semantic_row] if semantic_row is not None else []
+            timer.lap(SEMANTIC)
+        response_time = (time.time() - start_time) * 1000
         
-        if best_row is None:
-            log_interaction(
-                interaction_type="resolve",
-                user_type=user_type,
-                query=issue,
-                success=False,
-                response_time=response_time
-            )
-            return jsonify({
+        if not all_matches:
+            return ResolveResult(200, {
                 "success": False,
-                "message": status_msg,
-            }), 200
-
-        # Extract fields safely
-        case_id = _safe_val(best_row.get("CaseID"))
+                "message": "No matches found",
+                "alternatives": []
+            })
         
-        # Log successful interaction
-        log_interaction(
+        # Log first match; all matches are formatted from cached per-case JSON
+        return ResolveResult(200, {
+            "success": True,
+            "message": "Found multiple matches",
+            "customer": name,
+            "user_type": user_type,
+        }, all_matches, alternatives=True, agent=agent, log=dict(
             interaction_type="resolve",
             user_type=user_type,
             query=issue,
             success=True,
             response_time=response_time,
-            matched_case_id=case_id
-        )
-        
-        resp = {
-            "success": True,
+            matched_case_id=_safe_val(all_matches[0].get("CaseID"))
+        ))
+    
+    # Original behavior - get best match only
+    best_row, status_msg = agent.find_best_row(issue, ranking=ranking)
+    if best_row is None:
+        # No keyword hit: fall back to the nearest case by text similarity
+        best_row, status_msg = agent.find_semantic_row(issue)
+        timer.lap(SEMANTIC)
+    
+    response_time = (time.time() - start_time) * 1000  # Convert to ms
+    
+    if best_row is None:
+        return ResolveResult(200, {
+            "success": False,
             "message": status_msg,
-            "customer": name,
-            "user_type": user_type,
-            "match": {
-                "case_id": case_id,
-                "category": _safe_val(best_row.get("Category")),
-                "subcategory": _safe_val(best_row.get("SubCategory")),
-                "priority": _safe_val(best_row.get("Priorty")),  # note: source typo
-                "score": _safe_val(best_row.get("MatchScore")),
-                "response_text": _safe_val(best_row.get("ResponseText")),
-                "fallback": _safe_val(best_row.get("FallbackText")),
-                "why": _safe_val(best_row.get("Why")),
-                "last_updated": _safe_val(best_row.get("LastUpdated")),
-            }
-        }
-        return jsonify(resp)
-
-    except Exception as e:
-        response_time = (time.time() - start_time) * 1000
-        log_interaction(
+        }, log=dict(
             interaction_type="resolve",
-            user_type=user_type if 'user_type' in locals() else "unknown",
-            query=issue if 'issue' in locals() else "unknown",
+            user_type=user_type,
+            query=issue,
             success=False,
-            response_time=response_time,
-            error_message=str(e)
-        )
-        # Avoid leaking stack trace to clients
+            response_time=response_time
+        ))
+
+    return ResolveResult(200, {
+        "success": True,
+        "message": status_msg,
+        "customer": name,
+        "user_type": user_type,
+    }, [best_row], agent=agent, log=dict(
+        interaction_type="resolve",
+        user_type=user_type,
+        query=issue,
+        success=True,
+        response_time=response_time,
+        matched_case_id=_safe_val(best_row.get("CaseID"))
+    ))
+
+
+def resolve_response(result):
+    """Flask response for a ResolveResult (works outside a request context)."""
+    if result.rows:
+        return _resolve_response(result.agent, result.fields, result.rows, result.alternatives)
+    response = app.json.response(result.fields)
+    response.status_code = result.status
+    return response
+
+
+def resolve_error(data, start_time, error):
+    """(log_interaction() kwargs, response) for an unexpected /api/resolve failure."""
+    def field(key):
+        try:
+            return (data.get(key) or "").strip()
+        except Exception:
+            return "unknown"
+
+    log = dict(
+        interaction_type="resolve",
+        user_type=field("user_type"),
+        query=field("issue"),
+        success=False,
+        response_time=(time.time() - start_time) * 1000,
+        error_message=str(error)
+    )
+    # Avoid leaking stack trace to clients
+    response = app.json.response({
+        "success": False,
+        "message": "Internal server error",
+    })
+    response.status_code = 500
+    return log, response
+
+
+@app.post("/api/resolve")
+def api_resolve():
+    start_time = time.time()
+    data = None
+    try:
+        data = request.get_json(force=True) or {}
+        result = resolve_issue(data, start_time)
+        if result.log is not None:
+            log_interaction(**result.log)
+            current_timer().lap(LOG)
+        return resolve_response(result)
+    except Exception as e:
+        log, response = resolve_error(data, start_time, e)
+        log_interaction(**log)
+        return response
+
+
+@app.get("/api/suggest")
+def api_suggest():
+    """Typeahead: known keywords, synonyms and categories starting with `q`"""
+    try:
+        q = request.args.get("q", "")
+        user_type = request.args.get("user_type", "").strip()
+        limit = max(1, min(request.args.get("limit", SUGGEST_LIMIT, type=int), 50))
+
+        if user_type:
+            agent = get_agent_for_user(user_type)
+            if agent is None:
+                return jsonify({"error": "نوع الجهة غير مدعوم"}), 400
+            index = agent.get_index()
+        else:
+            # بدون نوع مستخدم: كل حالات المجموعة الرئيسية
+            index = get_case_index(get_collection())
+        if index is None:
+            return jsonify({"query": q, "suggestions": []})
         return jsonify({
-            "success": False,
-            "message": "Internal server error",
-        }), 500
+            "query": q,
+            "suggestions": index.suggest().suggest(q, limit, case_popularity.get()),
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 
 # ============================================
@@ -343,6 +632,7 @@ def api_resolve():
 # ============================================
 
 @app.get("/api/analytics/stats")
+@_conditional(_logs_version)
 def api_analytics_stats():
     """Get dashboard statistics"""
     try:
@@ -353,6 +643,7 @@ def api_analytics_stats():
 
 
 @app.get("/api/analytics/recent")
+@_conditional(_logs_version)
 def api_analytics_recent():
     """Get recent queries"""
     try:
@@ -364,17 +655,20 @@ def api_analytics_recent():
 
 
 @app.get("/api/analytics/popular")
+@_conditional(_popular_version)
 def api_analytics_popular():
     """Get popular queries"""
     try:
         limit = request.args.get("limit", 10, type=int)
-        queries = get_popular_queries(limit=limit)
+        days = request.args.get("days", type=int)
+        queries = get_popular_queries(limit=limit, days=days)
         return jsonify(queries)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.get("/api/analytics/hourly")
+@_conditional(_logs_version)
 def api_analytics_hourly():
     """Get hourly activity for today"""
     try:
@@ -385,6 +679,7 @@ def api_analytics_hourly():
 
 
 @app.get("/api/analytics/trends")
+@_conditional(_logs_version)
 def api_analytics_trends():
     """Get daily trends"""
     try:
@@ -395,33 +690,84 @@ def api_analytics_trends():
         return jsonify({"error": str(e)}), 500
 
 
+@app.get("/api/analytics/latency")
+@_conditional(_logs_version)
+def api_analytics_latency():
+    """Get p50/p90/p99 response times per user type and interaction type"""
+    try:
+        days = request.args.get("days", 7, type=int)
+        group_by = [f for f in request.args.get("by", "user_type,interaction_type").split(",") if f]
+        return jsonify(get_latency_percentiles(days=days, group_by=group_by))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/api/analytics/stages")
+def api_analytics_stages():
+    """Get per-stage timing histograms for the matching endpoints (this worker process)"""
+    try:
+        return jsonify(stage_histograms.snapshot())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/api/analytics/errors")
+def api_analytics_errors():
+    """Get agent error counts per day and error type (from daily aggregates)"""
+    try:
+        days = request.args.get("days", 7, type=int)
+        rows = SmartAgent().get_error_report(days=days)
+        if request.args.get("format") == "csv":
+            lines = ["date,error_type,count"]
+            lines += [f"{r['date']},{r['error_type']},{r['count']}" for r in rows]
+            return Response("\n".join(lines) + "\n", mimetype="text/csv")
+        return jsonify(rows)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 # ============================================
 # Admin Routes for Database Management
 # ============================================
 
-def parse_keywords(s):
-    """Parse comma/newline-separated keywords into a list."""
-    if not s:
-        return []
-    parts = []
-    for line in s.replace("\r", "\n").split("\n"):
-        for p in line.split(","):
-            t = p.strip().lower()
-            if t:
-                parts.append(t)
-    # Remove duplicates while preserving order
-    return list(dict.fromkeys(parts))
+ADMIN_PAGE_SIZE = int(os.environ.get("CALLHELPER_ADMIN_PAGE_SIZE", "50"))
 
 
 @app.route("/admin")
+@_conditional(_catalog_version)
 def admin_list():
-    """List all cases in the database."""
+    """List cases one page at a time (keyset pagination on CaseID, optional filters)."""
+    filters = {
+        "category": request.args.get("category", "").strip(),
+        "keyword": request.args.get("keyword", "").strip(),
+    }
+    limit = max(1, min(request.args.get("limit", ADMIN_PAGE_SIZE, type=int), 500))
     try:
-        cases = get_all_cases()
-        return render_template("admin_list.html", cases=cases)
+        page = list_cases(
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+            limit=limit,
+            category=filters["category"] or None,
+            keyword=filters["keyword"] or None,
+        )
+        categories = get_categories()
     except Exception as e:
         flash(f"Error loading cases: {e}", "error")
-        return render_template("admin_list.html", cases=[])
+        page = {"cases": [], "total": 0, "next_after": None, "prev_before": None}
+        categories = []
+    # الفلاتر تنحفظ في روابط الصفحات
+    link_args = {k: v for k, v in filters.items() if v}
+    if limit != ADMIN_PAGE_SIZE:
+        link_args["limit"] = limit
+    return render_template(
+        "admin_list.html",
+        cases=page["cases"],
+        total=page["total"],
+        next_url=url_for("admin_list", after=page["next_after"], **link_args) if page["next_after"] else None,
+        prev_url=url_for("admin_list", before=page["prev_before"], **link_args) if page["prev_before"] else None,
+        categories=categories,
+        filters=filters,
+    )
 
 
 @app.route("/admin/add", methods=["GET", "POST"])
@@ -437,7 +783,7 @@ def admin_add():
             "SubCategory": form.get("SubCategory", "").strip(),
             "MainKeywords": parse_keywords(form.get("MainKeywords", "")),
             "ExtraKeywords": parse_keywords(form.get("ExtraKeywords", "")),
-            "Synonyms": parse_keywords(form.get("Synonyms", "")),
+            "Synonyms": parse_synonyms(form.get("Synonyms", "")),
             "NegativeKeywords": parse_keywords(form.get("NegativeKeywords", "")),
             "Priorty": form.get("Priorty", "").strip(),
             "ResponseText": form.get("ResponseText", "").strip(),
@@ -450,6 +796,10 @@ def admin_add():
         if not data["CaseID"] or not data["UserType"] or not data["Category"] or not data["MainKeywords"] or not data["ResponseText"]:
             flash("Please fill all required fields: CaseID, UserType, Category, MainKeywords, ResponseText", "error")
             return render_template("admin_form.html", mode="add", data=data)
+        error = synonym_errors(data)
+        if error:
+            flash(f"Invalid Synonyms: {error}", "error")
+            return render_template("admin_form.html", mode="add", data=data)
         
         try:
             insert_case(data)
@@ -479,7 +829,7 @@ def admin_edit(case_id):
             "SubCategory": form.get("SubCategory", "").strip(),
             "MainKeywords": parse_keywords(form.get("MainKeywords", "")),
             "ExtraKeywords": parse_keywords(form.get("ExtraKeywords", "")),
-            "Synonyms": parse_keywords(form.get("Synonyms", "")),
+            "Synonyms": parse_synonyms(form.get("Synonyms", "")),
             "NegativeKeywords": parse_keywords(form.get("NegativeKeywords", "")),
             "Priorty": form.get("Priorty", "").strip(),
             "ResponseText": form.get("ResponseText", "").strip(),
@@ -492,6 +842,10 @@ def admin_edit(case_id):
         if not data["UserType"] or not data["Category"] or not data["MainKeywords"] or not data["ResponseText"]:
             flash("Please fill all required fields: UserType, Category, MainKeywords, ResponseText", "error")
             return render_template("admin_form.html", mode="edit", data={**existing, **data})
+        error = synonym_errors(data)
+        if error:
+            flash(f"Invalid Synonyms: {error}", "error")
+            return render_template("admin_form.html", mode="edit", data={**existing, **data})
         
         try:
             update_case(case_id, data)
@@ -515,6 +869,82 @@ def admin_delete(case_id):
     return redirect(url_for("admin_list"))
 
 
+@app.route("/admin/import", methods=["POST"])
+def admin_import():
+    """Bulk upsert cases from an uploaded CSV or JSON lines file."""
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Please choose a CSV or JSONL file to import.", "error")
+        return redirect(url_for("admin_list"))
+    fmt = format_for(upload.filename)
+    if fmt is None:
+        flash("Unsupported file type: use .csv or .jsonl", "error")
+        return redirect(url_for("admin_list"))
+
+    dry_run = bool(request.form.get("dry_run"))
+    try:
+        report = import_file(upload.stream, fmt, dry_run=dry_run)
+    except Exception as e:
+        flash(f"Error importing cases: {e}", "error")
+        return redirect(url_for("admin_list"))
+
+    summary = (f"{report['valid']} valid / {report['invalid']} invalid rows: "
+               f"{report['inserted']} inserted, {report['updated']} updated")
+    ok = report["valid"] and not report["aborted"]
+    flash(("Validated " if dry_run else "Imported ") + summary, "success" if ok else "error")
+    if report["aborted"]:
+        flash(f"Import incomplete, {report['aborted']}", "error")
+    for error in report["errors"][:20]:
+        flash(f"Line {error['line']} {error['CaseID'] or ''}: {error['error']}", "error")
+    if report["invalid"] > 20:
+        flash(f"... and {report['invalid'] - 20} more invalid rows", "error")
+    return redirect(url_for("admin_list"))
+
+
+@app.get("/admin/export")
+def admin_export():
+    """Stream all cases as CSV (default) or JSON lines."""
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "jsonl"):
+        return jsonify({"error": "format must be csv or jsonl"}), 400
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"cases-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{fmt}"
+    return Response(
+        stream_with_context(export_cases(fmt)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+@app.route("/admin/profiling", methods=["GET", "POST", "DELETE"])
+def admin_profiling():
+    """Request profiler: GET the hot-function report, POST settings, DELETE to reset."""
+    try:
+        if request.method == "POST":
+            data = request.get_json(silent=True) or request.form
+            request_profiler.configure(
+                sample_every=data.get("sample_every"),
+                profile_next=data.get("profile_next"),
+            )
+            return jsonify(request_profiler.settings())
+        if request.method == "DELETE":
+            request_profiler.reset()
+            return jsonify(request_profiler.settings())
+
+        endpoint = request.args.get("endpoint")
+        sort = request.args.get("sort", "cumulative")
+        limit = request.args.get("limit", 30, type=int)
+        if request.args.get("format") == "text":
+            if not endpoint:
+                return jsonify({"error": "endpoint is required for format=text"}), 400
+            return Response(request_profiler.report_text(endpoint, sort=sort, limit=limit), mimetype="text/plain")
+        return jsonify(request_profiler.report(endpoint, sort=sort, limit=limit))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 if __name__ == "__main__":
     # For local development
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+asgi.py
+asyncio serving mode, for thousands of concurrent connections per worker.
+
+    uvicorn asgi:app --workers 4 --limit-concurrency 4000 --backlog 4096
+
+POST /api/resolve and POST /api/chat are served on the event loop:
+- the request body is read asynchronously, so slow clients and idle
+  keep-alive connections hold a coroutine, not a thread;
+- matching (resolve_issue / chat_reply from app.py) runs in a small pool
+  of CALLHELPER_ASGI_SCORING_THREADS threads;
+- the interaction log is written with motor (agent/async_mongo.py).
+Requests and responses go through the Flask app's own machinery: each
+request gets a Flask request context, and the response is finished by
+app.process_response (stage timing, metrics, compression, CORS), so the
+contract is the same as under gunicorn. The request profiler only runs
+under the Flask server (it hooks before_request, which is not run here).
+
+Every other route, analytics included, is passed unchanged to the Flask
+app through a small WSGI bridge running in CALLHELPER_ASGI_WSGI_THREADS
+threads; the analytics views are short pymongo aggregations answered
+from ETags most of the time.
+
+Scoring is pure Python and holds the GIL, and a process pool would need
+its own copy of every case index, so CPU parallelism comes from uvicorn
+worker processes, as it does from gunicorn workers.
+"""
+
+import io
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request, g
+
+from app import app as flask_app, resolve_issue, resolve_response, resolve_error, chat_reply, CHAT_ERROR
+from agent.async_mongo import log_interaction_async, close_client
+from agent.stage_timer import start_timer, current_timer, LOG
+
+SCORING_THREADS = int(os.getenv("CALLHELPER_ASGI_SCORING_THREADS", str(min(4, os.cpu_count() or 1))))
+WSGI_THREADS = int(os.getenv("CALLHELPER_ASGI_WSGI_THREADS", "32"))
+# Largest JSON body accepted by /api/resolve and /api/chat
+MAX_BODY_BYTES = int(os.getenv("CALLHELPER_ASGI_MAX_BODY", str(1024 * 1024)))
+# Bodies passed to Flask (uploads) are kept in memory up to this size, then spooled to disk
+SPOOL_BYTES = 1024 * 1024
+
+scoring_pool = ThreadPoolExecutor(SCORING_THREADS, thread_name_prefix="asgi-scoring")
+wsgi_pool = ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix="asgi-wsgi")
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def _run(pool, func, *args):
+    """Run `func` in `pool` within the caller's context (Flask request, stage timer)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, contextvars.copy_context().run, func, *args)
+
+
+async def _read_body(receive, limit=None):
+    """(file object, length) of the request body, or (None, 0) if the client went away."""
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    length = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            body.close()
+            return None, 0
+        chunk = message.get("body", b"")
+        length += len(chunk)
+        if limit is not None and length > limit:
+            body.close()
+            raise BodyTooLarge()
+        body.write(chunk)
+        if not message.get("more_body"):
+            break
+    body.seek(0)
+    return body, length
+
+
+def _path(scope):
+    path, root = scope["path"], scope.get("root_path", "")
+    # بعض السيرفرات تحط root_path داخل path
+    if root and path.startswith(root):
+        path = path[len(root):]
+    return path
+
+
+def _environ(scope, body, length):
+    """WSGI environ for an ASGI http scope."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": _path(scope).encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", ()):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key == "CONTENT_LENGTH":
+            continue
+        if key != "CONTENT_TYPE":
+            key = "HTTP_" + key
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _headers(pairs):
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in pairs]
+
+
+# ---- native endpoints ----
+
+
+async def _resolve():
+    start_time = time.time()
+    data = None
+    try:
+        data = request.get_json(force=True) or {}
+        result = await _run(scoring_pool, resolve_issue, data, start_time)
+        if result.log is not None:
+            await log_interaction_async(**result.log)
+            current_timer().lap(LOG)
+        return resolve_response(result)
+    except Exception as e:
+        log, response = resolve_error(data, start_time, e)
+        await log_interaction_async(**log)
+        return response
+
+
+async def _chat():
+    try:
+        data = request.get_json(force=True) or {}
+    except Exception:
+        body, status = CHAT_ERROR, 500
+    else:
+        body, status = await _run(scoring_pool, chat_reply, data)
+    response = flask_app.json.response(body)
+    response.status_code = status
+    return response
+
+
+async def _too_large():
+    response = flask_app.json.response({"success": False, "message": "Request body too large"})
+    response.status_code = 413
+    return response
+
+
+NATIVE_ROUTES = {
+    ("POST", "/api/resolve"): _resolve,
+    ("POST", "/api/chat"): _chat,
+}
+
+
+async def _send_response(send, response):
+    await send({
+        "type": "http.response.start",
+        "status": response.status_code,
+        "headers": _headers(response.headers.to_wsgi_list()),
+    })
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+
+async def _native(scope, receive, send, handler):
+    try:
+        body, length = await _read_body(receive, MAX_BODY_BYTES)
+    except BodyTooLarge:
+        # بدون body، بس لازم يمر على process_response عشان CORS
+        body, length, handler = io.BytesIO(), 0, _too_large
+    if body is None:
+        return
+
+    with body, flask_app.request_context(_environ(scope, body, length)):
+        # نفس _start_stage_timer في app.py (before_request ما تنفذ هنا)
+        g.request_started = time.perf_counter()
+        g.stage_timer, g.stage_timer_token = start_timer(request.endpoint)
+        response = await handler()
+        response = flask_app.process_response(response)
+    await _send_response(send, response)
+
+
+# ---- everything else: the Flask app in a thread pool ----
+
+
+async def _wsgi(scope, receive, send):
+    body, length = await _read_body(receive)
+    if body is None:
+        return
+    environ = _environ(scope, body, length)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    def call():
+        iterable = flask_app(environ, start_response)
+        chunks = iter(iterable)
+        return iterable, chunks, next(chunks, None)
+
+    # سياق واحد للطلب كله: stream_with_context يرجع نفس الـ ContextVar tokens
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    with body:
+        iterable, chunks, chunk = await loop.run_in_executor(wsgi_pool, context.run, call)
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": started["status"],
+                "headers": _headers(started["headers"]),
+            })
+            while chunk is not None:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(wsgi_pool, context.run, next, chunks, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                await loop.run_in_executor(wsgi_pool, context.run, close)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            close_client()
+            scoring_pool.shutdown(wait=False)
+            wsgi_pool.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return  # no websockets
+    handler = NATIVE_ROUTES.get((scope["method"], _path(scope)))
+    if handler is None:
+        await _wsgi(scope, receive, send)
+    else:
+        await _native(scope, receive, send, handler)
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks/
+Performance tooling for CallHelper (not imported by the app).
+"""
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks/bench_matching.py
+Benchmark the matching engine on synthetic catalogs.
+
+For each catalog size, cases from benchmarks/corpus.py are loaded into the
+in-memory Mongo stand-in and served by a real UmrahAgent, so the measured
+path is the production one (catalog version check, cached CaseIndex,
+scoring, sorting). Each mode runs the same query workload:
+
+    keywords   find_all_matches, keyword points, prefix tier
+    fuzzy      find_all_matches, prefix + fuzzy tiers
+    bm25       find_all_matches, BM25 ranking
+    semantic   find_semantic_row (hashed n-gram similarity)
+    suggest    typeahead suggestions for the first half of each query
+               (hit@1 is not measured)
+
+Reported per mode: index build time, p50/p90/p99 latency, throughput,
+hit@1 against the generating case, and peak traced memory (a separate
+tracemalloc pass, so it doesn't slow the timed run).
+
+Baselines:
+    python -m benchmarks.bench_matching --sizes 1000,10000 --save-baseline
+    python -m benchmarks.bench_matching --sizes 1000,10000     # compare, exit 1 on regression
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from .memory_mongo import install
+
+install()
+
+from agent.UmrahAgent import UmrahAgent  # noqa: E402  (after install())
+from agent.mongo_helper import get_collection, bump_catalog_version  # noqa: E402
+from .corpus import generate_cases, generate_queries, min_vocabulary  # noqa: E402
+
+MODES = ("keywords", "fuzzy", "bm25", "semantic", "suggest")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _runner(agent: UmrahAgent, mode: str):
+    if mode == "semantic":
+        return lambda q: [row for row in [agent.find_semantic_row(q)[0]] if row is not None]
+    if mode == "suggest":
+        return lambda q: agent.get_index().suggest().suggest(q)
+    if mode == "fuzzy":
+        return lambda q: agent.find_all_matches(q, tiers=("prefix", "fuzzy"), ranking="keywords")
+    if mode == "bm25":
+        return lambda q: agent.find_all_matches(q, tiers=("prefix",), ranking="bm25")
+    return lambda q: agent.find_all_matches(q, tiers=("prefix",), ranking="keywords")
+
+
+def _build(agent: UmrahAgent, mode: str):
+    """Force a fresh index (and the mode's lazy sub-index) and return it."""
+    bump_catalog_version(agent.collection)
+    index = agent.get_index()
+    if mode == "fuzzy":
+        index.fuzzy()
+    elif mode == "bm25":
+        index.bm25()
+    elif mode == "semantic":
+        index.semantic()
+    elif mode == "suggest":
+        index.suggest()
+    return index
+
+
+def bench_mode(agent: UmrahAgent, mode: str, queries: List[Tuple[str, Optional[str]]],
+               memory_queries: int = 200) -> dict:
+    run = _runner(agent, mode)
+    if mode == "suggest":
+        queries = [(q[:max(1, len(q) // 2)], None) for q, _ in queries]
+
+    started = time.perf_counter_ns()
+    _build(agent, mode)
+    build_ms = (time.perf_counter_ns() - started) / 1e6
+
+    latencies = []
+    hits = expected = 0
+    gc.collect()
+    wall = time.perf_counter_ns()
+    for query, case_id in queries:
+        t0 = time.perf_counter_ns()
+        results = run(query)
+        latencies.append((time.perf_counter_ns() - t0) / 1e6)
+        if case_id is not None:
+            expected += 1
+            hits += bool(results) and results[0].get("CaseID") == case_id
+    wall_s = (time.perf_counter_ns() - wall) / 1e9
+    latencies.sort()
+
+    # ذاكرة: بناء الفهرس من جديد + عينة استعلامات تحت tracemalloc
+    gc.collect()
+    tracemalloc.start()
+    _build(agent, mode)
+    for query, _ in queries[:memory_queries]:
+        run(query)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "build_ms": round(build_ms, 2),
+        "p50_ms": round(_percentile(latencies, 0.50), 4),
+        "p90_ms": round(_percentile(latencies, 0.90), 4),
+        "p99_ms": round(_percentile(latencies, 0.99), 4),
+        "max_ms": round(latencies[-1], 4) if latencies else 0.0,
+        "qps": round(len(queries) / wall_s, 1) if wall_s else 0.0,
+        "hit_at_1": round(hits / expected, 4) if expected else 0.0,
+        "peak_mb": round(peak / 2 ** 20, 2),
+    }
+
+
+def run_benchmarks(sizes: List[int], modes: List[str], query_count: int, vocabulary: int,
+                   zipf: float, typo_rate: float, miss_rate: float, seed: int) -> Dict[str, dict]:
+    collection = get_collection()
+    agent = UmrahAgent()
+    results = {}
+    for size in sizes:
+        cases = generate_cases(size, vocabulary_size=vocabulary, zipf=zipf, seed=seed)
+        queries = generate_queries(cases, query_count, typo_rate=typo_rate, miss_rate=miss_rate, seed=seed + 1)
+        collection.delete_many({})
+        collection.insert_many(cases)
+        del cases
+        for mode in modes:
+            result = bench_mode(agent, mode, queries)
+            results[f"{mode}@{size}"] = result
+            print(f"{mode:>9} @ {size:>7}: build {result['build_ms']:>9.1f} ms | "
+                  f"p50 {result['p50_ms']:>8.3f} p90 {result['p90_ms']:>8.3f} p99 {result['p99_ms']:>8.3f} ms | "
+                  f"{result['qps']:>9.1f} q/s | hit@1 {result['hit_at_1']:.3f} | peak {result['peak_mb']:>7.1f} MB",
+                  flush=True)
+    return results
+
+
+# الحقول اللي نقارنها: (الحقل، الأعلى أسوأ؟)
+COMPARED = (("p50_ms", True), ("p99_ms", True), ("build_ms", True), ("peak_mb", True), ("qps", False))
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Regression messages for results worse than baseline by more than `tolerance`."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for field, higher_is_worse in COMPARED:
+            old, new = base.get(field), result.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append(f"{key} {field}: {old} -> {new} ({change:+.0%})")
+        if result["hit_at_1"] < base.get("hit_at_1", 0) - 0.01:
+            regressions.append(f"{key} hit_at_1: {base['hit_at_1']} -> {result['hit_at_1']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Matching engine benchmarks")
+    parser.add_argument("--sizes", default="1000,10000", help="comma-separated catalog sizes")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"comma-separated subset of {MODES}")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--vocabulary", type=int, default=5000, help="distinct keywords in the corpus")
+    parser.add_argument("--zipf", type=float, default=1.1, help="keyword frequency skew")
+    parser.add_argument("--typo-rate", type=float, default=0.1)
+    parser.add_argument("--miss-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    modes = [m for m in args.modes.split(",") if m]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    if args.vocabulary < min_vocabulary():
+        parser.error(f"--vocabulary must be at least {min_vocabulary()}")
+
+    results = run_benchmarks(sizes, modes, args.queries, args.vocabulary, args.zipf,
+                             args.typo_rate, args.miss_rate, args.seed)
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "save_baseline")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.setdefault("results", {}).update(results)
+        baseline.update({k: v for k, v in report.items() if k != "results"})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline} (run with --save-baseline to create one)")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) vs {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\n✅ No regressions vs {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks/corpus.py
+Synthetic Arabic case catalogs and query workloads.
+
+Keywords are drawn from a vocabulary of real support terms followed by a
+long tail of generated words, with Zipf-distributed frequencies (the
+`zipf` exponent controls how much a few terms dominate, which drives the
+length of the hottest postings lists). Queries are built from a target
+case's keywords plus filler words, with optional spelling noise (hamza /
+taa marbuta / alef maqsura variants and letter swaps) and a share of
+queries that match nothing.
+
+Everything is deterministic for a given seed.
+"""
+
+import random
+from bisect import bisect
+from itertools import accumulate
+from typing import List, Optional, Tuple
+
+# مفردات دعم حقيقية (الأعلى تكراراً في الكتالوج)
+VOCABULARY = [
+    "تفعيل", "حساب", "شركة", "مشكلة", "معلق", "تأشيرة", "عمرة", "حج", "وكيل", "خارجي",
+    "تسجيل", "دخول", "كلمة", "مرور", "دفع", "فاتورة", "سداد", "استرداد", "مبلغ", "حجز",
+    "فندق", "نقل", "رحلة", "طيران", "مجموعة", "معتمر", "حاج", "جواز", "سفر", "بيانات",
+    "تحديث", "تعديل", "إلغاء", "طلب", "حالة", "رفض", "موافقة", "انتظار", "مستند", "رفع",
+    "عقد", "ترخيص", "تجديد", "انتهاء", "صلاحية", "مستخدم", "صلاحيات", "بوابة", "منصة", "نظام",
+    "خطأ", "رسالة", "تنبيه", "بريد", "إلكتروني", "جوال", "رمز", "تحقق", "مزود", "خدمة",
+    "باقة", "سعر", "خصم", "ضريبة", "إيصال", "تقرير", "كشف", "حساب بنكي", "تحويل", "بنك",
+    "محفظة", "رصيد", "شحن", "تأخير", "موعد", "وصول", "مغادرة", "مطار", "منفذ", "تصريح",
+]
+
+FILLER = ["عندي", "في", "ما", "يشتغل", "كيف", "ابغى", "ليش", "عند", "العميل", "لو", "سمحت", "مو", "راضي"]
+
+CATEGORIES = [
+    "تفعيل الحساب", "المدفوعات", "التأشيرات", "الحجوزات", "إدارة الحسابات",
+    "النقل", "التقارير", "الصلاحيات", "المستندات", "الدعم التقني",
+]
+SUBCATEGORIES = ["مشاكل تقنية", "استفسارات عامة", "إعدادات", "أخطاء النظام", "طلبات"]
+
+_LETTERS = "ابتثجحخدذرزسشصضطظعغفقكلمنهوي"
+
+# صيغ إملائية شائعة (نفس اللي يوحّدها text_normalizer)
+_VARIANTS = {"ا": "أإآ", "ة": "ه", "ي": "ى", "ه": "ة"}
+
+
+def _zipf_cdf(n: int, s: float) -> List[float]:
+    return list(accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def _pick(rng: random.Random, cdf: List[float]) -> int:
+    return bisect(cdf, rng.random() * cdf[-1])
+
+
+def build_vocabulary(size: int, seed: int = 0) -> List[str]:
+    """VOCABULARY followed by generated words, `size` words in total."""
+    rng = random.Random(seed)
+    words = VOCABULARY[:size]
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choice(_LETTERS) for _ in range(rng.randint(3, 7)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+# Distinct words in a case's ResponseText filler
+RESPONSE_WORDS = 12
+
+
+def min_vocabulary(main_keywords: Tuple[int, int] = (2, 5), extra_keywords: Tuple[int, int] = (0, 4)) -> int:
+    """Smallest vocabulary generate_cases() can draw distinct words from."""
+    # أكبر سحب: الرد، أو كلمة سلبية مستثناة منها الرئيسية والإضافية
+    return max(RESPONSE_WORDS, main_keywords[1] + extra_keywords[1] + 1)
+
+
+def generate_cases(
+    count: int,
+    vocabulary_size: int = 5000,
+    main_keywords: Tuple[int, int] = (2, 5),
+    extra_keywords: Tuple[int, int] = (0, 4),
+    zipf: float = 1.1,
+    negative_rate: float = 0.1,
+    synonym_rate: float = 0.2,
+    user_type: str = "شركة عمرة",
+    seed: int = 0,
+) -> List[dict]:
+    """Synthetic cases in the catalog schema (MainKeywords, ExtraKeywords, ...)."""
+    needed = min_vocabulary(main_keywords, extra_keywords)
+    if vocabulary_size < needed:
+        raise ValueError(f"vocabulary_size must be at least {needed}, got {vocabulary_size}")
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary(vocabulary_size, seed)
+    cdf = _zipf_cdf(len(vocabulary), zipf)
+
+    def sample(k: int, exclude=()) -> List[str]:
+        chosen = []
+        while len(chosen) < k:
+            word = vocabulary[_pick(rng, cdf)]
+            if word not in chosen and word not in exclude:
+                chosen.append(word)
+        return chosen
+
+    cases = []
+    for i in range(count):
+        main = sample(rng.randint(*main_keywords))
+        extra = sample(rng.randint(*extra_keywords), exclude=main)
+        negative = sample(1, exclude=main + extra) if rng.random() < negative_rate else []
+        synonyms = [f"{main[0]}={sample(1, exclude=main)[0]}"] if rng.random() < synonym_rate else []
+        cases.append({
+            "CaseID": f"BENCH-{i:06d}",
+            "UserType": user_type,
+            "Category": rng.choice(CATEGORIES),
+            "SubCategory": rng.choice(SUBCATEGORIES),
+            "Priorty": rng.choice(["عالي", "متوسط", "منخفض"]),
+            "MainKeywords": main,
+            "ExtraKeywords": extra,
+            "NegativeKeywords": negative,
+            "Synonyms": synonyms,
+            "ResponseText": "لحل مشكلة " + " ".join(main + extra) + ": " + " ".join(sample(RESPONSE_WORDS)),
+            "FallbackText": "تواصل مع الدعم التقني.",
+            "Why": "تطابق الكلمات الرئيسية: " + "، ".join(main),
+        })
+    return cases
+
+
+def _misspell(rng: random.Random, word: str) -> str:
+    if len(word) < 3:
+        return word
+    i = rng.randrange(len(word))
+    letter = word[i]
+    if letter in _VARIANTS and rng.random() < 0.6:
+        return word[:i] + rng.choice(_VARIANTS[letter]) + word[i + 1:]
+    if rng.random() < 0.5 and i < len(word) - 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + rng.choice(_LETTERS) + word[i + 1:]
+
+
+def generate_queries(
+    cases: List[dict],
+    count: int,
+    keywords_per_query: Tuple[int, int] = (1, 3),
+    typo_rate: float = 0.1,
+    miss_rate: float = 0.1,
+    case_zipf: Optional[float] = 1.0,
+    seed: int = 1,
+) -> List[Tuple[str, Optional[str]]]:
+    """
+    (query, expected CaseID) pairs. Target cases are Zipf-distributed by
+    popularity (case_zipf=None for uniform); expected is None for the
+    miss_rate share of queries built from filler words only.
+    """
+    rng = random.Random(seed)
+    cdf = _zipf_cdf(len(cases), case_zipf) if case_zipf else None
+    order = list(range(len(cases)))
+    rng.shuffle(order)
+
+    queries = []
+    for _ in range(count):
+        if rng.random() < miss_rate:
+            words = rng.sample(FILLER, rng.randint(2, 4))
+            queries.append((" ".join(words), None))
+            continue
+        case = cases[order[_pick(rng, cdf)] if cdf else rng.randrange(len(cases))]
+        main = case["MainKeywords"]
+        words = rng.sample(main, min(len(main), rng.randint(*keywords_per_query)))
+        words = [_misspell(rng, w) if rng.random() < typo_rate else w for w in words]
+        words += rng.sample(FILLER, rng.randint(0, 3))
+        rng.shuffle(words)
+        queries.append((" ".join(words), case["CaseID"]))
+    return queries
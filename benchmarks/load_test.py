@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks/load_test.py
+Open-loop HTTP load test for /api/resolve, /api/chat and /api/analytics/*.
+
+Requests are scheduled at a fixed target rate and handed to a pool of
+client threads. Latency is measured from the scheduled send time, so a
+server that falls behind shows up as queueing delay instead of silently
+lowering the offered load. Chat traffic replays multi-turn
+conversations: each virtual user opens a session, sends a few messages
+and feedback replies with the returned session_id, then starts over.
+
+Against a running server:
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --rate 50 --duration 30
+
+Or start the app under gunicorn with the in-memory Mongo stand-in:
+    python -m benchmarks.load_test --spawn --workers 1 --threads 8 --rate 100 --duration 30
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import signal
+import argparse
+import threading
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import requests
+
+from .corpus import generate_cases, generate_queries
+
+ANALYTICS_PATHS = (
+    "/api/analytics/stats",
+    "/api/analytics/recent",
+    "/api/analytics/popular",
+    "/api/analytics/hourly",
+    "/api/analytics/trends",
+    "/api/analytics/latency",
+)
+USER_TYPES = ("شركة عمرة", "وكيل خارجي")
+FEEDBACK = ("نعم ساعدني", "لا", "أحتاج مزيد من المساعدة")
+
+
+class Stats:
+    """Per-endpoint latencies (ms) and error counts."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.service: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, latency_ms: float, service_ms: float, error: Optional[str]):
+        with self._lock:
+            self.latencies[endpoint].append(latency_ms)
+            self.service[endpoint].append(service_ms)
+            if error:
+                self.errors[endpoint][error] += 1
+
+    def report(self, elapsed_s: float) -> Dict[str, dict]:
+        def pct(values, q):
+            return round(values[min(len(values) - 1, int(q * len(values)))], 2) if values else 0.0
+
+        report = {}
+        for endpoint in sorted(self.latencies):
+            values = sorted(self.latencies[endpoint])
+            service = sorted(self.service[endpoint])
+            errors = sum(self.errors[endpoint].values())
+            report[endpoint] = {
+                "requests": len(values),
+                "rps": round(len(values) / elapsed_s, 2) if elapsed_s else 0.0,
+                "errors": errors,
+                "error_rate": round(errors / len(values), 4) if values else 0.0,
+                "error_kinds": dict(self.errors[endpoint]),
+                "p50_ms": pct(values, 0.50),
+                "p90_ms": pct(values, 0.90),
+                "p99_ms": pct(values, 0.99),
+                "max_ms": round(values[-1], 2) if values else 0.0,
+                # من لحظة الإرسال الفعلي (بدون انتظار الطابور)
+                "service_p50_ms": pct(service, 0.50),
+                "service_p99_ms": pct(service, 0.99),
+            }
+        return report
+
+
+class VirtualUser:
+    """One chat conversation at a time, reusing its session_id between turns."""
+
+    def __init__(self, rng: random.Random, messages: List[str]):
+        self.rng = rng
+        self.messages = messages
+        self.session_id = None
+        self.turns_left = 0
+        self.lock = threading.Lock()
+
+    def next_payload(self) -> dict:
+        if self.session_id is None or self.turns_left <= 0:
+            self.session_id = None
+            self.turns_left = self.rng.randint(2, 6)
+            return {"is_first": True, "message": "", "user_type": self.rng.choice(USER_TYPES)}
+        self.turns_left -= 1
+        message = self.rng.choice(FEEDBACK) if self.rng.random() < 0.25 else self.rng.choice(self.messages)
+        return {"message": message, "session_id": self.session_id, "user_type": self.rng.choice(USER_TYPES)}
+
+
+class LoadTest:
+    def __init__(self, base_url: str, rate: float, duration: float, concurrency: int, mix: Dict[str, float],
+                 queries: List[str], chat_users: int, timeout: float, seed: int):
+        self.base_url = base_url.rstrip("/")
+        self.rate = rate
+        self.duration = duration
+        self.concurrency = concurrency
+        self.mix = mix
+        self.queries = queries
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.users = [VirtualUser(random.Random(seed + i), queries) for i in range(chat_users)]
+        self.stats = Stats()
+        self.tasks: "queue.Queue" = queue.Queue(maxsize=concurrency * 100)
+        self.dropped = 0
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _pick(self) -> str:
+        r = self.rng.random() * sum(self.mix.values())
+        for kind, weight in self.mix.items():
+            r -= weight
+            if r <= 0:
+                return kind
+        return kind
+
+    def _send(self, method: str, path: str, **kwargs):
+        response = self._session().request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        error = None if response.status_code < 400 else f"HTTP {response.status_code}"
+        return response, error
+
+    def _do(self, kind: str, scheduled: float):
+        started = time.perf_counter()
+        endpoint, error = kind, None
+        try:
+            if kind == "resolve":
+                endpoint = "/api/resolve"
+                payload = {
+                    "user_type": self.rng.choice(USER_TYPES),
+                    "issue": self.rng.choice(self.queries),
+                    "get_alternatives": self.rng.random() < 0.3,
+                }
+                _, error = self._send("POST", endpoint, json=payload)
+            elif kind == "chat":
+                endpoint = "/api/chat"
+                user = self.rng.choice(self.users)
+                # نفس المستخدم ما يرسل رسالتين بنفس الوقت (مثل المتصفح)
+                with user.lock:
+                    response, error = self._send("POST", endpoint, json=user.next_payload())
+                    if error is None:
+                        user.session_id = response.json().get("session_id") or user.session_id
+            else:
+                endpoint = self.rng.choice(ANALYTICS_PATHS)
+                _, error = self._send("GET", endpoint)
+        except requests.RequestException as e:
+            error = type(e).__name__
+        except ValueError:
+            error = "invalid JSON"
+        finished = time.perf_counter()
+        self.stats.record(endpoint, (finished - scheduled) * 1000, (finished - started) * 1000, error)
+
+    def _worker(self):
+        while True:
+            item = self.tasks.get()
+            if item is None:
+                return
+            kind, scheduled = item
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._do(kind, scheduled)
+
+    def run(self) -> dict:
+        workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.concurrency)]
+        for w in workers:
+            w.start()
+
+        interval = 1.0 / self.rate
+        start = time.perf_counter()
+        total = int(self.rate * self.duration)
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter() - 0.05
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.tasks.put_nowait((self._pick(), scheduled))
+            except queue.Full:
+                # العملاء متأخرين كثير: نسجلها بدل ما نخفف الحمل بصمت
+                self.dropped += 1
+        for _ in workers:
+            self.tasks.put(None)
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+
+        endpoints = self.stats.report(elapsed)
+        sent = sum(e["requests"] for e in endpoints.values())
+        errors = sum(e["errors"] for e in endpoints.values())
+        return {
+            "target_rps": self.rate,
+            "achieved_rps": round(sent / elapsed, 2) if elapsed else 0.0,
+            "duration_s": round(elapsed, 2),
+            "requests": sent,
+            "errors": errors,
+            "error_rate": round(errors / sent, 4) if sent else 0.0,
+            "dropped": self.dropped,
+            "endpoints": endpoints,
+        }
+
+
+def spawn_server(host: str, port: int, workers: int, threads: int, cases: int, seed: int) -> subprocess.Popen:
+    env = dict(os.environ, CALLHELPER_BENCH_CASES=str(cases), CALLHELPER_BENCH_SEED=str(seed))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+         "-b", f"{host}:{port}", "--log-level", "warning", "benchmarks.memory_app:app"],
+        cwd=root, env=env,
+    )
+    url = f"http://{host}:{port}/"
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            requests.get(url + "api/analytics/hourly", timeout=2)
+            return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start within 120s")
+
+
+def print_report(result: dict):
+    print(f"\nTarget {result['target_rps']} rps, achieved {result['achieved_rps']} rps over "
+          f"{result['duration_s']} s — {result['requests']} requests, {result['errors']} errors "
+          f"({result['error_rate']:.2%}), {result['dropped']} dropped by the client")
+    print(f"{'endpoint':<26}{'reqs':>7}{'rps':>8}{'err%':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'svc p99':>9}")
+    for endpoint, e in result["endpoints"].items():
+        print(f"{endpoint:<26}{e['requests']:>7}{e['rps']:>8.1f}{e['error_rate'] * 100:>6.1f}%"
+              f"{e['p50_ms']:>9.1f}{e['p90_ms']:>9.1f}{e['p99_ms']:>9.1f}{e['max_ms']:>9.1f}{e['service_p99_ms']:>9.1f}")
+    print("(latencies in ms from the scheduled send time; 'svc' excludes client-side queueing)")
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in ("resolve", "chat", "analytics"):
+            raise argparse.ArgumentTypeError(f"unknown traffic kind: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP load test for CallHelper")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running server")
+    target.add_argument("--spawn", action="store_true", help="start gunicorn with the in-memory Mongo stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers (--spawn)")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker (--spawn)")
+    parser.add_argument("--cases", type=int, default=2000, help="catalog size (--spawn)")
+    parser.add_argument("--rate", type=float, default=50, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=32, help="client threads")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("resolve=6,chat=3,analytics=1"))
+    parser.add_argument("--chat-users", type=int, default=50, help="concurrent chat conversations")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the report JSON here")
+    args = parser.parse_args(argv)
+
+    # نفس الكتالوج اللي يولده memory_app، فالاستعلامات لها حلول فعلاً
+    cases = generate_cases(args.cases, seed=args.seed)
+    queries = [q for q, _ in generate_queries(cases, 2000, seed=args.seed + 1)]
+
+    server = None
+    base_url = args.url
+    if args.spawn:
+        server = spawn_server(args.host, args.port, args.workers, args.threads, args.cases, args.seed)
+        base_url = f"http://{args.host}:{args.port}"
+    try:
+        test = LoadTest(base_url, args.rate, args.duration, args.concurrency, args.mix, queries,
+                        args.chat_users, args.timeout, args.seed)
+        result = test.run()
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
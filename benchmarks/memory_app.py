@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks/memory_app.py
+The Flask app backed by the in-memory Mongo stand-in, for load tests.
+
+    gunicorn -w 1 --threads 8 -b 127.0.0.1:5055 benchmarks.memory_app:app
+    uvicorn --workers 1 --port 5055 benchmarks.memory_app:asgi_app
+
+The catalog is generated with benchmarks/corpus.py at import time
+(CALLHELPER_BENCH_CASES cases, CALLHELPER_BENCH_SEED). The store lives in
+the worker process, so with several gunicorn workers each worker gets an
+identical catalog but its own interaction logs; analytics responses then
+only reflect the worker that served them.
+"""
+
+import os
+
+from .memory_mongo import install
+
+install()
+# ما فيه فهارس نبنيها على الذاكرة
+os.environ.setdefault("CALLHELPER_ENSURE_INDEXES", "0")
+# motor ما يشوف المخزن اللي في الذاكرة
+os.environ.setdefault("CALLHELPER_ASYNC_MONGO", "0")
+
+from agent.mongo_helper import get_collection, bump_catalog_version  # noqa: E402
+from .corpus import generate_cases  # noqa: E402
+
+BENCH_CASES = int(os.getenv("CALLHELPER_BENCH_CASES", "2000"))
+BENCH_SEED = int(os.getenv("CALLHELPER_BENCH_SEED", "42"))
+
+
+def seed_catalog(count: int = BENCH_CASES, seed: int = BENCH_SEED):
+    collection = get_collection()
+    collection.delete_many({})
+    collection.insert_many(generate_cases(count, seed=seed))
+    bump_catalog_version(collection)
+
+
+seed_catalog()
+
+from app import app  # noqa: E402,F401
+from asgi import app as asgi_app  # noqa: E402,F401
@@ -0,0 +1,651 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks/memory_mongo.py
+In-memory stand-in for the subset of pymongo that CallHelper uses.
+
+Enough of MongoClient / Database / Collection / Cursor is implemented for
+the agents, mongo_helper, analytics_helper and the heavy-hitter tracker
+to run unchanged: filters with the common comparison operators, simple
+projections, sort/skip/limit, update operators ($set, $inc, $push,
+$setOnInsert, $unset) with upserts, bulk_write, and aggregation
+pipelines built from $match, $group, $sort, $limit, $skip, $project,
+$unwind and $replaceRoot.
+
+install() swaps pymongo.MongoClient for MemoryClient. It must run before
+any `agent` module is imported, since they create their clients at import.
+Every MemoryClient in the process shares one store, like several clients
+pointed at the same server.
+"""
+
+import re
+import copy
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+_MISSING = object()
+
+
+# ---- document helpers ----
+
+def _get(doc: Any, path: str, default=_MISSING):
+    for part in path.split("."):
+        if isinstance(doc, dict) and part in doc:
+            doc = doc[part]
+        elif isinstance(doc, list) and part.isdigit() and int(part) < len(doc):
+            doc = doc[int(part)]
+        else:
+            return default
+    return doc
+
+
+def _set(doc: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset(doc: dict, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _sort_key(value):
+    # ترتيب أنواع BSON التقريبي: None < أرقام < نصوص < كائنات < تواريخ
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (5, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (6, value)
+    return (3, str(value))
+
+
+def _compare(op: str, value, target) -> bool:
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == "$gt":
+            return value > target
+        if op == "$gte":
+            return value >= target
+        if op == "$lt":
+            return value < target
+        return value <= target
+    except TypeError:
+        return False
+
+
+def _equals(value, target) -> bool:
+    if value is _MISSING:
+        return target is None
+    if isinstance(value, list) and not isinstance(target, list):
+        return target in value
+    return value == target
+
+
+def _match_condition(value, condition) -> bool:
+    if not (isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)):
+        return _equals(value, condition)
+    for op, target in condition.items():
+        if op == "$eq":
+            ok = _equals(value, target)
+        elif op == "$ne":
+            ok = not _equals(value, target)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            values = value if isinstance(value, list) else [value]
+            ok = any(_compare(op, v, target) for v in values)
+        elif op == "$in":
+            ok = any(_equals(value, t) for t in target)
+        elif op == "$nin":
+            ok = not any(_equals(value, t) for t in target)
+        elif op == "$exists":
+            ok = (value is not _MISSING) == bool(target)
+        elif op == "$regex":
+            flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+            values = value if isinstance(value, list) else [value]
+            ok = any(isinstance(v, str) and re.search(target, v, flags) for v in values)
+        elif op == "$options":
+            ok = True
+        elif op == "$type":
+            ok = target == "number" and isinstance(value, (int, float)) and not isinstance(value, bool)
+        else:
+            raise NotImplementedError(f"Query operator {op} is not supported by the stand-in")
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif not _match_condition(_get(doc, key), condition):
+            return False
+    return True
+
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return dict(doc)
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    if include:
+        out = {}
+        for key in include:
+            value = _get(doc, key)
+            if value is not _MISSING:
+                _set(out, key, value)
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    out = dict(doc)
+    for key, value in projection.items():
+        if not value:
+            _unset(out, key)
+    return out
+
+
+def _apply_update(doc: dict, update: dict, inserting: bool = False):
+    for op, fields in update.items():
+        if op == "$set":
+            for key, value in fields.items():
+                _set(doc, key, copy.deepcopy(value))
+        elif op == "$setOnInsert":
+            if inserting:
+                for key, value in fields.items():
+                    _set(doc, key, copy.deepcopy(value))
+        elif op == "$inc":
+            for key, value in fields.items():
+                current = _get(doc, key, 0)
+                _set(doc, key, current + value)
+        elif op == "$push":
+            for key, value in fields.items():
+                current = _get(doc, key, None)
+                if current is None:
+                    current = []
+                    _set(doc, key, current)
+                current.append(copy.deepcopy(value))
+        elif op == "$unset":
+            for key in fields:
+                _unset(doc, key)
+        elif op in ("$max", "$min"):
+            for key, value in fields.items():
+                current = _get(doc, key, None)
+                if current is None or (value > current if op == "$max" else value < current):
+                    _set(doc, key, copy.deepcopy(value))
+        else:
+            raise NotImplementedError(f"Update operator {op} is not supported by the stand-in")
+
+
+def _upsert_seed(query: dict) -> dict:
+    """New document for an upsert: the equality parts of the filter."""
+    doc = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                _set(doc, key, condition["$eq"])
+            continue
+        _set(doc, key, copy.deepcopy(condition))
+    return doc
+
+
+# ---- aggregation ----
+
+def _expr(doc: dict, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get(doc, expr[1:])
+        return None if value is _MISSING else value
+    if isinstance(expr, list):
+        return [_expr(doc, e) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) == 1:
+        op, args = next(iter(expr.items()))
+        if op.startswith("$"):
+            return _operator(doc, op, args)
+    return {k: _expr(doc, v) for k, v in expr.items()}
+
+
+def _operator(doc: dict, op: str, args):
+    if op == "$cond":
+        if isinstance(args, dict):
+            args = [args["if"], args["then"], args["else"]]
+        return _expr(doc, args[1]) if _expr(doc, args[0]) else _expr(doc, args[2])
+    values = [_expr(doc, a) for a in (args if isinstance(args, list) else [args])]
+    if op == "$ifNull":
+        return next((v for v in values if v is not None), None)
+    if op == "$eq":
+        return values[0] == values[1]
+    if op == "$ne":
+        return values[0] != values[1]
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        return _compare(op, values[0], values[1])
+    if op == "$and":
+        return all(values)
+    if op == "$or":
+        return any(values)
+    if op == "$not":
+        return not values[0]
+    if op == "$add":
+        return sum(v or 0 for v in values)
+    if op == "$divide":
+        return values[0] / values[1] if values[1] else None
+    if op == "$multiply":
+        result = 1
+        for v in values:
+            result *= v or 0
+        return result
+    if op == "$toString":
+        return None if values[0] is None else str(values[0])
+    if op == "$size":
+        return len(values[0] or [])
+    raise NotImplementedError(f"Expression operator {op} is not supported by the stand-in")
+
+
+def _group(docs: Iterable[dict], spec: dict) -> List[dict]:
+    groups: Dict[Any, dict] = {}
+    id_expr = spec["_id"]
+    accumulators = {k: v for k, v in spec.items() if k != "_id"}
+    for doc in docs:
+        key = _expr(doc, id_expr)
+        hashable = repr(key)
+        group = groups.get(hashable)
+        if group is None:
+            group = groups[hashable] = {"_id": key, **{name: _MISSING for name in accumulators}, "__n": {}}
+        for name, acc in accumulators.items():
+            op, arg = next(iter(acc.items()))
+            value = _expr(doc, arg)
+            current = group[name]
+            if op == "$sum":
+                group[name] = (0 if current is _MISSING else current) + (value if isinstance(value, (int, float)) else 0)
+            elif op == "$avg":
+                if isinstance(value, (int, float)):
+                    total, n = group["__n"].get(name, (0, 0))
+                    group["__n"][name] = (total + value, n + 1)
+            elif op == "$first":
+                if current is _MISSING:
+                    group[name] = value
+            elif op == "$last":
+                group[name] = value
+            elif op == "$max":
+                if value is not None and (current is _MISSING or current is None or value > current):
+                    group[name] = value
+            elif op == "$min":
+                if value is not None and (current is _MISSING or current is None or value < current):
+                    group[name] = value
+            elif op == "$push":
+                group[name] = ([] if current is _MISSING else current) + [value]
+            else:
+                raise NotImplementedError(f"Accumulator {op} is not supported by the stand-in")
+    result = []
+    for group in groups.values():
+        averages = group.pop("__n")
+        for name, acc in accumulators.items():
+            if "$avg" in acc:
+                total, n = averages.get(name, (0, 0))
+                group[name] = total / n if n else None
+            elif group[name] is _MISSING:
+                group[name] = None
+        result.append(group)
+    return result
+
+
+def _sort_docs(docs: List[dict], spec) -> List[dict]:
+    items = spec.items() if isinstance(spec, dict) else spec
+    for key, direction in reversed(list(items)):
+        docs.sort(key=lambda d: _sort_key(_get(d, key)), reverse=direction < 0)
+    return docs
+
+
+def _project_stage(doc: dict, spec: dict) -> dict:
+    computed = {k: v for k, v in spec.items() if not (v in (0, 1, True, False) and not isinstance(v, str))}
+    flags = {k: v for k, v in spec.items() if k not in computed}
+    if any(flags.get(k) for k in flags if k != "_id") or computed:
+        out = {}
+        if flags.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        for key, value in flags.items():
+            if value and key != "_id":
+                v = _get(doc, key)
+                if v is not _MISSING:
+                    _set(out, key, v)
+        for key, expr in computed.items():
+            _set(out, key, _expr(doc, expr))
+        return out
+    return _project(doc, spec)
+
+
+def run_pipeline(docs: List[dict], pipeline: List[dict]) -> List[dict]:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [d for d in docs if matches(d, spec)]
+        elif name == "$group":
+            docs = _group(docs, spec)
+        elif name == "$sort":
+            docs = _sort_docs(list(docs), spec)
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$project":
+            docs = [_project_stage(d, spec) for d in docs]
+        elif name == "$unwind":
+            path = spec if isinstance(spec, str) else spec["path"]
+            field = path[1:]
+            unwound = []
+            for d in docs:
+                for item in _get(d, field, None) or []:
+                    copy_ = dict(d)
+                    _set(copy_, field, item)
+                    unwound.append(copy_)
+            docs = unwound
+        elif name == "$replaceRoot":
+            docs = [_expr(d, spec["newRoot"]) for d in docs]
+        elif name == "$count":
+            docs = [{spec: len(docs)}]
+        else:
+            raise NotImplementedError(f"Pipeline stage {name} is not supported by the stand-in")
+    return docs
+
+
+# ---- pymongo-like API ----
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+        self.acknowledged = True
+
+
+class Cursor:
+    def __init__(self, docs: List[dict], projection: Optional[dict]):
+        self._docs = docs
+        self._projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction: int = 1):
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def skip(self, n: int):
+        self._skip = n
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def _materialize(self) -> List[dict]:
+        docs = self._docs
+        if self._sort:
+            docs = _sort_docs(list(docs), self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [_project(d, self._projection) for d in docs]
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: List[dict] = []
+        self._lock = threading.RLock()
+        self._indexes: Dict[str, dict] = {}
+
+    # reads
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs):
+        with self._lock:
+            docs = [d for d in self._docs if matches(d, filter)]
+        cursor = Cursor(docs, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs):
+        for doc in self.find(filter, projection, **kwargs).limit(1):
+            return doc
+        return None
+
+    def count_documents(self, filter: dict, **kwargs) -> int:
+        with self._lock:
+            return sum(1 for d in self._docs if matches(d, filter))
+
+    def estimated_document_count(self, **kwargs) -> int:
+        return len(self._docs)
+
+    def distinct(self, key: str, filter: Optional[dict] = None) -> list:
+        seen = []
+        with self._lock:
+            for d in self._docs:
+                if matches(d, filter):
+                    value = _get(d, key)
+                    for v in (value if isinstance(value, list) else [value]):
+                        if v is not _MISSING and v not in seen:
+                            seen.append(v)
+        return seen
+
+    def aggregate(self, pipeline: List[dict], **kwargs):
+        with self._lock:
+            docs = [dict(d) for d in self._docs]
+        return iter(run_pipeline(docs, pipeline))
+
+    # writes
+
+    def insert_one(self, document: dict, **kwargs):
+        document.setdefault("_id", ObjectId())
+        with self._lock:
+            self._docs.append(copy.deepcopy(document))
+        return _Result(inserted_id=document["_id"])
+
+    def insert_many(self, documents: Iterable[dict], ordered: bool = True, **kwargs):
+        ids = []
+        with self._lock:
+            for document in documents:
+                document.setdefault("_id", ObjectId())
+                self._docs.append(copy.deepcopy(document))
+                ids.append(document["_id"])
+        return _Result(inserted_ids=ids)
+
+    def _update(self, filter: dict, update: dict, upsert: bool, many: bool):
+        matched = modified = 0
+        upserted_id = None
+        with self._lock:
+            for doc in self._docs:
+                if matches(doc, filter):
+                    _apply_update(doc, update)
+                    matched += 1
+                    modified += 1
+                    if not many:
+                        break
+            if not matched and upsert:
+                doc = _upsert_seed(filter)
+                _apply_update(doc, update, inserting=True)
+                doc.setdefault("_id", ObjectId())
+                self._docs.append(doc)
+                upserted_id = doc["_id"]
+        return _Result(matched_count=matched, modified_count=modified, upserted_id=upserted_id)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs):
+        return self._update(filter, update, upsert, many=False)
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs):
+        return self._update(filter, update, upsert, many=True)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs):
+        with self._lock:
+            for i, doc in enumerate(self._docs):
+                if matches(doc, filter):
+                    new = copy.deepcopy(replacement)
+                    new["_id"] = doc["_id"]
+                    self._docs[i] = new
+                    return _Result(matched_count=1, modified_count=1, upserted_id=None)
+            if upsert:
+                new = copy.deepcopy(replacement)
+                new.setdefault("_id", ObjectId())
+                self._docs.append(new)
+                return _Result(matched_count=0, modified_count=0, upserted_id=new["_id"])
+        return _Result(matched_count=0, modified_count=0, upserted_id=None)
+
+    def find_one_and_update(self, filter: dict, update: dict, projection=None, upsert: bool = False,
+                            return_document: bool = False, **kwargs):
+        with self._lock:
+            for doc in self._docs:
+                if matches(doc, filter):
+                    before = copy.deepcopy(doc)
+                    _apply_update(doc, update)
+                    return _project(doc if return_document else before, projection)
+            if upsert:
+                doc = _upsert_seed(filter)
+                _apply_update(doc, update, inserting=True)
+                doc.setdefault("_id", ObjectId())
+                self._docs.append(doc)
+                return _project(doc, projection) if return_document else None
+        return None
+
+    def _delete(self, filter: dict, many: bool):
+        deleted = 0
+        with self._lock:
+            kept = []
+            for doc in self._docs:
+                if (many or not deleted) and matches(doc, filter):
+                    deleted += 1
+                else:
+                    kept.append(doc)
+            self._docs = kept
+        return _Result(deleted_count=deleted)
+
+    def delete_one(self, filter: dict, **kwargs):
+        return self._delete(filter, many=False)
+
+    def delete_many(self, filter: dict, **kwargs):
+        return self._delete(filter, many=True)
+
+    def bulk_write(self, requests: list, ordered: bool = True, **kwargs):
+        upserted = matched = inserted = deleted = 0
+        for request in requests:
+            kind = type(request).__name__
+            if kind in ("UpdateOne", "UpdateMany"):
+                result = self._update(request._filter, request._doc, bool(request._upsert), kind == "UpdateMany")
+                matched += result.matched_count
+                upserted += result.upserted_id is not None
+            elif kind == "ReplaceOne":
+                result = self.replace_one(request._filter, request._doc, bool(request._upsert))
+                matched += result.matched_count
+                upserted += result.upserted_id is not None
+            elif kind == "InsertOne":
+                self.insert_one(request._doc)
+                inserted += 1
+            elif kind in ("DeleteOne", "DeleteMany"):
+                deleted += self._delete(request._filter, kind == "DeleteMany").deleted_count
+            else:
+                raise NotImplementedError(f"Bulk operation {kind} is not supported by the stand-in")
+        return _Result(inserted_count=inserted, matched_count=matched, modified_count=matched,
+                       deleted_count=deleted, upserted_count=upserted)
+
+    # admin
+
+    def create_index(self, keys, **kwargs) -> str:
+        name = kwargs.get("name") or "_".join(f"{k}_{d}" for k, d in keys)
+        self._indexes[name] = {"key": keys, **kwargs}
+        return name
+
+    def index_information(self) -> dict:
+        return dict(self._indexes)
+
+    def drop(self):
+        self.database.drop_collection(self.name)
+
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        with self._lock:
+            coll = self._collections.get(name)
+            if coll is None:
+                coll = self._collections[name] = MemoryCollection(self, name)
+            return coll
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def create_collection(self, name: str, **kwargs) -> MemoryCollection:
+        return self[name]
+
+    def drop_collection(self, name: str):
+        with self._lock:
+            self._collections.pop(name, None)
+
+    def list_collection_names(self) -> List[str]:
+        return list(self._collections)
+
+
+_store: Dict[str, MemoryDatabase] = {}
+_store_lock = threading.Lock()
+
+
+class MemoryClient:
+    """Drop-in for pymongo.MongoClient (all instances share one store)."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        with _store_lock:
+            db = _store.get(name)
+            if db is None:
+                db = _store[name] = MemoryDatabase(self, name)
+            return db
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        return self[name]
+
+    def server_info(self) -> dict:
+        return {"version": "7.0.0"}
+
+    def close(self):
+        pass
+
+
+def install():
+    """Make pymongo.MongoClient the in-memory client (call before importing `agent`)."""
+    import pymongo
+    pymongo.MongoClient = MemoryClient
+
+
+def reset():
+    """Drop every in-memory database."""
+    with _store_lock:
+        _store.clear()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks/replay.py
+Replay recorded /api/resolve traffic through the current matcher.
+
+Events come from MongoDB (whatever CALLHELPER_LOG_STORAGE mode is in use)
+or from exported JSON lines files, including the gzip archives written by
+agent/log_archive.py. They are streamed in chunks to a pool of worker
+processes, each resolving queries the way /api/resolve does (best
+keyword match, then the semantic fallback). Only a bounded number of
+chunks is in flight, so arbitrarily large logs replay in constant memory.
+
+The report shows throughput, per-query matcher latency, and how many
+queries now resolve differently from what was logged: a different case,
+newly matched or no longer matched. --diff writes every changed query as
+JSON lines for review.
+
+    python -m benchmarks.replay --from-mongo --since 2025-01-01 --workers 4
+    python -m benchmarks.replay log_archive/interaction_logs-2025-01-*.jsonl.gz --catalog cases.jsonl
+
+--catalog serves the cases from a JSON / JSON lines file through the
+in-memory Mongo stand-in instead of the live collection, to evaluate a
+catalog change before it is deployed.
+"""
+
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import argparse
+import multiprocessing
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional
+
+# ---- event sources ----
+
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def iter_file_events(paths: Iterable[str]) -> Iterator[dict]:
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with _open(path) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+
+
+def iter_mongo_events(since: Optional[str], until: Optional[str]) -> Iterator[dict]:
+    from agent.log_archive import iter_events
+    yield from iter_events(since, until)
+
+
+def load_cases(path: str) -> List[dict]:
+    with _open(path) as f:
+        text = f.read()
+    text = text.strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def replayable(events: Iterable[dict], since: Optional[str], until: Optional[str]) -> Iterator[tuple]:
+    """(user_type, query, logged case id) for resolve events in the date range."""
+    for event in events:
+        if event.get("interaction_type", "resolve") != "resolve":
+            continue
+        date = event.get("date") or str(event.get("timestamp", ""))[:10]
+        if (since and date < since) or (until and date > until):
+            continue
+        query = event.get("query")
+        if not query or query == "unknown":
+            continue
+        yield event.get("user_type") or "", query, event.get("matched_case_id")
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ---- worker side ----
+
+_options = {}
+
+
+def _init_worker(catalog: Optional[str], ranking: Optional[str], semantic: bool):
+    if catalog:
+        from .memory_mongo import install
+        install()
+        from agent.mongo_helper import get_collection, bump_catalog_version
+        collection = get_collection()
+        collection.insert_many(load_cases(catalog))
+        bump_catalog_version(collection)
+    _options.update(ranking=ranking, semantic=semantic)
+
+
+def _resolve_chunk(chunk: List[tuple]) -> List[tuple]:
+    from Logic import get_agent_for_user
+
+    results = []
+    for user_type, query, old_case in chunk:
+        started = time.perf_counter_ns()
+        new_case, match_type = None, None
+        agent = get_agent_for_user(user_type)
+        if agent is not None:
+            row, _ = agent.find_best_row(query, ranking=_options["ranking"])
+            if row is None and _options["semantic"]:
+                row, _ = agent.find_semantic_row(query)
+            if row is not None:
+                new_case, match_type = row.get("CaseID"), row.get("MatchType", "keyword")
+        elapsed_ms = (time.perf_counter_ns() - started) / 1e6
+        results.append((user_type, query, old_case, new_case, match_type, elapsed_ms))
+    return results
+
+
+# ---- driver ----
+
+
+def replay(items: Iterable[tuple], workers: int, chunk_size: int, catalog: Optional[str],
+           ranking: Optional[str], semantic: bool, diff_path: Optional[str] = None) -> dict:
+    context = multiprocessing.get_context("spawn")
+    outcomes = Counter()
+    transitions = Counter()
+    latencies = []
+    diff = open(diff_path, "w", encoding="utf-8") if diff_path else None
+
+    def collect(results):
+        for user_type, query, old_case, new_case, match_type, elapsed_ms in results:
+            latencies.append(elapsed_ms)
+            if old_case == new_case:
+                outcomes["unchanged"] += 1
+                continue
+            kind = "newly_matched" if old_case is None else "unmatched" if new_case is None else "changed"
+            outcomes[kind] += 1
+            transitions[(old_case, new_case)] += 1
+            if diff:
+                diff.write(json.dumps({
+                    "user_type": user_type, "query": query, "kind": kind,
+                    "old_case": old_case, "new_case": new_case, "match_type": match_type,
+                }, ensure_ascii=False) + "\n")
+
+    started = time.perf_counter()
+    try:
+        with context.Pool(workers, initializer=_init_worker, initargs=(catalog, ranking, semantic)) as pool:
+            pending = []
+            for chunk in _chunks(items, chunk_size):
+                pending.append(pool.apply_async(_resolve_chunk, (chunk,)))
+                # عدد محدود من الدفعات في الطريق عشان الذاكرة ما تكبر مع حجم اللوق
+                while len(pending) >= workers * 4:
+                    collect(pending.pop(0).get())
+            for result in pending:
+                collect(result.get())
+    finally:
+        if diff:
+            diff.close()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = len(latencies)
+
+    def pct(q):
+        return round(latencies[min(total - 1, int(q * total))], 3) if total else 0.0
+
+    return {
+        "events": total,
+        "duration_s": round(elapsed, 2),
+        "throughput_qps": round(total / elapsed, 1) if elapsed else 0.0,
+        "workers": workers,
+        "latency_ms": {"p50": pct(0.5), "p90": pct(0.9), "p99": pct(0.99), "max": pct(1.0)},
+        "outcomes": {k: outcomes.get(k, 0) for k in ("unchanged", "changed", "newly_matched", "unmatched")},
+        "changed_share": round((total - outcomes["unchanged"]) / total, 4) if total else 0.0,
+        "top_transitions": [
+            {"old_case": old, "new_case": new, "count": n} for (old, new), n in transitions.most_common(20)
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay logged resolve queries through the current matcher")
+    parser.add_argument("files", nargs="*", help="exported JSON lines logs (.jsonl / .jsonl.gz, globs allowed)")
+    parser.add_argument("--from-mongo", action="store_true", help="read raw events from MongoDB")
+    parser.add_argument("--since", help="first date to replay (YYYY-MM-DD)")
+    parser.add_argument("--until", help="last date to replay (YYYY-MM-DD)")
+    parser.add_argument("--limit", type=int, help="stop after N events")
+    parser.add_argument("--catalog", help="cases file (JSON / JSON lines) to match against instead of MongoDB")
+    parser.add_argument("--ranking", choices=("keywords", "bm25"), help="ranking mode (default: CALLHELPER_RANKING)")
+    parser.add_argument("--no-semantic", action="store_true", help="disable the semantic fallback")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--diff", help="write changed queries here (JSON lines)")
+    parser.add_argument("--output", help="write the report JSON here")
+    args = parser.parse_args(argv)
+
+    if bool(args.files) == args.from_mongo:
+        parser.error("give either log files or --from-mongo")
+
+    events = iter_mongo_events(args.since, args.until) if args.from_mongo else iter_file_events(args.files)
+    items = replayable(events, args.since, args.until)
+    if args.limit:
+        items = (item for i, item in zip(range(args.limit), items))
+
+    report = replay(items, args.workers, args.chunk_size, args.catalog, args.ranking,
+                    not args.no_semantic, args.diff)
+
+    print(f"Replayed {report['events']} queries in {report['duration_s']} s "
+          f"({report['throughput_qps']} q/s, {report['workers']} workers)")
+    lat = report["latency_ms"]
+    print(f"Matcher latency: p50 {lat['p50']} ms | p90 {lat['p90']} ms | p99 {lat['p99']} ms | max {lat['max']} ms")
+    out = report["outcomes"]
+    print(f"Unchanged {out['unchanged']} | changed {out['changed']} | newly matched {out['newly_matched']} | "
+          f"no longer matched {out['unmatched']} ({report['changed_share']:.2%} differ)")
+    for t in report["top_transitions"][:10]:
+        print(f"  {t['old_case']} -> {t['new_case']}: {t['count']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
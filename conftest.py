@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+conftest.py
+Under pytest, the root test scripts run against the in-memory Mongo
+stand-in (benchmarks/memory_mongo.py). Run a script with python to use
+the database at MONGO_URI instead (test_alternatives.py expects the seeded
+catalog from seed_database.py).
+"""
+
+import os
+
+from benchmarks.memory_mongo import install
+
+# قبل ما أي ملف اختبار يستورد agent
+install()
+os.environ.setdefault("CALLHELPER_ENSURE_INDEXES", "0")
+os.environ.setdefault("CALLHELPER_ASYNC_MONGO", "0")
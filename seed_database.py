@@ -4,7 +4,7 @@
 Seed the database with test cases for alternative solutions feature.
 """
 
-from agent.mongo_helper import get_collection
+from agent.mongo_helper import get_collection, bump_catalog_version
 from datetime import datetime, timezone
 
 def seed_database():
@@ -96,11 +96,12 @@ def seed_database():
         }
     ]
     
-    # Insert test cases
+    # Insert test cases (one round trip, one catalog version bump)
     print(f"\nInserting {len(test_cases)} test cases...")
+    collection.insert_many(test_cases)
     for case in test_cases:
-        result = collection.insert_one(case)
         print(f"✅ Inserted: {case['CaseID']} - {case['Category']}")
+    bump_catalog_version(collection)
     
     print(f"\n🎉 Database seeded successfully with {len(test_cases)} test cases!")
     print("\n" + "="*70)
@@ -7,6 +7,7 @@ export interface ResolveRequest {
   user_type: 'umrah' | 'external' | string;
   issue: string;
   get_alternatives?: boolean;  // Optional: request all alternatives
+  ranking?: 'keywords' | 'bm25';  // Optional: ranking mode (server default otherwise)
 }
 
 export interface ChatRequest {
@@ -39,6 +40,7 @@ export interface MatchResult {
   fallback: string | null;
   why: string | null;
   last_updated: string | null;
+  match_type?: 'keyword' | 'semantic';  // 'semantic' = fallback when no keyword matched
 }
 
 export interface ResolveResponse {
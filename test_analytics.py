@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test the analytics side: popular queries, latency and error statistics,
+interaction log storage, metrics and alerts.
+
+Runs against the in-memory Mongo stand-in (benchmarks/memory_mongo.py),
+so no MongoDB is needed:
+
+    python test_analytics.py
+"""
+
+import os
+import gzip
+import json
+import time
+import random
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+
+from benchmarks.memory_mongo import install, MemoryClient
+
+# لازم قبل ما نستورد agent
+install()
+os.environ.setdefault("CALLHELPER_ENSURE_INDEXES", "0")
+os.environ.setdefault("CALLHELPER_ASYNC_MONGO", "0")
+
+from pymongo.errors import BulkWriteError, OperationFailure  # noqa: E402
+
+from agent.heavy_hitters import SpaceSaving, HotQueryTracker  # noqa: E402
+from agent.alert_dispatcher import AlertDispatcher  # noqa: E402
+from agent.error_stats import ErrorStats  # noqa: E402
+from agent.latency_sketch import LatencySketch, RELATIVE_ACCURACY  # noqa: E402
+from agent import analytics_helper  # noqa: E402
+from agent.metrics import Registry, Counter, Gauge, Histogram  # noqa: E402
+from agent import log_archive, mongo_indexes  # noqa: E402
+
+
+def memory_db(name):
+    """A fresh in-memory database."""
+    db = MemoryClient()[name]
+    for collection in db.list_collection_names():
+        db.drop_collection(collection)
+    return db
+
+
+class FlakyCollection:
+    """Wraps a collection; bulk_write fails while `failing` is set ("all", or a set of op positions)."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+        self.database = collection.database
+        self.failing = None
+
+    def bulk_write(self, ops, ordered=True):
+        if self.failing == "all":
+            raise ConnectionError("server went away")
+        if self.failing:
+            for i, op in enumerate(ops):
+                if i not in self.failing:
+                    self.collection.bulk_write([op])
+            raise BulkWriteError({"writeErrors": [{"index": i} for i in sorted(self.failing)]})
+        return self.collection.bulk_write(ops, ordered=ordered)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def test_space_saving():
+    """Heavy hitters are kept with bounded memory and bounded overcount."""
+    rng = random.Random(7)
+    stream = ["عمرة"] * 300 + ["تفعيل"] * 200 + ["حجز"] * 100 + [f"q{rng.randrange(1000)}" for _ in range(1400)]
+    rng.shuffle(stream)
+    sketch = SpaceSaving(capacity=20)
+    for query in stream:
+        sketch.offer(query)
+
+    print("\n🔍 SpaceSaving top 3:", sketch.top(3))
+    assert len(sketch) == 20
+    assert [key for key, _ in sketch.top(3)] == ["عمرة", "تفعيل", "حجز"]
+    for key, count in sketch.top(3):
+        assert count - sketch.errors[key] <= stream.count(key) <= count
+
+    # دمج sketchين يجمع العدّادات
+    other = SpaceSaving(capacity=20)
+    for _ in range(50):
+        other.offer("حجز")
+    sketch.merge(other)
+    assert len(sketch) == 20 and sketch.counts["حجز"] >= 150
+
+
+def test_latency_sketch():
+    """Quantiles stay within the relative accuracy, and merged sketches equal one sketch."""
+    rng = random.Random(3)
+    values = [rng.lognormvariate(4, 1) for _ in range(5000)] + [0.0] * 10
+    whole, parts = LatencySketch(), [LatencySketch() for _ in range(4)]
+    for i, value in enumerate(values):
+        whole.add(value)
+        parts[i % 4].add(value)
+
+    merged = LatencySketch()
+    for part in parts:
+        merged.merge(part)
+    assert merged.bins == whole.bins and len(merged) == len(values)
+
+    exact = sorted(values)
+    for q in (0.5, 0.9, 0.99):
+        expected = exact[int(q * (len(exact) - 1))]
+        assert abs(whole.quantile(q) - expected) <= RELATIVE_ACCURACY * expected, q
+    assert whole.quantile(0) == 0.0
+    assert LatencySketch().quantile(0.5) is None
+    assert LatencySketch().quantiles() == {"p50": None, "p90": None, "p99": None}
+    print("\n🔍 Latency sketch:", whole.quantiles(), "bins:", len(whole.bins))
+
+    # من تجميعات الساعة: كل مجموعة sketch لحالها والمجموع يدمجها
+    analytics_helper.rollups_collection.delete_many({})
+    for ms in (10, 20, 30, 40):
+        analytics_helper.log_interaction("resolve", "شركة عمرة", "عمرة", True, response_time=ms)
+    analytics_helper.log_interaction("chat", "حج خارجي", "تصريح", False, response_time=1000)
+    analytics_helper.log_interaction("chat", "حج خارجي", "تصريح", False)
+    percentiles = analytics_helper.get_latency_percentiles(days=0)
+    print("🔍 Latency percentiles:", percentiles)
+    assert percentiles["overall"]["count"] == 5
+    assert abs(percentiles["overall"]["p50"] - 30) <= 30 * RELATIVE_ACCURACY
+    umrah, hajj = percentiles["groups"]
+    assert (umrah["user_type"], umrah["count"], hajj["count"]) == ("شركة عمرة", 4, 1)
+    assert abs(umrah["p50"] - 20) <= 20 * RELATIVE_ACCURACY
+    assert abs(hajj["p99"] - 1000) <= 1000 * RELATIVE_ACCURACY
+    assert analytics_helper.get_latency_percentiles(days=0, group_by=())["groups"][0]["count"] == 5
+
+
+def test_hot_query_flush_retry():
+    """A failed flush is retried; hourly and daily totals end up equal."""
+    db = memory_db("test_hot_queries")
+    hourly = FlakyCollection(db["hot_queries"])
+    daily = FlakyCollection(db["hot_queries_daily"])
+    tracker = HotQueryTracker(hourly, daily_collection=daily, snapshot_seconds=0)
+    at = datetime(2026, 10, 19, 9)
+
+    def totals(collection):
+        result = {}
+        for row in collection.find({}):
+            result[row["key"]] = result.get(row["key"], 0) + row["count"]
+        return result
+
+    for query in ["عمرة"] * 3 + ["عمره", "تفعيل", "حجز"]:
+        tracker.record(query, at=at)
+
+    print("\n🔍 Hot queries: hourly write fails")
+    hourly.failing = "all"
+    assert tracker.flush() == 0
+    assert tracker.pending_count() == 3 and totals(db["hot_queries"]) == {} == totals(db["hot_queries_daily"])
+
+    print("🔍 Hot queries: daily write fails")
+    hourly.failing = None
+    daily.failing = "all"
+    tracker.record("تفعيل", at=at)
+    assert tracker.flush() == 4
+    assert totals(db["hot_queries"]) == {"عمره": 4, "تفعيل": 2, "حجز": 1}
+    assert totals(db["hot_queries_daily"]) == {}
+
+    print("🔍 Hot queries: one hourly row fails")
+    daily.failing = None
+    tracker.record("حجز", at=at)
+    tracker.record("حجز", at=at)
+    hourly.failing = {0}
+    assert tracker.flush() == 0
+    hourly.failing = None
+    assert tracker.flush() == 1
+    print("  hourly:", totals(db["hot_queries"]), "daily:", totals(db["hot_queries_daily"]))
+    assert totals(db["hot_queries"]) == totals(db["hot_queries_daily"]) == {"عمره": 4, "تفعيل": 2, "حجز": 3}
+    assert tracker.pending_count() == 0
+
+    top = tracker.top(limit=2)
+    assert [row["count"] for row in top] == [4, 3] and top[0]["query"] == "عمرة"
+
+
+def test_error_stats():
+    """Daily error counts are built incrementally from the log and survive a restart."""
+    today = date.today()
+    yesterday = (today - timedelta(days=1)).isoformat()
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, "agent_logs.txt")
+        stats_file = os.path.join(tmp, "agent_error_stats.json")
+
+        def append(text):
+            with open(log_file, "a", encoding="utf-8") as f:
+                f.write(text)
+
+        append(f"[{yesterday} 23:59:59.000001] KeyError: 'x'\n" + "-" * 60 + "\n")
+        append(f"[{today} 08:00:00.000001] ValueError: bad\n[{today} 08:01:00.000001] ValueError: bad\n")
+        stats = ErrorStats(log_file, stats_file).refresh()
+        assert stats.count(yesterday, "KeyError") == 1 and stats.count(today.isoformat(), "ValueError") == 2
+
+        # سطر ناقص ما ينحسب لين يكتمل
+        append(f"[{today} 09:00:00.000001] Value")
+        assert stats.refresh().count(today.isoformat(), "ValueError") == 2
+        append("Error: bad\n")
+        assert stats.refresh().count(today.isoformat(), "ValueError") == 3
+
+        # عملية جديدة تكمل من نفس الموضع، ما تعد من الأول
+        restarted = ErrorStats(log_file, stats_file)
+        assert restarted.offset == os.path.getsize(log_file)
+        report = restarted.refresh().report(days=2)
+        print("\n🔍 Error report:", report)
+        assert report == [
+            {"date": yesterday, "error_type": "KeyError", "count": 1},
+            {"date": today.isoformat(), "error_type": "ValueError", "count": 3},
+        ]
+        assert restarted.report(days=1) == report[1:]
+
+        # تدوير اللوق: الملف صار أصغر → نبدأ من أوله
+        os.remove(log_file)
+        append(f"[{today} 10:00:00.000001] OSError: disk\n")
+        assert restarted.refresh().count(today.isoformat(), "OSError") == 1
+
+
+class RecordingTransport:
+    """Alert transport that records (thread name, subject); can hold the first send."""
+
+    def __init__(self, hold=False):
+        self.sent = []
+        self.sending = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def send(self, subject, body):
+        self.sending.set()
+        self.release.wait(5)
+        self.sent.append((threading.current_thread().name, subject.split(": ", 1)[1]))
+
+
+def test_alert_dispatch():
+    """Alerts are aggregated per error type and rate limited, also at shutdown."""
+    transport = RecordingTransport()
+    dispatcher = AlertDispatcher(transport, window_seconds=60, rate_per_hour=1, burst=2)
+    for error_type in ("KeyError", "KeyError", "ValueError", "TypeError", "OSError"):
+        assert dispatcher.submit(error_type, 3)
+    time.sleep(0.2)
+    # داخل النافذة: ما انرسل شي
+    assert transport.sent == []
+
+    dispatcher.close()
+    sent = [error_type for _, error_type in transport.sent]
+    print("\n🔍 Alerts sent at shutdown:", sent, "left:", list(dispatcher.pending))
+    assert len(sent) == 2 and len(set(sent)) == 2
+    assert len(dispatcher.pending) == 2
+
+
+def test_alert_close_while_sending():
+    """close() does not deliver from a second thread while the worker is still sending."""
+    transport = RecordingTransport(hold=True)
+    dispatcher = AlertDispatcher(transport, window_seconds=0, rate_per_hour=3600, burst=5)
+    dispatcher.submit("KeyError", 3)
+    assert transport.sending.wait(5)
+    dispatcher.submit("ValueError", 3)
+
+    dispatcher.close(timeout=0.2)
+    transport.release.set()
+    dispatcher._thread.join(5)
+    print("\n🔍 Alerts sent:", transport.sent)
+    assert [error_type for _, error_type in transport.sent][:1] == ["KeyError"]
+    assert all(name == "callhelper-alerts" for name, _ in transport.sent)
+    assert len(transport.sent) == len({error_type for _, error_type in transport.sent})
+
+
+def test_metrics_registry():
+    """Prometheus exposition, and totals of exited workers kept in the shared directory."""
+    registry = Registry(directory="")
+    requests = Counter("test_requests_total", "Requests.", ["endpoint"], registry=registry)
+    sessions = Gauge("test_sessions", "Open sessions.", registry=registry)
+    latency = Histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=registry)
+    requests.labels("api_resolve").inc()
+    requests.labels(endpoint="api_resolve").inc(2)
+    sessions.set(5)
+    sessions.dec()
+    for seconds in (0.05, 0.5, 3):
+        latency.observe(seconds)
+
+    text = registry.render()
+    print("\n🔍 Exposition:\n" + text)
+    for line in (
+        "# TYPE test_requests_total counter",
+        'test_requests_total{endpoint="api_resolve"} 3',
+        "test_sessions 4",
+        'test_latency_seconds_bucket{le="0.1"} 1',
+        'test_latency_seconds_bucket{le="1"} 2',
+        'test_latency_seconds_bucket{le="+Inf"} 3',
+        "test_latency_seconds_sum 3.55",
+        "test_latency_seconds_count 3",
+    ):
+        assert line in text.splitlines(), line
+    for bad in (lambda: requests.labels("a", "b"), lambda: requests.labels("a").inc(-1),
+                lambda: Counter("test_sessions", "Duplicate.", registry=registry)):
+        try:
+            bad()
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("accepted")
+
+    with tempfile.TemporaryDirectory() as metrics_dir:
+        registry.directory = metrics_dir
+        # ملف عامل انتهى (pid مو موجود): العداد ينضاف للأرشيف والـ gauge يروح
+        exited = {"pid": 999999999, "started": "1", "metrics": json.loads(json.dumps(registry.snapshot()))}
+        with open(os.path.join(metrics_dir, "metrics-999999999-1.json"), "w", encoding="utf-8") as f:
+            json.dump(exited, f)
+
+        text = registry.render()
+        assert 'test_requests_total{endpoint="api_resolve"} 6' in text.splitlines()
+        assert "test_sessions 4" in text.splitlines()
+        assert 'test_latency_seconds_bucket{le="+Inf"} 6' in text.splitlines()
+        assert not os.path.exists(os.path.join(metrics_dir, "metrics-999999999-1.json"))
+        assert os.path.exists(os.path.join(metrics_dir, "archive.json"))
+        # المجموع ما يرجع لورا بعد ما انحذف ملف العامل
+        requests.labels("api_resolve").inc()
+        assert 'test_requests_total{endpoint="api_resolve"} 7' in registry.render().splitlines()
+
+
+def test_mongo_indexes():
+    """Indexes are created idempotently, failures are reported, and COLLSCAN plans are spotted."""
+    results = mongo_indexes.ensure_indexes()
+    assert all(result["ok"] for result in results)
+    assert mongo_indexes.ensure_indexes() == results
+    cases = mongo_indexes.get_collection()
+    assert {"CaseID_unique", "Category_CaseID"} <= set(cases.index_information())
+
+    def duplicate_ids(keys, **options):
+        raise OperationFailure("E11000 duplicate key error")
+
+    cases.create_index = duplicate_ids
+    try:
+        failed = [r for r in mongo_indexes.ensure_indexes() if not r["ok"]]
+    finally:
+        del cases.create_index
+    print("\n🔍 Failed indexes:", [r["index"] for r in failed])
+    assert len(failed) == len(mongo_indexes.CASE_INDEXES) and "E11000" in failed[0]["error"]
+
+    # find() كلاسيكي، SBE (queryPlan)، وaggregate فيه winningPlan داخل stages
+    classic = {"queryPlanner": {"winningPlan": {"stage": "LIMIT", "inputStage": {
+        "stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}}}
+    sbe = {"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "OR", "inputStages": [
+        {"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]}}}}
+    aggregate = {"stages": [{"$cursor": classic}, {"$group": {}}]}
+    assert mongo_indexes._plan_stages(classic) == ["LIMIT", "FETCH", "IXSCAN"]
+    assert mongo_indexes._plan_stages(sbe) == ["OR", "IXSCAN", "COLLSCAN"]
+    assert mongo_indexes._plan_stages(aggregate) == ["LIMIT", "FETCH", "IXSCAN"]
+
+    # الاستعلام اللي يفشل explain حقه ينحسب خطأ، ما يوقف التقرير
+    report = mongo_indexes.check_query_plans()
+    assert report and all("error" in entry or entry["collscan"] is not None for entry in report)
+
+
+def test_archive_timeseries():
+    """Old days are archived once; an unsupported server or failed delete leaves no file."""
+    logs = memory_db("test_archive")["interaction_logs_ts"]
+    today = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+    for days_ago in (0, 100, 100, 120):
+        at = today - timedelta(days=days_ago)
+        logs.insert_one({"timestamp": at, "date": at.strftime("%Y-%m-%d"), "hour": at.hour,
+                         "user_type": "شركة عمرة", "query": "عمرة", "success": True})
+
+    saved = log_archive.LOG_STORAGE, log_archive.logs_collection, log_archive._server_version, log_archive._delete_day
+    log_archive.LOG_STORAGE, log_archive.logs_collection = "timeseries", logs
+    try:
+        with tempfile.TemporaryDirectory() as out_dir:
+            log_archive._server_version = lambda collection: (6, 0)
+            try:
+                log_archive.archive_expired_days(90, out_dir)
+            except RuntimeError as e:
+                print("\n🔍 MongoDB 6.0:", e)
+            else:
+                raise AssertionError("archived on MongoDB 6.0")
+            assert os.listdir(out_dir) == [] and logs.count_documents({}) == 4
+
+            log_archive._server_version = saved[2]
+
+            def failing_delete(source, day):
+                raise ConnectionError("server went away")
+            log_archive._delete_day = failing_delete
+            try:
+                log_archive.archive_expired_days(90, out_dir)
+            except ConnectionError:
+                pass
+            assert os.listdir(out_dir) == [] and logs.count_documents({}) == 4
+
+            log_archive._delete_day = saved[3]
+            written = log_archive.archive_expired_days(90, out_dir)
+            print("🔍 Archived:", [os.path.basename(p) for p in written])
+            assert len(written) == 2 and logs.count_documents({}) == 1
+            with gzip.open(written[1], "rt", encoding="utf-8") as f:
+                assert len(f.readlines()) == 2
+            assert log_archive.archive_expired_days(90, out_dir) == []
+    finally:
+        (log_archive.LOG_STORAGE, log_archive.logs_collection,
+         log_archive._server_version, log_archive._delete_day) = saved
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ {name}: {e!r}")
+            import traceback
+            traceback.print_exc()
+        else:
+            print(f"✅ {name}")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test the benchmark tools: synthetic corpora, the matching benchmark, the
+load-test harness and traffic replay.
+
+Runs against the in-memory Mongo stand-in (benchmarks/memory_mongo.py),
+so no MongoDB is needed:
+
+    python test_benchmarks.py
+"""
+
+import os
+import gzip
+import json
+import argparse
+import tempfile
+import threading
+
+from benchmarks.memory_mongo import install
+
+# لازم قبل ما نستورد agent
+install()
+os.environ.setdefault("CALLHELPER_ENSURE_INDEXES", "0")
+os.environ.setdefault("CALLHELPER_ASYNC_MONGO", "0")
+os.environ.setdefault("CALLHELPER_BENCH_CASES", "300")
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from agent import case_io  # noqa: E402
+from benchmarks import bench_matching, load_test, replay  # noqa: E402
+from benchmarks.corpus import generate_cases, generate_queries, min_vocabulary  # noqa: E402
+
+
+def test_corpus():
+    """Catalogs and workloads are deterministic, valid, and reject a too-small vocabulary."""
+    cases = generate_cases(200, vocabulary_size=300, seed=5)
+    assert cases == generate_cases(200, vocabulary_size=300, seed=5)
+    assert cases != generate_cases(200, vocabulary_size=300, seed=6)
+    for case in cases:
+        keywords = case["MainKeywords"] + case["ExtraKeywords"] + case["NegativeKeywords"]
+        assert len(keywords) == len(set(keywords)), case["CaseID"]
+        assert 2 <= len(case["MainKeywords"]) <= 5 and len(case["ExtraKeywords"]) <= 4
+        assert case_io.synonym_errors(case) is None, case["CaseID"]
+
+    queries = generate_queries(cases, 500, miss_rate=0.2, seed=1)
+    assert queries == generate_queries(cases, 500, miss_rate=0.2, seed=1)
+    misses = [query for query, case_id in queries if case_id is None]
+    print(f"\n🔍 Corpus: {len(cases)} cases, {len(queries)} queries, {len(misses)} misses")
+    assert 50 <= len(misses) <= 150
+    assert {case_id for _, case_id in queries} <= {case["CaseID"] for case in cases} | {None}
+
+    # أصغر مفردات ممكنة تكفي، والأصغر منها خطأ واضح بدل حلقة ما تنتهي
+    assert min_vocabulary() == 12 and min_vocabulary((2, 10), (0, 6)) == 17
+    generate_cases(20, vocabulary_size=min_vocabulary(), seed=1)
+    try:
+        generate_cases(20, vocabulary_size=min_vocabulary() - 1)
+    except ValueError as e:
+        print("🔍", e)
+    else:
+        raise AssertionError("small vocabulary accepted")
+
+
+def test_bench_matching():
+    """Every mode runs end to end, and slower results than the baseline are reported."""
+    results = bench_matching.run_benchmarks(
+        sizes=[100], modes=list(bench_matching.MODES), query_count=100, vocabulary=300,
+        zipf=1.1, typo_rate=0.0, miss_rate=0.0, seed=3)
+    assert set(results) == {f"{mode}@100" for mode in bench_matching.MODES}
+    for key, result in results.items():
+        assert result["p50_ms"] <= result["p99_ms"] <= result["max_ms"], key
+        assert result["qps"] > 0 and result["peak_mb"] >= 0, key
+    assert results["keywords@100"]["hit_at_1"] >= 0.5
+    assert results["suggest@100"]["hit_at_1"] == 0.0
+
+    baseline = {"keywords@100": dict(results["keywords@100"])}
+    assert bench_matching.compare(results, baseline, tolerance=0.25) == []
+    slower = {"keywords@100": {**results["keywords@100"],
+                               "p99_ms": results["keywords@100"]["p99_ms"] * 2 + 1,
+                               "hit_at_1": results["keywords@100"]["hit_at_1"] - 0.1}}
+    regressions = bench_matching.compare(slower, baseline, tolerance=0.25)
+    print("\n🔍 Regressions:", regressions)
+    assert [r.split(":")[0] for r in regressions] == ["keywords@100 p99_ms", "keywords@100 hit_at_1"]
+
+
+def test_load_test():
+    """An open-loop run against the app sends every scheduled request and keeps chat sessions."""
+    # يولّد الكتالوج وقت الاستيراد، فما نستورده إلا هنا
+    from benchmarks import memory_app
+    memory_app.seed_catalog()
+    cases = generate_cases(memory_app.BENCH_CASES, seed=memory_app.BENCH_SEED)
+    queries = [query for query, _ in generate_queries(cases, 200, seed=memory_app.BENCH_SEED + 1)]
+
+    server = make_server("127.0.0.1", 0, memory_app.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        test = load_test.LoadTest(
+            f"http://127.0.0.1:{server.server_port}", rate=60, duration=1, concurrency=4,
+            mix=load_test.parse_mix("resolve=3,chat=2,analytics=1"), queries=queries,
+            chat_users=3, timeout=10, seed=7)
+        result = test.run()
+    finally:
+        server.shutdown()
+        thread.join(5)
+
+    load_test.print_report(result)
+    assert result["requests"] == 60 and result["dropped"] == 0
+    assert result["errors"] == 0, {e: r["error_kinds"] for e, r in result["endpoints"].items()}
+    assert {"/api/resolve", "/api/chat"} <= set(result["endpoints"])
+    assert any(path in result["endpoints"] for path in load_test.ANALYTICS_PATHS)
+    # كل محادثة تكمل بالجلسة اللي رجعها السيرفر
+    assert all(user.session_id for user in test.users)
+
+    stats = load_test.Stats()
+    for ms in range(1, 101):
+        stats.record("/x", ms, ms / 2, "HTTP 500" if ms % 10 == 0 else None)
+    report = stats.report(elapsed_s=2)["/x"]
+    assert (report["requests"], report["rps"], report["errors"], report["p50_ms"], report["p99_ms"]) == (100, 50, 10, 51, 100)
+    try:
+        load_test.parse_mix("resolve=1,upload=1")
+    except argparse.ArgumentTypeError as e:
+        assert "upload" in str(e)
+    else:
+        raise AssertionError("unknown traffic kind accepted")
+
+
+def test_replay():
+    """Logged resolve queries are re-run against a catalog file and the differences reported."""
+    catalog = [
+        {"CaseID": "RP-001", "UserType": "شركة عمرة", "MainKeywords": ["تفعيل", "حساب"], "ExtraKeywords": [],
+         "NegativeKeywords": [], "Synonyms": [], "Category": "تفعيل الحساب", "ResponseText": "فعّل الحساب"},
+        {"CaseID": "RP-002", "UserType": "شركة عمرة", "MainKeywords": ["فاتورة"], "ExtraKeywords": [],
+         "NegativeKeywords": [], "Synonyms": [], "Category": "المدفوعات", "ResponseText": "ادفع الفاتورة"},
+    ]
+
+    def event(query, case_id, date="2026-10-01", **extra):
+        return {"interaction_type": "resolve", "user_type": "شركة عمرة", "query": query,
+                "matched_case_id": case_id, "date": date, **extra}
+
+    events = [
+        event("تفعيل حساب", "RP-001"),                          # unchanged
+        event("فاتورة", "OLD-009"),                             # changed
+        event("مشكلة تفعيل", None),                             # newly matched
+        event("zzzz", "RP-002"),                                # unmatched
+        event("تفعيل", "RP-001", interaction_type="chat"),       # مو resolve
+        event("unknown", None),
+        event("فاتورة", "RP-002", date="2026-09-01"),           # قبل --since
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        catalog_path = os.path.join(tmp, "cases.json")
+        with open(catalog_path, "w", encoding="utf-8") as f:
+            json.dump(catalog, f, ensure_ascii=False)
+        logs_path = os.path.join(tmp, "interaction_logs-2026-10-01.jsonl.gz")
+        with gzip.open(logs_path, "wt", encoding="utf-8") as f:
+            for e in events:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+        diff_path, output_path = os.path.join(tmp, "diff.jsonl"), os.path.join(tmp, "report.json")
+
+        assert replay.main([os.path.join(tmp, "*.jsonl.gz"), "--catalog", catalog_path, "--since", "2026-10-01",
+                            "--workers", "2", "--chunk-size", "2", "--no-semantic",
+                            "--diff", diff_path, "--output", output_path]) == 0
+        with open(output_path, encoding="utf-8") as f:
+            report = json.load(f)
+        with open(diff_path, encoding="utf-8") as f:
+            diff = [json.loads(line) for line in f]
+
+    print("\n🔍 Replay:", report["outcomes"])
+    assert report["events"] == 4
+    assert report["outcomes"] == {"unchanged": 1, "changed": 1, "newly_matched": 1, "unmatched": 1}
+    assert report["changed_share"] == 0.75
+    assert sorted((d["query"], d["kind"], d["new_case"]) for d in diff) == [
+        ("zzzz", "unmatched", None), ("فاتورة", "changed", "RP-002"), ("مشكلة تفعيل", "newly_matched", "RP-001"),
+    ]
+    assert {"old_case": "OLD-009", "new_case": "RP-002", "count": 1} in report["top_transitions"]
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ {name}: {e!r}")
+            import traceback
+            traceback.print_exc()
+        else:
+            print(f"✅ {name}")
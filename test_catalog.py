@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test text normalization, case matching and the catalog tools.
+
+Runs against the in-memory Mongo stand-in (benchmarks/memory_mongo.py),
+so no MongoDB is needed:
+
+    python test_catalog.py
+"""
+
+import io
+import os
+import sys
+import importlib
+
+from benchmarks.memory_mongo import install
+
+# لازم قبل ما نستورد agent
+install()
+os.environ.setdefault("CALLHELPER_ENSURE_INDEXES", "0")
+os.environ.setdefault("CALLHELPER_ASYNC_MONGO", "0")
+
+from agent.mongo_helper import get_collection, bump_catalog_version  # noqa: E402
+from agent.text_normalizer import normalize_text, normalize_query  # noqa: E402
+from agent.UmrahAgent import UmrahAgent  # noqa: E402
+from agent.fuzzy_index import TrigramIndex, bounded_edit_distance  # noqa: E402
+from agent.suggest_index import SuggestIndex  # noqa: E402
+from agent import case_io  # noqa: E402
+from agent.user_type_router import route_user_type  # noqa: E402
+import Logic  # noqa: E402
+
+
+def make_case(case_id, user_type, main, extra=(), synonyms=(), negative=()):
+    return {
+        "CaseID": case_id,
+        "UserType": user_type,
+        "AccountStatus": "",
+        "Category": "اختبار",
+        "SubCategory": "",
+        "MainKeywords": list(main),
+        "ExtraKeywords": list(extra),
+        "Synonyms": list(synonyms),
+        "NegativeKeywords": list(negative),
+        "Priorty": "1",
+        "ResponseText": f"رد {case_id}",
+        "Why": "",
+        "FallbackText": "",
+        "Notes": "",
+    }
+
+
+def seed(cases):
+    collection = get_collection()
+    collection.delete_many({})
+    collection.insert_many([dict(case) for case in cases])
+    bump_catalog_version(collection)
+    return collection
+
+
+def case_ids(matches):
+    return [m.get("CaseID") for m in matches]
+
+
+def test_normalization():
+    """Spelling variants of a keyword match the same case."""
+    seed([make_case("NORM-001", "شركة عمرة", ["عمرة", "إلغاء"])])
+    agent = UmrahAgent()
+
+    print("\n🔍 Normalization")
+    assert normalize_text("عمرة") == normalize_text("عمره") == normalize_text("عُمْرَة") == normalize_text("عمـــرة")
+    assert normalize_text("أإآا") == "اااا"
+    assert normalize_text("مستشفى") == normalize_text("مستشفي")
+    assert normalize_text("تفعيل، الحساب؟") == "تفعيل الحساب"
+    assert normalize_query("  تفعيل   الحساب ") == ("تفعيل الحساب", ("تفعيل", "الحساب"))
+    assert normalize_query("تفعيل الحساب") is normalize_query("تفعيل الحساب")
+
+    for query in ("عمرة", "عمره", "عُمْرَة", "عمـــرة", "الغاء", "آلغاء"):
+        matches = agent.find_all_matches(query)
+        print(f"  {query}: {case_ids(matches)}")
+        assert case_ids(matches) == ["NORM-001"], query
+
+
+def test_synonym_scoring():
+    """A grouped synonym scores exactly as its keyword; a plain one as an extra keyword."""
+    seed([
+        make_case("SYN-001", "شركة عمرة", ["تفعيل", "حساب"],
+                  synonyms=["تفعيل=تنشيط|تشغيل", "حساب=اكاونت", "مفعل"]),
+        # بدون مجموعات: ولا مرادف يرتبط بكلمة ما تخصه
+        make_case("SYN-002", "شركة عمرة", ["تسجيل", "دخول"], synonyms=["لوقن", "تسجيل", "دخول", "login"]),
+    ])
+    agent = UmrahAgent()
+
+    def scored(query, case_id):
+        match = next(m for m in agent.find_all_matches(query) if m["CaseID"] == case_id)
+        print(f"  {query}: score {match['MatchScore']}, ratio {match['MatchRatio']:.0%}")
+        return match["MatchScore"], match["MatchRatio"]
+
+    print("\n🔍 Synonym groups")
+    activate = scored("تفعيل", "SYN-001")
+    assert activate == (2, 0.5)
+    assert scored("تنشيط", "SYN-001") == scored("تشغيل", "SYN-001") == activate
+    assert scored("اكاونت", "SYN-001") == scored("حساب", "SYN-001")
+    # مرادف + كلمته ما ينحسبون مرتين
+    assert scored("تنشيط تفعيل", "SYN-001") == activate
+    assert scored("تنشيط اكاونت", "SYN-001") == (4, 1.0)
+    assert scored("مفعل", "SYN-001") == (1, 0)
+
+    print("\n🔍 Plain synonyms")
+    assert scored("لوقن", "SYN-002") == scored("login", "SYN-002") == (1, 0)
+    assert scored("لوقن تسجيل", "SYN-002") == (3, 0.5)
+
+    # التحقق وقت الحفظ/الاستيراد
+    assert case_io.parse_synonyms("تفعيل = تنشيط | تشغيل ,مفعل") == ["تفعيل=تنشيط|تشغيل", "مفعل"]
+    assert case_io.synonym_errors({"MainKeywords": ["تفعيل"], "Synonyms": ["تفعيل=تنشيط"]}) is None
+    assert case_io.synonym_errors({"MainKeywords": ["حساب"], "Synonyms": ["تفعيل=تنشيط"]})
+    assert case_io.synonym_errors({"MainKeywords": ["تفعيل"], "Synonyms": ["تفعيل="]})
+
+
+def test_bm25_ranking():
+    """bm25 orders the same candidates as keyword scoring, never more or fewer."""
+    cases = [
+        make_case("BM-001", "شركة عمرة", ["تفعيل", "حساب"]),
+        make_case("BM-002", "شركة عمرة", ["حسابات", "مالية"]),
+        make_case("BM-003", "شركة عمرة", ["تفعيل"], negative=["مالية"]),
+        make_case("BM-004", "شركة عمرة", ["تذكرة"]),
+    ]
+    cases[3]["ResponseText"] = "تفعيل الحساب في البوابة"
+    seed(cases)
+    agent = UmrahAgent()
+
+    print("\n🔍 keywords vs bm25")
+    for query in ("تفعيل", "حسابي", "تفعيلات", "تفعيل حساب", "في", "البوابة", "حساب مالية"):
+        keywords = agent.find_all_matches(query, limit=10, ranking="keywords")
+        bm25 = agent.find_all_matches(query, limit=10, ranking="bm25")
+        print(f"  {query}: {case_ids(keywords)} / {case_ids(bm25)}")
+        assert sorted(case_ids(keywords)) == sorted(case_ids(bm25)), query
+        assert "BM-004" not in case_ids(bm25), query
+
+    # المطابقة الدقيقة قبل المطابقة بالبادئة
+    assert case_ids(agent.find_all_matches("حساب", ranking="bm25"))[0] == "BM-001"
+    try:
+        agent.find_all_matches("تفعيل", ranking="other")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unknown ranking accepted")
+
+
+def test_fuzzy_tier():
+    """A one-letter typo matches only with the fuzzy tier; short words and negatives never do."""
+    assert bounded_edit_distance("تفعيل", "تفعيل", 1) == 0
+    assert bounded_edit_distance("تفعيل", "تفعل", 1) == 1
+    assert bounded_edit_distance("تفعيل", "تسجيل", 1) == 2
+    trigrams = TrigramIndex(["تفعيل", "تسجيل", "حجز", "كلمة مرور"])
+    assert trigrams.lookup("تفغيل") == ("تفعيل",)
+    assert trigrams.lookup("حجر") == ()
+    assert trigrams.lookup("كلمة مرو") == ()
+
+    seed([
+        make_case("FZ-001", "شركة عمرة", ["تفعيل", "حساب"]),
+        make_case("FZ-002", "شركة عمرة", ["تذكرة"], negative=["مرفوض"]),
+    ])
+    agent = UmrahAgent()
+
+    print("\n🔍 Fuzzy tier")
+    for query, expected in (("تفغيل", ["FZ-001"]), ("ضذكرة", ["FZ-002"])):
+        assert case_ids(agent.find_all_matches(query, tiers=("fuzzy",))) == expected, query
+        assert agent.find_all_matches(query, tiers=()) == [], query
+    match = agent.find_all_matches("تفغيل", tiers=("fuzzy",))[0]
+    assert (match["MatchScore"], match["MatchRatio"]) == (2, 0.5)
+    # الكلمات السالبة ما تنطابق بالخطأ الإملائي، بس الصحيحة تستبعد
+    assert case_ids(agent.find_all_matches("تذكرة مرفوص", tiers=("fuzzy",))) == ["FZ-002"]
+    assert agent.find_all_matches("تذكرة مرفوض", tiers=("fuzzy",)) == []
+
+
+def test_semantic_fallback():
+    """With no keyword hit, the nearest case by category/response text is returned."""
+    cases = [
+        make_case("SEM-001", "شركة عمرة", ["تذكرة"]),
+        make_case("SEM-002", "شركة عمرة", ["فاتورة"], negative=["استرجاع"]),
+    ]
+    cases[0].update(Category="تسجيل الدخول", ResponseText="أعد تعيين كلمة المرور من صفحة الدخول")
+    cases[1].update(Category="المدفوعات", ResponseText="استرداد المبالغ المدفوعة خلال أسبوع")
+    seed(cases)
+    agent = UmrahAgent()
+
+    print("\n🔍 Semantic fallback")
+    assert agent.find_all_matches("نسيت كلمه المرور") == []
+    case, message = agent.find_semantic_row("نسيت كلمه المرور")
+    print(f"  {case['CaseID']}: {case['MatchScore']}")
+    assert case["CaseID"] == "SEM-001" and case["MatchType"] == "semantic"
+    assert message == agent.message("semantic") and 0 < case["MatchScore"] <= 1
+    assert agent.find_semantic_row("استرداد المبالغ")[0]["CaseID"] == "SEM-002"
+    # الكلمات السالبة تستبعد حتى بالبحث الدلالي
+    assert agent.find_semantic_row("استرجاع استرداد المبالغ")[0] is None
+    assert agent.find_semantic_row("zzzz qqqq") == (None, agent.message("no_match"))
+
+
+def test_suggest():
+    """Prefix, word-suffix and multi-word completion over keywords and categories."""
+    index = SuggestIndex([
+        {"CaseID": "A", "Category": "تسجيل الدخول", "MainKeywords": ["كلمة مرور", "تفعيل"]},
+        {"CaseID": "B", "Category": "مرور الحجاج", "MainKeywords": ["تصريح"], "Synonyms": ["إذن"]},
+        {"CaseID": "C", "Category": "تذاكر", "MainKeywords": ["تفعيل", "عمرة"]},
+    ])
+
+    def texts(query, **kwargs):
+        result = [s["text"] for s in index.suggest(query, **kwargs)]
+        print(f"  {query}: {result}")
+        return result
+
+    print("\n🔍 Suggestions")
+    assert texts("كلمة م")[0] == "كلمة مرور"
+    # الكلمة الثانية من المصطلح، وبداية المصطلح أولى
+    assert texts("مرور") == ["مرور الحجاج", "كلمة مرور"]
+    assert texts("الدخ") == ["تسجيل الدخول"]
+    assert texts("عمره") == ["عمرة"]
+    assert texts("اذ") == ["إذن"] and index.suggest("اذ")[0]["type"] == "synonym"
+    assert texts("تف") == ["تفعيل"] and index.suggest("تف")[0]["cases"] == 2
+    assert texts("غير موجود") == []
+
+    # تكملة آخر الكلمات: أطول ذيل أول، و"query" فيها الكلمات اللي قبله
+    suggestions = index.suggest("نسيت كلمة مر")
+    assert [s["query"] for s in suggestions] == ["نسيت كلمة مرور", "نسيت كلمة مرور الحجاج"]
+    assert index.suggest("مشكلة تص")[0]["query"] == "مشكلة تصريح"
+
+    # الأكثر مطابقة بالسجلات أول
+    assert texts("ت", popularity={"C": 5}) == ["تفعيل", "تذاكر", "تصريح", "تسجيل الدخول"]
+    assert texts("ت", popularity={"B": 5})[0] == "تصريح"
+    assert len(texts("ت", limit=2)) == 2
+
+
+def test_route_user_type():
+    """Aliases route in priority order, in Arabic and English, with spelling variants."""
+    print("\n🔍 Routing")
+    for user_type, expected in (
+        ("شركة عمرة", "umrah"), ("شركه عمره", "umrah"), ("وكيل خارجي", "umrah"), ("Umrah Company", "umrah"),
+        ("حج خارجي", "hajj_ex"), ("حجاج الخارج", "hajj_ex"), ("Hajj External", "hajj_ex"),
+        ("حج داخلي", "hajj_lo"), ("حجاج الداخل", "hajj_lo"), ("hajj domestic", "hajj_lo"),
+        ("حج", None), ("hajj", None), ("مقدم خدمة", None), ("", None), (None, None),
+    ):
+        assert route_user_type(user_type) == expected, user_type
+    assert Logic.get_agent_for_user("حج خارجي").__class__.__name__ == "HajjExAgent"
+    assert Logic.get_agent_for_user("مقدم خدمة") is None
+
+
+def test_import_export():
+    """Export then import (CSV and JSON lines) restores the catalog; invalid rows are reported."""
+    cases = [
+        make_case("IO-001", "شركة عمرة", ["تفعيل", "حساب"], extra=["معلق"],
+                  synonyms=["تفعيل=تنشيط|تشغيل", "مفعل"], negative=["مالية"]),
+        make_case("IO-002", "حج خارجي", ["تصريح"]),
+    ]
+    cases[0]["ResponseText"] = 'رد فيه "اقتباس"، وفاصلة\nوسطر ثاني'
+    collection = seed(cases)
+
+    def snapshot():
+        return [{k: v for k, v in doc.items() if k not in ("_id", "LastUpdated")}
+                for doc in collection.find({}, sort=[("CaseID", 1)])]
+
+    before = snapshot()
+    for fmt in case_io.FORMATS:
+        exported = "".join(case_io.export_cases(fmt))
+        collection.delete_many({})
+        report = case_io.import_file(io.BytesIO(exported.encode("utf-8")), fmt, chunk_size=1)
+        print(f"\n🔍 {fmt}: {report}")
+        assert (report["valid"], report["invalid"], report["inserted"], report["aborted"]) == (2, 0, 2, None)
+        assert snapshot() == before, fmt
+
+    rows = "\n".join([
+        '{"CaseID": "IO-001", "UserType": "شركة عمرة", "Category": "اختبار", "MainKeywords": "تفعيل, حساب", '
+        '"ResponseText": "رد جديد"}',
+        '{"CaseID": "IO-003", "UserType": "شركة عمرة", "Category": "اختبار", "MainKeywords": "تذكرة, حجز", '
+        '"ResponseText": "رد", "Synonyms": "تذكره=تكت, حجز=بوكنق"}',
+        '{"CaseID": "IO-004", "UserType": "شركة عمرة", "Category": "اختبار", "MainKeywords": ["تذكرة"], '
+        '"ResponseText": "رد", "Synonyms": ["فاتورة=ايصال"]}',
+        '{"CaseID": "IO-005", "UserType": "شركة عمرة"}',
+        "{مو json",
+    ])
+    dry = case_io.import_file(io.StringIO(rows), "jsonl", dry_run=True)
+    assert (dry["valid"], dry["invalid"], dry["inserted"], dry["version"]) == (2, 3, 0, None)
+    assert snapshot() == before
+
+    report = case_io.import_file(io.StringIO(rows), "jsonl")
+    errors = {error["line"]: error["error"] for error in report["errors"]}
+    print("🔍 Import errors:", errors)
+    assert (report["inserted"], report["updated"]) == (1, 1)
+    assert sorted(errors) == [3, 4, 5] and "فاتورة" in errors[3] and "missing" in errors[4]
+    updated = collection.find_one({"CaseID": "IO-001"})
+    # الأعمدة اللي مو في الملف تبقى مثل ما هي
+    assert updated["ResponseText"] == "رد جديد" and updated["ExtraKeywords"] == ["معلق"]
+    assert updated["Synonyms"] == ["تفعيل=تنشيط|تشغيل", "مفعل"]
+    assert collection.find_one({"CaseID": "IO-003"})["Synonyms"] == ["تذكره=تكت", "حجز=بوكنق"]
+    assert case_ids(UmrahAgent().find_all_matches("بوكنق")) == ["IO-003"]
+
+    # Excel بفاصلة منقوطة، وعلامات تنصيص داخل الحقل
+    semicolons = '\ufeffCaseID;UserType;Category;MainKeywords;ResponseText\r\nIO-006;شركة عمرة;اختبار;"تذكرة, حجز";"رد ""مقتبس"""\r\n'
+    assert case_io.import_file(io.BytesIO(semicolons.encode("utf-8")), "csv")["inserted"] == 1
+    imported = collection.find_one({"CaseID": "IO-006"})
+    assert imported["MainKeywords"] == ["تذكرة", "حجز"] and imported["ResponseText"] == 'رد "مقتبس"'
+
+
+def test_partition_routing():
+    """Every stored UserType is served by exactly one agent, the one it routes to."""
+    seed([
+        make_case("UMR-001", "شركة عمرة", ["تذكرة"]),
+        make_case("EXT-001", "external", ["رابط"]),
+        make_case("EXT-002", "خارجي", ["بوابة"]),
+        make_case("SP-001", "مقدم خدمة", ["فاتورة"]),
+        make_case("OLD-001", "", ["قديم"]),
+        make_case("HEX-001", "حج خارجي", ["تصريح"]),
+        make_case("HLO-001", "حجاج الداخل", ["مخيم"]),
+    ])
+
+    print("\n🔍 Partitions")
+    for case in get_collection().find({}):
+        owners = [key for key, agent_class in Logic.AGENTS.items() if agent_class.owns_case(case)]
+        route = route_user_type(case["UserType"])
+        print(f"  {case['CaseID']} ({case['UserType'] or '-'}): route {route}, owners {owners}")
+        # اللي ما له إيجنت يروح لـ UmrahAgent
+        assert owners == [route or "umrah"], case["CaseID"]
+        agent = Logic.AGENTS[owners[0]]()
+        assert case["CaseID"] in case_ids(agent.find_all_matches(case["MainKeywords"][0])), case["CaseID"]
+        assert len([a for a in Logic.AGENTS.values() if a().find_all_matches(case["MainKeywords"][0])]) == 1
+
+
+def test_agent_reconnects():
+    """An agent created while MongoDB was unreachable is not cached."""
+    catalog_agent = sys.modules["agent.CatalogAgent"]
+    working = catalog_agent.get_collection
+
+    def unreachable(*args, **kwargs):
+        raise ConnectionError("MongoDB is down")
+
+    seed([make_case("UMR-001", "شركة عمرة", ["تذكرة"])])
+    Logic._agent_instances.clear()
+    catalog_agent.get_collection = unreachable
+    try:
+        agent = Logic.get_agent_for_user("شركة عمرة")
+        assert agent.collection is None and agent.find_all_matches("تذكرة") == []
+    finally:
+        catalog_agent.get_collection = working
+    agent = Logic.get_agent_for_user("شركة عمرة")
+    assert case_ids(agent.find_all_matches("تذكرة")) == ["UMR-001"]
+    assert Logic.get_agent_for_user("شركة عمرة") is agent
+
+
+def test_dedicated_hajj_collection():
+    """A Hajj agent on its own collection also serves the untagged cases in it."""
+    collection = get_collection("hajj_ex_cases")
+    collection.delete_many({})
+    collection.insert_many([
+        make_case("HEX-001", "حج خارجي", ["تصريح"]),
+        make_case("HEX-002", "", ["تأشيرة"]),
+        make_case("UMR-001", "شركة عمرة", ["تذكرة"]),
+    ])
+    bump_catalog_version(collection)
+
+    os.environ["MONGO_HAJJ_EX_COLLECTION"] = "hajj_ex_cases"
+    try:
+        module = importlib.reload(sys.modules["agent.HajjExAgent"])
+        agent = module.HajjExAgent()
+        print("\n🔍 Dedicated collection:", case_ids(agent.find_all_matches("تصريح تأشيرة تذكرة")))
+        assert sorted(case_ids(agent.find_all_matches("تصريح تأشيرة تذكرة"))) == ["HEX-001", "HEX-002"]
+    finally:
+        del os.environ["MONGO_HAJJ_EX_COLLECTION"]
+        module = importlib.reload(sys.modules["agent.HajjExAgent"])
+    assert not module.HajjExAgent.owns_unrouted_cases
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ {name}: {e!r}")
+            import traceback
+            traceback.print_exc()
+        else:
+            print(f"✅ {name}")
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test the HTTP side: stage timing, profiling, the admin list, cached
+responses, compression and the asyncio server.
+
+Runs against the in-memory Mongo stand-in (benchmarks/memory_mongo.py),
+so no MongoDB is needed:
+
+    python test_server.py
+"""
+
+import os
+import json
+import gzip
+import zlib
+import time
+import asyncio
+
+from benchmarks.memory_mongo import install
+
+# لازم قبل ما نستورد app
+install()
+os.environ.setdefault("CALLHELPER_ENSURE_INDEXES", "0")
+os.environ.setdefault("CALLHELPER_ASYNC_MONGO", "0")
+
+import app as flask_app_module  # noqa: E402
+import asgi  # noqa: E402
+from agent.stage_timer import (  # noqa: E402
+    StageTimer, StageHistograms, start_timer, stop_timer, current_timer, SCORE, RENDER
+)
+from agent.http_cache import choose_encoding, etag_matches, make_etag, version_cache  # noqa: E402
+from agent.mongo_helper import get_collection, bump_catalog_version, list_cases  # noqa: E402
+from agent.request_profiler import request_profiler, PROFILE_HEADER  # noqa: E402
+from seed_database import seed_database  # noqa: E402
+
+flask_app = flask_app_module.app
+
+
+def resolve(client, headers=None, **payload):
+    payload.setdefault("user_type", "شركة عمرة")
+    return client.post("/api/resolve", json=payload, headers=headers)
+
+
+def asgi_request(method, path, body=b"", query_string=b"", chunk_size=None):
+    """Run one request through the ASGI app. Returns (status, headers dict, body)."""
+    scope = {
+        "type": "http", "method": method, "path": path, "root_path": "", "query_string": query_string,
+        "http_version": "1.1", "scheme": "http", "server": ("127.0.0.1", 8000), "client": ("127.0.0.1", 5555),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    }
+    step = chunk_size or max(1, len(body))
+    chunks = [body[i:i + step] for i in range(0, len(body), step)] or [b""]
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in sent[0]["headers"]}
+    return sent[0]["status"], headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def test_stage_timer():
+    """Laps are charged to their stage, and finished requests land in the histograms."""
+    timer, token = start_timer("api_resolve")
+    try:
+        assert current_timer() is timer
+        time.sleep(0.002)
+        timer.lap(SCORE)
+        timer.lap(RENDER)
+    finally:
+        stop_timer(token)
+    assert current_timer() is not timer
+    # بدون مؤقت فعال: lap ما يسوي شي
+    current_timer().lap(SCORE)
+
+    assert timer.ns[SCORE] >= 2_000_000 and timer.total_ns() == sum(timer.ns)
+    header = timer.server_timing()
+    print("\n🔍 Server-Timing:", header)
+    assert header.startswith("score;dur=") and "render;dur=" in header and "total;dur=" in header
+
+    histograms = StageHistograms()
+    for _ in range(3):
+        histograms.record(timer)
+    score = histograms.snapshot()["api_resolve"]["score"]
+    assert score["count"] == 3 and sum(score["buckets"]) == 3
+    assert score["p50_ms"] >= 2 and score["p50_ms"] == score["p99_ms"]
+    assert "agent" not in histograms.snapshot()["api_resolve"]
+
+    seed_database()
+    client = flask_app.test_client()
+    before = flask_app_module.stage_histograms.snapshot().get("api_resolve", {}).get("total", {}).get("count", 0)
+    assert resolve(client, issue="تفعيل حساب").status_code == 200
+    assert "Server-Timing" not in resolve(client, issue="تفعيل حساب").headers
+    stages = client.get("/api/analytics/stages").get_json()["api_resolve"]
+    assert stages["total"]["count"] == before + 2
+    assert {"agent", "index", "score", "render"} <= set(stages)
+
+    flask_app_module.SERVER_TIMING = True
+    try:
+        assert "score;dur=" in resolve(client, issue="تفعيل حساب").headers["Server-Timing"]
+    finally:
+        flask_app_module.SERVER_TIMING = False
+    # المسارات اللي ما تنقاس ما لها مؤقت
+    assert client.get("/api/analytics/stages").headers.get("Server-Timing") is None
+
+
+def test_metrics_endpoint():
+    """/metrics exposes request, stage and index metrics in the Prometheus text format."""
+    seed_database()
+    client = flask_app.test_client()
+    assert resolve(client, issue="تفعيل حساب").status_code == 200
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.mimetype == "text/plain"
+    lines = response.get_data(as_text=True).splitlines()
+    print("\n🔍 /metrics:", len(lines), "lines")
+    assert "# TYPE callhelper_http_requests_total counter" in lines
+    assert any(line.startswith('callhelper_http_requests_total{endpoint="api_resolve",method="POST",status="200"}')
+               for line in lines)
+    assert any(line.startswith('callhelper_stage_duration_seconds_bucket{endpoint="api_resolve",stage="score"')
+               for line in lines)
+    assert any(line.startswith("callhelper_case_index_cases{") for line in lines)
+
+
+def test_request_profiler():
+    """Armed, sampled and token requests are profiled one at a time and reported per endpoint."""
+    seed_database()
+    client = flask_app.test_client()
+    assert client.delete("/admin/profiling").get_json()["profile_next"] == 0
+
+    settings = client.post("/admin/profiling", json={"profile_next": 2}).get_json()
+    assert settings["profile_next"] == 2 and settings["header"] is None
+    profiled = [resolve(client, issue="تفعيل حساب").headers.get("X-CallHelper-Profiled") for _ in range(3)]
+    # المسارات اللي مو بالقائمة ما تنحسب من العدد
+    assert client.get("/api/analytics/stages").headers.get("X-CallHelper-Profiled") is None
+    assert profiled == ["admin", "admin", None]
+
+    saved = request_profiler.token, request_profiler.sample_every
+    request_profiler.token = "secret"
+    try:
+        assert resolve(client, {PROFILE_HEADER: "wrong"}, issue="تفعيل حساب").headers.get("X-CallHelper-Profiled") is None
+        assert resolve(client, {PROFILE_HEADER: "secret"}, issue="تفعيل حساب").headers["X-CallHelper-Profiled"] == "header"
+        client.post("/admin/profiling", json={"sample_every": 2})
+        sampled = [resolve(client, issue="تفعيل حساب").headers.get("X-CallHelper-Profiled") for _ in range(4)]
+        assert sampled.count("sample") == 2
+    finally:
+        request_profiler.token = saved[0]
+        client.post("/admin/profiling", json={"sample_every": saved[1]})
+
+    report = client.get("/admin/profiling?endpoint=api_resolve&sort=tottime&limit=5").get_json()
+    resolve_report = report["endpoints"]["api_resolve"]
+    print("\n🔍 Profiled:", resolve_report["requests"], resolve_report["reasons"])
+    assert resolve_report["reasons"] == {"admin": 2, "header": 1, "sample": 2}
+    assert len(resolve_report["functions"]) == 5
+    tottimes = [f["tottime_ms"] for f in resolve_report["functions"]]
+    assert tottimes == sorted(tottimes, reverse=True)
+    cumulative = client.get("/admin/profiling?endpoint=api_resolve&limit=200").get_json()
+    assert any("resolve_issue" in f["function"] for f in cumulative["endpoints"]["api_resolve"]["functions"])
+    assert "function calls" in client.get("/admin/profiling?endpoint=api_resolve&format=text").get_data(as_text=True)
+
+    assert client.get("/admin/profiling?sort=bogus").status_code == 400
+    assert client.get("/admin/profiling?format=text").status_code == 400
+    client.delete("/admin/profiling")
+    assert client.get("/admin/profiling").get_json()["endpoints"] == {}
+
+    # بروفايل واحد بس في نفس الوقت
+    request_profiler.configure(profile_next=2)
+    first = request_profiler.start("api_resolve")
+    try:
+        assert first is not None and request_profiler.start("api_resolve") is None
+    finally:
+        request_profiler.stop(first)
+        request_profiler.configure(profile_next=0)
+        request_profiler.reset()
+
+
+def test_admin_pagination():
+    """Keyset pages walk the whole catalog both ways, with filters kept in the page links."""
+    collection = get_collection()
+    collection.delete_many({})
+    collection.insert_many([{
+        "CaseID": f"PG-{i:03d}", "UserType": "شركة عمرة", "Category": "المدفوعات" if i % 2 else "التذاكر",
+        "MainKeywords": ["فاتورة" if i % 3 == 0 else "تذكرة"], "ExtraKeywords": [], "Synonyms": [],
+        "ResponseText": f"رد {i}",
+    } for i in range(7)])
+    bump_catalog_version(collection)
+
+    pages, after = [], None
+    while True:
+        page = list_cases(after=after, limit=3)
+        pages.append([case["CaseID"] for case in page["cases"]])
+        assert page["total"] == 7 and "ResponseText" not in page["cases"][0]
+        after = page["next_after"]
+        if after is None:
+            break
+    print("\n🔍 Pages:", pages)
+    assert pages == [["PG-000", "PG-001", "PG-002"], ["PG-003", "PG-004", "PG-005"], ["PG-006"]]
+    assert list_cases(limit=3)["prev_before"] is None
+
+    back = list_cases(before="PG-006", limit=3)
+    assert [case["CaseID"] for case in back["cases"]] == ["PG-003", "PG-004", "PG-005"]
+    assert (back["next_after"], back["prev_before"]) == ("PG-005", "PG-003")
+    first = list_cases(before="PG-003", limit=3)
+    assert [case["CaseID"] for case in first["cases"]] == ["PG-000", "PG-001", "PG-002"]
+    assert first["prev_before"] is None
+
+    paid = list_cases(category="المدفوعات", limit=2)
+    assert [case["CaseID"] for case in paid["cases"]] == ["PG-001", "PG-003"] and paid["total"] == 3
+    assert [case["CaseID"] for case in list_cases(keyword=" فاتورة ", limit=5)["cases"]] == ["PG-000", "PG-003", "PG-006"]
+
+    client = flask_app.test_client()
+    html = client.get("/admin?category=المدفوعات&limit=2").get_data(as_text=True)
+    assert "PG-001" in html and "PG-005" not in html and "Showing 2 of 3 cases" in html
+    assert "/admin?after=PG-003&amp;category=" in html and "limit=2" in html
+    html = client.get("/admin?after=PG-003&category=المدفوعات&limit=2").get_data(as_text=True)
+    assert "PG-005" in html and "PG-001" not in html and "before=PG-005" in html and "after=" not in html
+
+
+def test_cached_resolve_fragments():
+    """Responses assembled from cached fragments are byte-identical to jsonify()."""
+    seed_database()
+    client = flask_app.test_client()
+    payloads = [
+        {"issue": "مشكلة تفعيل حساب شركة عمرة معلق"},
+        {"issue": "تفعيل", "get_alternatives": True},
+        {"issue": "تفعيل حساب", "ranking": "bm25", "name": "عميل \"مقتبس\""},
+        {"issue": "تعديل بيانات معلومات", "get_alternatives": True, "ranking": "bm25"},
+        # بدون تطابق بالكلمات: الرد من البحث الدلالي
+        {"issue": "رسالة التأكيد في البريد الإلكتروني"},
+    ]
+    cached = [resolve(client, **payload) for payload in payloads]
+    flask_app_module.RESPONSE_CACHE = False
+    try:
+        plain = [resolve(client, **payload) for payload in payloads]
+    finally:
+        flask_app_module.RESPONSE_CACHE = True
+
+    print("\n🔍 Match types:", [r.get_json()["match"]["match_type"] for r in cached])
+    assert "semantic" in [r.get_json()["match"]["match_type"] for r in cached]
+    for payload, a, b in zip(payloads, cached, plain):
+        assert a.get_json()["success"], payload
+        assert (a.status_code, a.mimetype, a.get_data()) == (b.status_code, b.mimetype, b.get_data()), payload
+
+    # حالة مو في الفهرس (الكتالوج تغيّر بين المطابقة والرد) تنبني عادي
+    agent = flask_app_module.get_agent_for_user("شركة عمرة")
+    index = agent.get_index()
+    row = dict(agent.find_all_matches("تفعيل")[0], _id="gone", ResponseText="نص جديد")
+    assert flask_app_module.response_cache.match_json(index, row) == flask_app.json.dumps(
+        flask_app_module.format_match(row), separators=(",", ":")).encode("utf-8")
+    # نفس الحالة ما تنشفّر مرتين
+    fragments = flask_app_module.response_cache._entry(index)["fragments"]
+    count = len(fragments)
+    resolve(client, issue="تفعيل", get_alternatives=True)
+    assert len(fragments) == count
+
+
+def test_compression_and_etags():
+    """Large bodies are compressed as negotiated; unchanged read views answer 304."""
+    assert choose_encoding("gzip, deflate, br") == "gzip"
+    assert choose_encoding("deflate;q=1, gzip;q=0.5") == "deflate"
+    assert choose_encoding("gzip;q=0, *;q=0.1") == "deflate"
+    assert choose_encoding("br") is None and choose_encoding("") is None
+    etag = make_etag("/admin?", "2026-10-19", (3, 7))
+    assert etag.startswith('W/"') and etag == make_etag("/admin?", "2026-10-19", (3, 7))
+    assert etag_matches(f'"x", {etag[2:]}', etag) and etag_matches("*", etag)
+    assert not etag_matches(make_etag("/admin?", "2026-10-19", (4, 7)), etag)
+
+    seed_database()
+    client = flask_app.test_client()
+    saved_ttl, version_cache.ttl = version_cache.ttl, 0
+    try:
+        plain = client.get("/admin")
+        assert plain.status_code == 200 and "Content-Encoding" not in plain.headers
+        assert "Accept-Encoding" in plain.headers["Vary"]
+        for encoding, decompress in (("gzip", gzip.decompress), ("deflate", zlib.decompress)):
+            compressed = client.get("/admin", headers={"Accept-Encoding": encoding})
+            assert compressed.headers["Content-Encoding"] == encoding
+            assert decompress(compressed.get_data()) == plain.get_data()
+            assert len(compressed.get_data()) < len(plain.get_data())
+        # الردود الصغيرة تروح بدون ضغط
+        small = resolve(client, {"Accept-Encoding": "gzip"}, issue="zz")
+        assert "Content-Encoding" not in small.headers
+
+        etag = plain.headers["ETag"]
+        print("\n🔍 /admin ETag:", etag)
+        not_modified = client.get("/admin", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304 and not_modified.get_data() == b""
+        assert not_modified.headers["ETag"] == etag
+        # صفحة ثانية أو فلتر ثاني له ETag ثاني
+        assert client.get("/admin?limit=2", headers={"If-None-Match": etag}).status_code == 200
+
+        bump_catalog_version(get_collection())
+        changed = client.get("/admin", headers={"If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["ETag"] != etag
+
+        stats = client.get("/api/analytics/stats")
+        assert client.get("/api/analytics/stats", headers={"If-None-Match": stats.headers["ETag"]}).status_code == 304
+        resolve(client, issue="تفعيل حساب")
+        assert client.get("/api/analytics/stats", headers={"If-None-Match": stats.headers["ETag"]}).status_code == 200
+    finally:
+        version_cache.ttl = saved_ttl
+
+
+def test_resolve_asgi():
+    """/api/resolve answers byte for byte the same under the asyncio server as under Flask."""
+    seed_database()
+    client = flask_app.test_client()
+    payloads = [
+        {"user_type": "شركة عمرة", "issue": "مشكلة تفعيل حساب شركة عمرة معلق", "name": "عميل"},
+        {"user_type": "شركة عمرة", "issue": "تفعيل", "get_alternatives": True},
+        {"user_type": "شركة عمرة", "issue": "تفعيل حساب", "ranking": "bm25"},
+        {"user_type": "شركة عمرة", "issue": "zzzz qqqq"},
+        {"user_type": "شركة عمرة", "issue": "تفعيل", "ranking": "other"},
+        {"user_type": "مقدم خدمة", "issue": "تفعيل"},
+        {"user_type": "", "issue": "تفعيل"},
+    ]
+    print("\n🔍 /api/resolve under ASGI")
+    for payload in payloads:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        expected = client.post("/api/resolve", data=body, content_type="application/json")
+        status, headers, data = asgi_request("POST", "/api/resolve", body, chunk_size=7)
+        print(f"  {status} {payload}")
+        assert status == expected.status_code, payload
+        assert headers["content-type"] == expected.headers["Content-Type"], payload
+        assert data == expected.get_data(), payload
+
+    # باقي المسارات تمر على Flask كما هي
+    expected = client.get("/api/suggest?q=%D8%AA%D9%81")
+    status, headers, data = asgi_request("GET", "/api/suggest", query_string=b"q=%D8%AA%D9%81")
+    assert (status, data) == (200, expected.get_data())
+
+    saved, asgi.MAX_BODY_BYTES = asgi.MAX_BODY_BYTES, 10
+    try:
+        status, _, data = asgi_request("POST", "/api/resolve", json.dumps(payloads[0]).encode("utf-8"))
+    finally:
+        asgi.MAX_BODY_BYTES = saved
+    assert status == 413 and json.loads(data)["success"] is False
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if not name.startswith("test_") or not callable(test):
+            continue
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ {name}: {e!r}")
+            import traceback
+            traceback.print_exc()
+        else:
+            print(f"✅ {name}")